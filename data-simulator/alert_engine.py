@@ -0,0 +1,193 @@
+"""
+Alert episode tracking for Health Monitoring
+Turns per-reading anomalies into opened / escalated / resolved alerts
+"""
+
+import datetime
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from detection_rules import SEVERITY_RANK
+from health_data_simulator import import_storage_module
+
+naive_local = import_storage_module('local_storage').naive_local
+
+class Episode:
+    """One ongoing alert for a user and anomaly type"""
+
+    __slots__ = ('episode_id', 'user_id', 'alert_type', 'started_at', 'last_seen',
+                 'severity', 'message', 'hits', 'misses', 'is_open', 'silent', 'readings')
+
+    def __init__(self, episode_id: str, user_id: str, alert_type: str, started_at: datetime.datetime):
+        self.episode_id = episode_id
+        self.user_id = user_id
+        self.alert_type = alert_type
+        self.started_at = started_at
+        self.last_seen = started_at
+        self.severity = 'medium'
+        self.message = ''
+        self.hits = 0      # Consecutive readings with the anomaly
+        self.misses = 0    # Consecutive readings without it
+        self.is_open = False
+        self.silent = False  # Opened during a cooldown, so not announced
+        self.readings = 0
+
+class AlertEngine:
+    """Stateful alerting over detector output
+
+    An anomaly type must be seen on ``open_after`` consecutive readings
+    before its episode opens (critical anomalies open at once), and must be
+    absent for ``resolve_after`` consecutive readings before it resolves.
+    While open, only a rise in severity produces an update. An episode that
+    reopens within ``cooldown_seconds`` of the last one resolving stays
+    silent unless it becomes more severe than that one was. Resolutions
+    are forgotten once their cooldown has passed, checked about once per
+    cooldown of reading time. process() returns only these state changes,
+    shaped for the ``alerts`` collection. Timestamps with an offset are
+    compared as naive local time.
+    """
+
+    def __init__(self, open_after: int = 2, resolve_after: int = 3,
+                 cooldown_seconds: float = 300.0, immediate_severities: Tuple[str, ...] = ('critical',)):
+        self.open_after = open_after
+        self.resolve_after = resolve_after
+        self.cooldown = datetime.timedelta(seconds=cooldown_seconds)
+        self.immediate_severities = immediate_severities
+        self.episodes: Dict[str, Dict[str, Episode]] = {}  # user_id -> alert_type -> episode
+        self._resolved: Dict[Tuple[str, str], Tuple[datetime.datetime, int]] = {}  # -> (resolved_at, peak rank)
+        self._purge_at: Optional[datetime.datetime] = None
+        self.stats = {'readings': 0, 'anomalies': 0, 'events': 0}
+
+    def process(self, analysis: Dict) -> List[Dict]:
+        """Feed one analyze_reading result, returning alert state changes"""
+        user_id = analysis.get('user_id', 'unknown')
+        now = self._timestamp(analysis)
+        self.stats['readings'] += 1
+        self.stats['anomalies'] += len(analysis['anomalies'])
+        if self._purge_at is None or now >= self._purge_at:
+            self.purge_cooldowns(now)
+            self._purge_at = now + self.cooldown
+
+        # Strongest anomaly of each type in this reading
+        current: Dict[str, Dict] = {}
+        for anomaly in analysis['anomalies']:
+            seen = current.get(anomaly['type'])
+            if seen is None or SEVERITY_RANK[anomaly['severity']] > SEVERITY_RANK[seen['severity']]:
+                current[anomaly['type']] = anomaly
+
+        user_episodes = self.episodes.get(user_id)
+        if not current and not user_episodes:
+            return []  # The common case: nothing happening
+        if user_episodes is None:
+            user_episodes = self.episodes[user_id] = {}
+
+        events = []
+        for alert_type, anomaly in current.items():
+            episode = user_episodes.get(alert_type)
+            if episode is None:
+                episode = user_episodes[alert_type] = Episode(uuid.uuid4().hex, user_id, alert_type, now)
+            events.extend(self._observe(episode, anomaly, now))
+
+        for alert_type in [t for t in user_episodes if t not in current]:
+            episode = user_episodes[alert_type]
+            event = self._miss(episode, now)
+            if event is not None:
+                events.append(event)
+            if not episode.is_open:
+                del user_episodes[alert_type]
+
+        if not user_episodes:
+            del self.episodes[user_id]
+        self.stats['events'] += len(events)
+        return events
+
+    def _observe(self, episode: Episode, anomaly: Dict, now: datetime.datetime) -> List[Dict]:
+        rank = SEVERITY_RANK[anomaly['severity']]
+        previous_rank = SEVERITY_RANK[episode.severity]
+        episode.hits += 1
+        episode.misses = 0
+        episode.readings += 1
+        episode.last_seen = now
+
+        if not episode.is_open:
+            if rank > previous_rank or episode.hits == 1:
+                episode.severity, episode.message = anomaly['severity'], anomaly['message']
+            if episode.hits < self.open_after and anomaly['severity'] not in self.immediate_severities:
+                return []
+            episode.is_open = True
+            episode.started_at = now if episode.hits == 1 else episode.started_at
+            # Cooldown: stay quiet if this repeats a recently resolved alert
+            resolved = self._resolved.get((episode.user_id, episode.alert_type))
+            if resolved and now - resolved[0] < self.cooldown and SEVERITY_RANK[episode.severity] <= resolved[1]:
+                episode.silent = True
+                return []
+            return [self._event(episode, 'opened', now)]
+
+        if rank > previous_rank:
+            episode.severity, episode.message = anomaly['severity'], anomaly['message']
+            if episode.silent:
+                resolved = self._resolved.get((episode.user_id, episode.alert_type))
+                if resolved and rank <= resolved[1]:
+                    return []
+                episode.silent = False
+                return [self._event(episode, 'opened', now)]
+            return [self._event(episode, 'escalated', now)]
+        return []
+
+    def _miss(self, episode: Episode, now: datetime.datetime) -> Optional[Dict]:
+        episode.hits = 0
+        if not episode.is_open:
+            return None
+        episode.misses += 1
+        if episode.misses < self.resolve_after:
+            return None
+
+        episode.is_open = False
+        key = (episode.user_id, episode.alert_type)
+        peak = SEVERITY_RANK[episode.severity]
+        if episode.silent:
+            # Keep the earlier resolution time so the cooldown is not extended forever
+            resolved_at, previous_peak = self._resolved.get(key, (now, peak))
+            self._resolved[key] = (resolved_at, max(peak, previous_peak))
+            return None
+        self._resolved[key] = (now, peak)
+        return self._event(episode, 'resolved', now)
+
+    def _event(self, episode: Episode, event: str, now: datetime.datetime) -> Dict:
+        resolved = event == 'resolved'
+        return {
+            'timestamp': now.isoformat(),
+            'user_id': episode.user_id,
+            'alert_type': episode.alert_type,
+            'severity': episode.severity,
+            'message': f"Resolved: {episode.message}" if resolved else episode.message,
+            'resolved': resolved,
+            'event': event,
+            'episode_id': episode.episode_id,
+            'started_at': episode.started_at.isoformat(),
+            'readings': episode.readings
+        }
+
+    @staticmethod
+    def _timestamp(analysis: Dict) -> datetime.datetime:
+        try:
+            return naive_local(datetime.datetime.fromisoformat(analysis['timestamp']))
+        except (KeyError, TypeError, ValueError):
+            return datetime.datetime.now()
+
+    def purge_cooldowns(self, now: Optional[datetime.datetime] = None) -> int:
+        """Forget resolutions whose cooldown has passed"""
+        cutoff = naive_local(now or datetime.datetime.now()) - self.cooldown
+        expired = [key for key, (resolved_at, _) in self._resolved.items() if resolved_at < cutoff]
+        for key in expired:
+            del self._resolved[key]
+        return len(expired)
+
+    def open_alerts(self) -> List[Dict]:
+        """Snapshot of every open episode"""
+        return [
+            self._event(episode, 'open', episode.last_seen)
+            for user_episodes in self.episodes.values()
+            for episode in user_episodes.values()
+            if episode.is_open
+        ]
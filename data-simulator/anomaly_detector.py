@@ -3,148 +3,320 @@ Basic AI Anomaly Detection for Health Monitoring
 Educational implementation using simple statistical methods
 """
 
+import math
+import sys
+from array import array
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 import json
 from datetime import datetime, timedelta
 
+from detection_rules import SEVERITY_RANK, RuleBook
+from readings import ReadingHistory
+from storage_modules import import_storage_module
+
+# Stage timers and counters live with the storage modules in firebase-config
+metrics = import_storage_module('metrics')
+
+EXACT_Z_SCORES = metrics.REGISTRY.counter(
+    'health_exact_z_scores_total', "Z-scores settled with an O(window) NumPy pass", ('reason',))
+
+# Per-metric trend settings: window length, z-score threshold, the value
+# substituted when a reading omits the metric, and how to describe it.
+DEFAULT_TREND_CONFIG = {
+    'heart_rate': {
+        'window': 10,
+        'z_threshold': 2.5,
+        'default': 72,
+        'anomaly_type': 'heart_rate_trend',
+        'label': 'Heart rate',
+        'unit': ' bpm'
+    },
+    'spo2': {
+        'window': 10,
+        'z_threshold': 2.0,  # Lower threshold for SpO2
+        'default': 98.5,
+        'anomaly_type': 'spo2_trend',
+        'label': 'SpO2',
+        'unit': '%'
+    }
+}
+
+# Message template for each range anomaly type
+RANGE_MESSAGES = {
+    'bradycardia': 'Low heart rate detected: {value} bpm',
+    'tachycardia': 'High heart rate detected: {value} bpm',
+    'hypoxemia': 'Low oxygen saturation: {value}%',
+    'fever': 'Elevated temperature: {value}°F',
+    'hypothermia': 'Low temperature: {value}°F',
+    'fall': 'Fall detected - immediate attention required'
+}
+GENERIC_RANGE_MESSAGE = '{type} out of range: {value}'
+
+# Severity rank -> (status, risk_level), as decided in analyze_reading
+RANK_SEVERITY = {rank: severity for severity, rank in SEVERITY_RANK.items()}
+STATUS_BY_RANK = {
+    0: ('normal', 'low'),
+    1: ('caution', 'medium'),
+    2: ('warning', 'high'),
+    3: ('critical', 'critical')
+}
+
+def reading_value(reading: Dict, metric: str, default):
+    """A reading's metric, with a missing key or None read as the default"""
+    value = reading.get(metric)
+    return default if value is None else value
+
+class RollingWindow:
+    """Fixed-size ring buffer with O(1) running mean and variance"""
+
+    __slots__ = ('size', 'values', 'head', 'count', 'mean', 'm2', '_evictions')
+
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError("Rolling window size must be at least 1")
+        self.size = size
+        self.values = array('d', [0.0]) * size
+        self.head = 0  # Slot the next value is written to
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared deviations from the mean
+        self._evictions = 0
+
+    def push(self, value: float):
+        """Add a value, evicting the oldest one once the window is full"""
+        value = float(value)
+        if self.count < self.size:
+            # Standard Welford update while the window fills up
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+        else:
+            # Sliding Welford update: replace the oldest value in one step
+            old = self.values[self.head]
+            old_mean = self.mean
+            self.mean = old_mean + (value - old) / self.size
+            self.m2 += (value - old) * (value - self.mean + old - old_mean)
+            self._evictions += 1
+
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+
+        if self._evictions >= self.size:
+            # Re-derive the moments once per full turn so rounding error
+            # from the sliding updates can never accumulate
+            self._recompute()
+
+    def extend(self, values):
+        """Push many values, keeping only the newest window's worth"""
+        values = [float(v) for v in values]
+        if len(values) < self.size:
+            for value in values:
+                self.push(value)
+            return
+        # The batch alone fills the window, so load its tail directly
+        self.values = array('d', values[-self.size:])
+        self.head = 0
+        self.count = self.size
+        self._recompute()
+
+    def _recompute(self):
+        """Recalculate mean and variance exactly from the buffered values"""
+        values = self.ordered()
+        self.mean = math.fsum(values) / self.count if self.count else 0.0
+        self.m2 = math.fsum((v - self.mean) ** 2 for v in values)
+        self._evictions = 0
+
+    def ordered(self) -> List[float]:
+        """Buffered values from oldest to newest"""
+        if self.count < self.size:
+            return list(self.values[:self.count])
+        return list(self.values[self.head:]) + list(self.values[:self.head])
+
+    @property
+    def full(self) -> bool:
+        return self.count == self.size
+
+    def variance(self) -> float:
+        """Population variance of the window (same as np.var)"""
+        if self.count == 0:
+            return 0.0
+        return max(0.0, self.m2 / self.count)
+
+    def std(self) -> float:
+        """Population standard deviation of the window (same as np.std)"""
+        return math.sqrt(self.variance())
+
+    def z_score(self, value: float, threshold: Optional[float] = None) -> Optional[float]:
+        """Absolute z-score of value against the window, None if flat
+
+        O(1) from the running moments, except in three narrow cases that
+        take an O(window) NumPy pass so results match np.mean/np.std
+        exactly: a near-flat window, a z-score within 1e-6 of
+        ``threshold``, or one within 1e-6 of a rounding boundary of the
+        reported 2-decimal value. Each pass is counted in
+        health_exact_z_scores_total. On a simulated fleet it is about 0.03%
+        of calls, at ~30 µs each against ~1 µs for the O(1) path (see the
+        z_score benchmark).
+        """
+        variance = self.variance()
+        if variance <= 1e-9 * max(1.0, self.mean * self.mean):
+            # Near-flat window: the result hinges on rounding residue
+            EXACT_Z_SCORES.inc('flat')
+            return self._exact_z_score(value)
+
+        z_score = abs(value - self.mean) / math.sqrt(variance)
+        near_threshold = threshold is not None and abs(z_score - threshold) < 1e-6
+        near_rounding = abs((z_score * 100) % 1 - 0.5) < 1e-6
+        if near_threshold or near_rounding:
+            # The running moments can differ from NumPy in the last bits,
+            # so settle borderline cases the same way np.mean/np.std would
+            EXACT_Z_SCORES.inc('threshold' if near_threshold else 'rounding')
+            return self._exact_z_score(value)
+        return z_score
+
+    def _exact_z_score(self, value: float) -> Optional[float]:
+        """Z-score computed with NumPy over the buffered values"""
+        values = self.ordered()
+        std = np.std(values)
+        if std > 0:
+            return float(abs(value - np.mean(values)) / std)
+        return None
+
+class TrendState:
+    """Per-user rolling windows, one per trend metric"""
+
+    __slots__ = ('windows', 'last_seen')
+
+    def __init__(self, windows: Tuple[RollingWindow, ...], last_seen: float = 0.0):
+        self.windows = windows
+        self.last_seen = last_seen
+
+    def nbytes(self) -> int:
+        """Approximate memory held by this state"""
+        total = sys.getsizeof(self) + sys.getsizeof(self.windows)
+        for window in self.windows:
+            total += sys.getsizeof(window) + sys.getsizeof(window.values)
+        return total
+
 class HealthAnomalyDetector:
     """Simple anomaly detection for health monitoring data"""
     
-    def __init__(self):
-        self.normal_ranges = {
-            'heart_rate': (60, 100),
-            'spo2': (95, 100),
-            'temperature': (97.0, 99.5)  # Fahrenheit
-        }
+    def __init__(self, trend_config: Optional[Dict[str, Dict]] = None,
+                 rules: Optional[Union[RuleBook, Dict]] = None):
+        # Range thresholds, severity tiers and recommendations (see detection_rules)
+        self.rules = rules if isinstance(rules, RuleBook) else RuleBook(rules)
+        
+        # Merge per-metric overrides (window, z_threshold, ...) onto defaults
+        self.trend_config = {metric: dict(settings) for metric, settings in DEFAULT_TREND_CONFIG.items()}
+        for metric, overrides in (trend_config or {}).items():
+            self.trend_config.setdefault(metric, {}).update(overrides)
         
-        self.history = []
         self.max_history = 100  # Keep last 100 readings
+        self.history = ReadingHistory(self.max_history)  # Numeric fields only, in arrays
+        self.trend_metrics = tuple(self.trend_config)
+        self.state = self.new_state()
         
-    def add_reading(self, reading: Dict):
+    @property
+    def normal_ranges(self) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+        """Default profile's (low, high) limits per metric"""
+        return self.rules.default_table.normal_ranges()
+    
+    @property
+    def windows(self) -> Dict[str, RollingWindow]:
+        """Rolling windows of the detector's own (single-user) state"""
+        return dict(zip(self.trend_metrics, self.state.windows))
+    
+    def new_state(self) -> TrendState:
+        """Create empty trend state, e.g. for one user in a registry"""
+        return TrendState(tuple(
+            RollingWindow(self.trend_config[metric]['window'])
+            for metric in self.trend_metrics
+        ))
+    
+    def add_reading(self, reading: Dict, state: Optional[TrendState] = None):
         """Add new reading to history"""
-        self.history.append(reading)
-        if len(self.history) > self.max_history:
-            self.history.pop(0)
+        if state is None:
+            state = self.state
+            self.history.append(reading)
+        for metric, window in zip(self.trend_metrics, state.windows):
+            window.push(reading_value(reading, metric, self.trend_config[metric]['default']))
     
+    @metrics.timed('range_check')
     def detect_range_anomalies(self, reading: Dict) -> List[Dict]:
         """Detect values outside normal ranges"""
         anomalies = []
         
-        # Heart rate check
-        hr = reading.get('heart_rate', 0)
-        if hr < self.normal_ranges['heart_rate'][0]:
-            anomalies.append({
-                'type': 'bradycardia',
-                'severity': 'high' if hr < 50 else 'medium',
-                'value': hr,
-                'message': f'Low heart rate detected: {hr} bpm'
-            })
-        elif hr > self.normal_ranges['heart_rate'][1]:
-            anomalies.append({
-                'type': 'tachycardia',
-                'severity': 'high' if hr > 120 else 'medium',
-                'value': hr,
-                'message': f'High heart rate detected: {hr} bpm'
-            })
-        
-        # SpO2 check
-        spo2 = reading.get('spo2', 100)
-        if spo2 < self.normal_ranges['spo2'][0]:
-            severity = 'critical' if spo2 < 90 else 'high'
-            anomalies.append({
-                'type': 'hypoxemia',
-                'severity': severity,
-                'value': spo2,
-                'message': f'Low oxygen saturation: {spo2}%'
-            })
-        
-        # Temperature check
-        temp = reading.get('temperature', 98.6)
-        if temp > self.normal_ranges['temperature'][1]:
-            severity = 'high' if temp > 101 else 'medium'
-            anomalies.append({
-                'type': 'fever',
-                'severity': severity,
-                'value': temp,
-                'message': f'Elevated temperature: {temp}°F'
-            })
-        elif temp < self.normal_ranges['temperature'][0]:
-            anomalies.append({
-                'type': 'hypothermia',
-                'severity': 'medium',
-                'value': temp,
-                'message': f'Low temperature: {temp}°F'
-            })
-        
-        # Fall detection
-        if reading.get('fall_detected', False):
-            anomalies.append({
-                'type': 'fall',
-                'severity': 'critical',
-                'value': True,
-                'message': 'Fall detected - immediate attention required'
-            })
+        # One table lookup per rule, using the user's profile
+        for rule in self.rules.table_for(reading.get('user_id')).rules:
+            value = reading_value(reading, rule.metric, rule.default)
+            if value is None:
+                continue
+            rank = rule.rank(value)
+            if rank:
+                if rule.direction == 'flag':
+                    value = True
+                anomalies.append(self._range_anomaly(rule.type, value, RANK_SEVERITY[rank]))
         
         return anomalies
     
-    def detect_trend_anomalies(self, reading: Dict) -> List[Dict]:
+    def _range_anomaly(self, anomaly_type: str, value, severity: str) -> Dict:
+        """Build the anomaly record for a failed range check"""
+        return {
+            'type': anomaly_type,
+            'severity': severity,
+            'value': value,
+            'message': RANGE_MESSAGES.get(anomaly_type, GENERIC_RANGE_MESSAGE).format(type=anomaly_type, value=value)
+        }
+    
+    @metrics.timed('trend_check')
+    def detect_trend_anomalies(self, reading: Dict, state: Optional[TrendState] = None) -> List[Dict]:
         """Detect anomalies based on trends in historical data"""
-        if len(self.history) < 10:
-            return []  # Need at least 10 readings for trend analysis
-        
         anomalies = []
+        state = state or self.state
         
-        # Get recent heart rate values
-        recent_hr = [r.get('heart_rate', 72) for r in self.history[-10:]]
-        current_hr = reading.get('heart_rate', 72)
-        
-        # Calculate moving average and standard deviation
-        hr_mean = np.mean(recent_hr)
-        hr_std = np.std(recent_hr)
-        
-        # Z-score anomaly detection (threshold: 2.5 standard deviations)
-        if hr_std > 0:
-            z_score = abs(current_hr - hr_mean) / hr_std
-            if z_score > 2.5:
-                anomalies.append({
-                    'type': 'heart_rate_trend',
-                    'severity': 'medium',
-                    'value': current_hr,
-                    'z_score': round(z_score, 2),
-                    'message': f'Heart rate trend anomaly: {current_hr} bpm (Z-score: {z_score:.2f})'
-                })
-        
-        # Similar analysis for SpO2
-        recent_spo2 = [r.get('spo2', 98.5) for r in self.history[-10:]]
-        current_spo2 = reading.get('spo2', 98.5)
-        
-        spo2_mean = np.mean(recent_spo2)
-        spo2_std = np.std(recent_spo2)
-        
-        if spo2_std > 0:
-            z_score = abs(current_spo2 - spo2_mean) / spo2_std
-            if z_score > 2.0:  # Lower threshold for SpO2
-                anomalies.append({
-                    'type': 'spo2_trend',
-                    'severity': 'medium',
-                    'value': current_spo2,
-                    'z_score': round(z_score, 2),
-                    'message': f'SpO2 trend anomaly: {current_spo2}% (Z-score: {z_score:.2f})'
-                })
+        for metric, window in zip(self.trend_metrics, state.windows):
+            if not window.full:
+                continue  # Need a full window of readings for trend analysis
+            
+            settings = self.trend_config[metric]
+            current = reading_value(reading, metric, settings['default'])
+            
+            # Z-score against the rolling mean and standard deviation
+            z_score = window.z_score(current, settings['z_threshold'])
+            if z_score is not None and z_score > settings['z_threshold']:
+                anomalies.append(self._trend_anomaly(metric, current, z_score))
         
         return anomalies
     
-    def analyze_reading(self, reading: Dict) -> Dict:
-        """Complete analysis of a health reading"""
+    def _trend_anomaly(self, metric: str, value, z_score: float) -> Dict:
+        """Build the anomaly record for a trend z-score breach"""
+        settings = self.trend_config[metric]
+        return {
+            'type': settings['anomaly_type'],
+            'severity': 'medium',
+            'value': value,
+            'z_score': round(z_score, 2),
+            'message': f"{settings['label']} trend anomaly: {value}{settings['unit']} (Z-score: {z_score:.2f})"
+        }
+    
+    @metrics.timed('analyze')
+    def analyze_reading(self, reading: Dict, state: Optional[TrendState] = None) -> Dict:
+        """Complete analysis of a health reading
+
+        By default the reading extends the detector's own history; pass a
+        TrendState to analyze it against another user's windows instead.
+        """
         # Add to history
-        self.add_reading(reading)
+        self.add_reading(reading, state)
         
         # Detect all types of anomalies
         range_anomalies = self.detect_range_anomalies(reading)
-        trend_anomalies = self.detect_trend_anomalies(reading)
+        trend_anomalies = self.detect_trend_anomalies(reading, state)
         
         all_anomalies = range_anomalies + trend_anomalies
+        metrics.record_anomalies(all_anomalies)
         
         # Determine overall health status
         if not all_anomalies:
@@ -170,34 +342,143 @@ class HealthAnomalyDetector:
             'recommendations': self.generate_recommendations(all_anomalies)
         }
     
-    def generate_recommendations(self, anomalies: List[Dict]) -> List[str]:
-        """Generate recommendations based on detected anomalies"""
-        recommendations = []
+    @metrics.timed('analyze_batch', items=len)
+    def analyze_batch(self, batch, state: Optional[TrendState] = None) -> List[Dict]:
+        """Analyze a columnar batch of readings in one vectorized pass
+
+        ``batch`` is a NumPy structured array or a dict of equal-length
+        arrays with heart_rate, spo2, temperature and fall_detected columns
+        (timestamp and user_id are optional). Rows are treated as if they
+        were passed to analyze_reading one after another, and the returned
+        list holds the same per-row result dicts. As with analyze_reading,
+        an explicit TrendState replaces the detector's own history.
+        """
+        columns, present = self._batch_columns(batch)
+        n = len(columns['heart_rate'])
+        if n == 0:
+            return []
         
-        for anomaly in anomalies:
-            if anomaly['type'] == 'fall':
-                recommendations.append("🚨 Call emergency services immediately")
-                recommendations.append("📞 Contact emergency contact")
-            
-            elif anomaly['type'] == 'hypoxemia':
-                if anomaly['severity'] == 'critical':
-                    recommendations.append("🏥 Seek immediate medical attention")
+        # Range checks: a severity rank per row and rule (0 = no anomaly),
+        # looked up in each profile's table for the rows it applies to
+        checks: Dict[str, Tuple[object, np.ndarray]] = {}
+        for table, rows in self.rules.tables_for(columns.get('user_id')):
+            for rule in table.rules:
+                if rule.metric not in columns:
+                    continue
+                if rule.type not in checks:
+                    checks[rule.type] = (rule, np.zeros(n, dtype=np.int8))
+                ranks = checks[rule.type][1]
+                values = columns[rule.metric]
+                if rows is None:
+                    ranks[:] = rule.rank_array(values)
                 else:
-                    recommendations.append("💨 Check breathing, consider medical consultation")
-            
-            elif anomaly['type'] in ['bradycardia', 'tachycardia']:
-                if anomaly['severity'] == 'high':
-                    recommendations.append("❤️ Monitor heart rate closely, consider medical consultation")
-                else:
-                    recommendations.append("🧘 Rest and monitor, avoid strenuous activity")
+                    ranks[rows] = rule.rank_array(values[rows])
+        
+        # Trend checks over the rolling window, seeded with current history
+        trends = []
+        windows = (state or self.state).windows
+        for metric, window in zip(self.trend_metrics, windows):
+            settings = self.trend_config[metric]
+            if metric in present:
+                values = columns[metric]
+                if values.dtype.kind == 'f' and np.isnan(values).any():
+                    # NaN is a missing value and counts as the default
+                    values = np.where(np.isnan(values), settings['default'], values)
+            else:
+                values = np.full(n, settings['default'])
+            z_scores = self._batch_z_scores(window, values)
+            flagged = z_scores > settings['z_threshold']
+            trends.append((metric, values, z_scores, flagged))
+            window.extend(values)
+        
+        severity = np.zeros(n, dtype=int)
+        for _, ranks in checks.values():
+            severity = np.maximum(severity, ranks)
+        for _, _, _, flagged in trends:
+            severity = np.maximum(severity, np.where(flagged, 1, 0))
+        
+        # Keep history consistent with the per-reading path
+        if state is None:
+            self.history.extend_columns(columns, present)
+        
+        results = []
+        for i in range(n):
+            status, risk_level = STATUS_BY_RANK[int(severity[i])]
+            anomalies = []
+            if severity[i]:
+                for anomaly_type, (rule, ranks) in checks.items():
+                    if ranks[i]:
+                        value = True if rule.direction == 'flag' else columns[rule.metric][i].item()
+                        if value != value:  # NaN was ranked as the default
+                            value = rule.default
+                        anomalies.append(self._range_anomaly(anomaly_type, value, RANK_SEVERITY[int(ranks[i])]))
+                for metric, values, z_scores, flagged in trends:
+                    if flagged[i]:
+                        anomalies.append(self._trend_anomaly(metric, values[i].item(), float(z_scores[i])))
+                metrics.record_anomalies(anomalies)
             
-            elif anomaly['type'] == 'fever':
-                recommendations.append("🌡️ Monitor temperature, stay hydrated, rest")
-                if anomaly['severity'] == 'high':
-                    recommendations.append("💊 Consider fever reducer, consult healthcare provider")
+            results.append({
+                'timestamp': columns['timestamp'][i] if 'timestamp' in columns else datetime.now().isoformat(),
+                'user_id': columns['user_id'][i] if 'user_id' in columns else 'unknown',
+                'status': status,
+                'risk_level': risk_level,
+                'anomalies': anomalies,
+                'anomaly_count': len(anomalies),
+                'recommendations': self.generate_recommendations(anomalies)
+            })
+        
+        return results
+    
+    def _batch_columns(self, batch) -> Tuple[Dict[str, np.ndarray], set]:
+        """Normalize a structured array or dict of arrays into columns"""
+        names = batch.dtype.names if isinstance(batch, np.ndarray) else tuple(batch.keys())
+        if not names:
+            raise ValueError("Batch must be a structured array or a dict of arrays")
         
-        # Remove duplicates
-        return list(set(recommendations))
+        lengths = {len(batch[name]) for name in names}
+        if len(lengths) != 1:
+            raise ValueError("All batch columns must have the same length")
+        n = lengths.pop()
+        
+        columns = {}
+        for name in ('timestamp', 'user_id'):
+            if name in names:
+                columns[name] = [str(value) for value in np.asarray(batch[name]).tolist()]
+        # Absent columns take the value the dict path assumes for a missing key
+        for name, default in self.rules.defaults.items():
+            if name in names:
+                columns[name] = np.asarray(batch[name])
+            elif default is not None:
+                columns[name] = np.full(n, default)
+        
+        return columns, set(names)
+    
+    def _batch_z_scores(self, window: RollingWindow, values: np.ndarray) -> np.ndarray:
+        """Z-score of each value against the window ending at that value"""
+        size = window.size
+        series = np.concatenate([np.asarray(window.ordered(), dtype=float), values.astype(float)])
+        z_scores = np.zeros(len(values))
+        
+        # Row i is scored once the window holds `size` values up to and including it
+        first = max(0, size - window.count - 1)
+        if first >= len(values):
+            return z_scores
+        
+        frames = np.lib.stride_tricks.sliding_window_view(series, size)
+        frames = frames[window.count + first - size + 1:]
+        means = frames.mean(axis=1)
+        stds = frames.std(axis=1)
+        current = series[window.count + first:]
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scored = np.where(stds > 0, np.abs(current - means) / stds, 0.0)
+        z_scores[first:] = scored
+        return z_scores
+    
+    def generate_recommendations(self, anomalies: List[Dict]) -> List[str]:
+        """Generate recommendations based on detected anomalies"""
+        # Table lookup per anomaly, duplicates removed in first-seen order
+        return self.rules.recommend(anomalies)
 
 def test_anomaly_detector():
     """Test the anomaly detector with sample data"""
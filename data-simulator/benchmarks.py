@@ -0,0 +1,316 @@
+"""
+Benchmark suite for Health Monitoring hot paths
+Throughput and latency percentiles for the simulator, detector and storage, as JSON
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from anomaly_detector import EXACT_Z_SCORES, HealthAnomalyDetector, RollingWindow
+from detector_registry import DetectorRegistry
+from health_data_simulator import (STORAGE_DIR, FleetSimulator, WearableSimulator,
+                                   import_storage_module, json_codec)
+
+SCHEMA_VERSION = 1
+RECENT_SIZES = (10_000, 100_000, 1_000_000)  # Pass --recent-sizes to go up to 10M
+STARTUP_MODULES = ('metrics', 'firebase_setup', 'health_data_simulator', 'detector_registry',
+                   'ingestion_server', 'rescore_job')
+
+def percentile_summary(latencies_ns: List[int], seconds: float) -> Dict:
+    """Throughput and p50/p99 latency for a list of per-call timings"""
+    latencies = np.asarray(latencies_ns, dtype=float) / 1000.0
+    return {
+        'ops': len(latencies),
+        'seconds': round(seconds, 4),
+        'ops_per_sec': round(len(latencies) / max(seconds, 1e-9)),
+        'p50_us': round(float(np.percentile(latencies, 50)), 2),
+        'p99_us': round(float(np.percentile(latencies, 99)), 2),
+        'max_us': round(float(latencies.max()), 2)
+    }
+
+def measure(call: Callable, inputs: List, warmup: int = 0) -> Dict:
+    """Time call(item) for each input, after ``warmup`` untimed calls"""
+    for item in inputs[:warmup]:
+        call(item)
+    timer = time.perf_counter_ns
+    latencies = []
+    gc.disable()  # Collector pauses would land on random calls
+    try:
+        started = timer()
+        for item in inputs[warmup:]:
+            before = timer()
+            call(item)
+            latencies.append(timer() - before)
+        elapsed = (timer() - started) / 1e9
+    finally:
+        gc.enable()
+    return percentile_summary(latencies, elapsed)
+
+def bench_generate_reading(count: int) -> Dict:
+    """WearableSimulator.generate_reading"""
+    simulator = WearableSimulator("bench_user")
+    return measure(lambda _: simulator.generate_reading(), [None] * count, warmup=100)
+
+def _readings(count: int, users: int = 1) -> List[Dict]:
+    simulators = [WearableSimulator(f"bench_user_{i:06d}") for i in range(users)]
+    return [simulators[i % users].to_dict(simulators[i % users].generate_reading()) for i in range(count)]
+
+def bench_analyze_reading(count: int) -> Dict:
+    """HealthAnomalyDetector.analyze_reading against cold and warm history"""
+    readings = _readings(count)
+    detector = HealthAnomalyDetector()
+
+    # Cold: every reading meets a brand-new, empty trend state
+    cold = measure(lambda reading: detector.analyze_reading(reading, detector.new_state()), readings)
+
+    # Warm: one user's windows are already full
+    for reading in readings[:detector.max_history]:
+        detector.analyze_reading(reading)
+    warm = measure(detector.analyze_reading, readings)
+    return {'cold': cold, 'warm': warm}
+
+def bench_z_score(count: int) -> Dict:
+    """RollingWindow.z_score: O(1) path, the exact NumPy fallback, and how often it runs"""
+    readings = _readings(count, users=100)
+    registry = DetectorRegistry(idle_ttl=None)
+    before = sum(EXACT_Z_SCORES.values.values())
+    for reading in readings:
+        registry.analyze_reading(reading)
+    exact_calls = sum(EXACT_Z_SCORES.values.values()) - before
+
+    window = RollingWindow(10)
+    for reading in readings[:10]:
+        window.push(reading['heart_rate'])
+    values = [float(reading['heart_rate']) for reading in readings]
+    checks = count * len(registry.detector.trend_metrics)
+    return {
+        'fast': measure(window.z_score, values),
+        'exact': measure(window._exact_z_score, values[:max(1, count // 10)]),
+        'exact_calls': exact_calls,
+        'exact_fraction': round(exact_calls / max(1, checks), 6)
+    }
+
+def _storage_db(data_dir: str):
+    firebase_setup = import_storage_module('firebase_setup')
+    return firebase_setup.FirebaseHealthDB(data_dir=data_dir)
+
+def bench_save_health_data(count: int, segments: int, data_dir: str) -> List[Dict]:
+    """FirebaseHealthDB.save_health_data, in segments as the day file grows"""
+    readings = _readings(count, users=100)
+    db = _storage_db(data_dir)
+    results = []
+    per_segment = max(1, count // segments)
+    try:
+        for start in range(0, count, per_segment):
+            result = measure(db.save_health_data, readings[start:start + per_segment])
+            db._writer.flush()
+            result['records_before'] = start
+            result['file_bytes'] = os.path.getsize(db._writer.path)
+            results.append(result)
+    finally:
+        db.close()
+    return results
+
+def write_day_file(data_dir: str, records: int, users: int, seed: int = 42) -> str:
+    """Write a day partition of ``records`` readings spread over ``users``"""
+    local_storage = import_storage_module('local_storage')
+    path = local_storage.partition_path(data_dir, local_storage.partition_day(), local_storage.JSONL_SUFFIX)
+    fleet = FleetSimulator(min(users, records), seed=seed, id_prefix="bench_user_")
+    start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    written = 0
+    with open(path, 'wb') as f:
+        while written < records:
+            batch = fleet.tick((start + datetime.timedelta(seconds=written // fleet.devices)).isoformat())
+            rows = fleet.to_dicts(batch)[:records - written]
+            f.write(b''.join(local_storage.encode_record(row) for row in rows))
+            written += len(rows)
+    return path
+
+def bench_get_recent_data(sizes, users: int, queries: int, limit: int, data_dir: str) -> List[Dict]:
+    """FirebaseHealthDB.get_recent_data against day files of each size"""
+    results = []
+    for size in sizes:
+        size_dir = os.path.join(data_dir, f"recent_{size}")
+        os.makedirs(size_dir)
+        path = write_day_file(size_dir, size, users)
+        user_ids = [f"bench_user_{random.randrange(min(users, size)):06d}" for _ in range(queries)]
+
+        db = _storage_db(size_dir)
+        # First query indexes the whole partition; later ones seek
+        started = time.perf_counter()
+        db.get_recent_data(user_ids[0], limit)
+        first_query = time.perf_counter() - started
+        result = measure(lambda user_id: db.get_recent_data(user_id, limit), user_ids)
+        db.close()
+
+        result.update({'records': size, 'file_bytes': os.path.getsize(path),
+                       'first_query_seconds': round(first_query, 4)})
+        results.append(result)
+        shutil.rmtree(size_dir)
+    return results
+
+def bench_startup(runs: int, modules=STARTUP_MODULES) -> Dict:
+    """Fresh-interpreter import time per module, as a spawned worker pays it"""
+    path = os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), STORAGE_DIR])
+    env = dict(os.environ, PYTHONPATH=path)
+    results = {}
+    for module in ('',) + tuple(modules):
+        command = [sys.executable, '-c', f"import {module}" if module else "pass"]
+        results[module or 'interpreter'] = measure(
+            lambda _: subprocess.run(command, env=env, check=True), [None] * runs, warmup=1)
+    return results
+
+def bench_json_codec(count: int) -> Dict:
+    """Per-record JSON encode and decode, stdlib vs json_codec's backend"""
+    records = _readings(count, users=100)
+    lines = [json_codec.encode_line(record) for record in records]
+    return {
+        'backend': json_codec.BACKEND,
+        'record_bytes': round(sum(map(len, lines)) / len(lines), 1),
+        'encode_stdlib': measure(lambda record: (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'),
+                                 records),
+        'encode': measure(json_codec.encode_line, records),
+        'decode_stdlib': measure(json.loads, lines),
+        'decode': measure(json_codec.loads, lines)
+    }
+
+def bench_memory_per_user(users: int) -> Dict:
+    """Bytes of detector state per tracked user, estimated and traced"""
+    registry = DetectorRegistry(idle_ttl=None)
+    readings = _readings(users * 2, users=users)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for reading in readings:
+        registry.analyze_reading(reading)
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {
+        'users': len(registry),
+        'estimated_bytes_per_user': registry.state_bytes,
+        'traced_bytes_per_user': round(traced / max(1, len(registry)))
+    }
+
+def _environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'json_backend': json_codec.BACKEND,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'run_at': datetime.datetime.now().isoformat()
+    }
+
+def run_benchmarks(readings: int = 20000, saves: int = 20000, segments: int = 5,
+                   recent_sizes=RECENT_SIZES, recent_users: int = 1000, queries: int = 1000,
+                   limit: int = 10, memory_users: int = 10000, startup_runs: int = 10,
+                   seed: int = 42, only: Optional[List[str]] = None) -> Dict:
+    """Run the suite and return the report as a dict"""
+    random.seed(seed)
+    np.random.seed(seed)
+    data_dir = tempfile.mkdtemp(prefix="health_bench_")
+    suites = {
+        'generate_reading': lambda: bench_generate_reading(readings),
+        'analyze_reading': lambda: bench_analyze_reading(readings),
+        'z_score': lambda: bench_z_score(readings),
+        'save_health_data': lambda: bench_save_health_data(saves, segments, data_dir),
+        'get_recent_data': lambda: bench_get_recent_data(recent_sizes, recent_users, queries, limit, data_dir),
+        'memory_per_user': lambda: bench_memory_per_user(memory_users),
+        'startup': lambda: bench_startup(startup_runs),
+        'json_codec': lambda: bench_json_codec(readings)
+    }
+    report = {'schema_version': SCHEMA_VERSION, 'environment': _environment(),
+              'parameters': {'readings': readings, 'saves': saves, 'recent_sizes': list(recent_sizes),
+                             'recent_users': recent_users, 'queries': queries, 'limit': limit,
+                             'memory_users': memory_users, 'startup_runs': startup_runs, 'seed': seed},
+              'results': {}}
+    try:
+        for name, suite in suites.items():
+            if only and name not in only:
+                continue
+            print(f"⏱️  {name}...", flush=True)
+            report['results'][name] = suite()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return report
+
+def _rates(results, prefix: str = '') -> Dict[str, float]:
+    """Flatten every ops_per_sec in a results tree, keyed by its path"""
+    rates = {}
+    if isinstance(results, dict):
+        if 'ops_per_sec' in results:
+            rates[prefix] = results['ops_per_sec']
+        for key, value in results.items():
+            rates.update(_rates(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(results, list):
+        for i, value in enumerate(results):
+            rates.update(_rates(value, f"{prefix}[{i}]"))
+    return rates
+
+def compare_reports(baseline: Dict, current: Dict, tolerance: float = 0.1) -> List[Dict]:
+    """Throughput changes between two reports, flagging drops beyond tolerance"""
+    old, new = _rates(baseline['results']), _rates(current['results'])
+    changes = []
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key] / max(old[key], 1)
+        changes.append({'benchmark': key, 'baseline': old[key], 'current': new[key],
+                        'ratio': round(ratio, 3), 'regression': ratio < 1 - tolerance})
+    return changes
+
+def main():
+    """Run the benchmark suite and write the JSON report"""
+    parser = argparse.ArgumentParser(description="Benchmark simulator, detector and storage hot paths")
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--saves', type=int, default=20000)
+    parser.add_argument('--segments', type=int, default=5)
+    parser.add_argument('--recent-sizes', type=int, nargs='+', default=list(RECENT_SIZES))
+    parser.add_argument('--recent-users', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--memory-users', type=int, default=10000)
+    parser.add_argument('--startup-runs', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', nargs='+', help="run just these benchmarks")
+    parser.add_argument('--output', help="write the report here instead of stdout")
+    parser.add_argument('--compare', help="baseline report to compare throughput against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.readings, args.saves, args.segments, args.recent_sizes,
+                            args.recent_users, args.queries, memory_users=args.memory_users,
+                            startup_runs=args.startup_runs, seed=args.seed, only=args.only)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            report['comparison'] = compare_reports(json.load(f), report)
+        for change in report['comparison']:
+            flag = "🔻" if change['regression'] else "  "
+            print(f"{flag} {change['benchmark']}: {change['baseline']} -> {change['current']} ({change['ratio']}x)")
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"📄 Benchmark report saved to {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
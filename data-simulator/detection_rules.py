@@ -0,0 +1,241 @@
+"""
+Declarative detection rules for Health Monitoring
+Range thresholds, severity tiers and recommendations as data, with per-cohort profiles
+"""
+
+import bisect
+import copy
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+SEVERITY_RANK = {'medium': 1, 'high': 2, 'critical': 3}
+
+# Each range rule fires when its metric is 'below' or 'above' ``limit``
+# (or, for 'flag' rules, when the metric is true). ``tiers`` raise the
+# severity past further limits in the same direction. ``defaults`` is the
+# value assumed when a reading omits a metric.
+DEFAULT_RULES = {
+    'defaults': {
+        'heart_rate': 0,
+        'spo2': 100,
+        'temperature': 98.6,
+        'fall_detected': False
+    },
+    'range_rules': [
+        {'type': 'bradycardia', 'metric': 'heart_rate', 'direction': 'below', 'limit': 60,
+         'severity': 'medium', 'tiers': [{'limit': 50, 'severity': 'high'}]},
+        {'type': 'tachycardia', 'metric': 'heart_rate', 'direction': 'above', 'limit': 100,
+         'severity': 'medium', 'tiers': [{'limit': 120, 'severity': 'high'}]},
+        {'type': 'hypoxemia', 'metric': 'spo2', 'direction': 'below', 'limit': 95,
+         'severity': 'high', 'tiers': [{'limit': 90, 'severity': 'critical'}]},
+        {'type': 'fever', 'metric': 'temperature', 'direction': 'above', 'limit': 99.5,
+         'severity': 'medium', 'tiers': [{'limit': 101, 'severity': 'high'}]},
+        {'type': 'hypothermia', 'metric': 'temperature', 'direction': 'below', 'limit': 97.0,
+         'severity': 'medium'},
+        {'type': 'fall', 'metric': 'fall_detected', 'direction': 'flag', 'severity': 'critical'}
+    ],
+    # Anomaly type -> severity ('*' for any) -> recommendations, in order
+    'recommendations': {
+        'fall': {'*': ["🚨 Call emergency services immediately", "📞 Contact emergency contact"]},
+        'hypoxemia': {
+            'critical': ["🏥 Seek immediate medical attention"],
+            '*': ["💨 Check breathing, consider medical consultation"]
+        },
+        'bradycardia': {
+            'high': ["❤️ Monitor heart rate closely, consider medical consultation"],
+            '*': ["🧘 Rest and monitor, avoid strenuous activity"]
+        },
+        'tachycardia': {
+            'high': ["❤️ Monitor heart rate closely, consider medical consultation"],
+            '*': ["🧘 Rest and monitor, avoid strenuous activity"]
+        },
+        'fever': {
+            'high': ["🌡️ Monitor temperature, stay hydrated, rest",
+                     "💊 Consider fever reducer, consult healthcare provider"],
+            '*': ["🌡️ Monitor temperature, stay hydrated, rest"]
+        },
+        'multivariate': {'*': ["📊 Unusual pattern for this user, review recent readings"]}
+    },
+    # Profile name -> rule type -> fields to override (limit, severity, tiers)
+    'profiles': {},
+    # User id -> profile name
+    'assignments': {}
+}
+
+class RangeRule:
+    """One compiled range check: value -> severity rank (0 means no anomaly)
+
+    The limit and tiers become a sorted array of bounds and the rank for
+    each interval between them, so a check is a single binary search:
+    bisect for one value, np.searchsorted for a column.
+    """
+
+    __slots__ = ('type', 'metric', 'direction', 'default', 'bounds', 'ranks',
+                 'limit', '_bounds', '_ranks', '_side')
+
+    def __init__(self, spec: Dict, default):
+        self.type = spec['type']
+        self.metric = spec['metric']
+        self.direction = spec.get('direction', 'below')
+        self.default = spec.get('default', default)
+        self.limit = spec.get('limit')
+        base_rank = SEVERITY_RANK[spec['severity']]
+
+        if self.direction == 'flag':
+            self.bounds, self.ranks = (), (0, base_rank)
+        elif self.direction in ('below', 'above'):
+            tiers = sorted((tier['limit'], SEVERITY_RANK[tier['severity']]) for tier in spec.get('tiers', ()))
+            if self.direction == 'below':
+                # value < bounds[0] -> most severe tier ... value >= limit -> 0
+                points = tiers + [(self.limit, base_rank)]
+                self.bounds = tuple(bound for bound, _ in points)
+                self.ranks = tuple(rank for _, rank in points) + (0,)
+            else:
+                # value <= limit -> 0 ... value > bounds[-1] -> most severe tier
+                points = [(self.limit, base_rank)] + tiers
+                self.bounds = tuple(bound for bound, _ in points)
+                self.ranks = (0,) + tuple(rank for _, rank in points)
+            if list(self.bounds) != sorted(self.bounds):
+                raise ValueError(f"Tiers of rule {self.type} must lie beyond its limit")
+        else:
+            raise ValueError(f"Unknown rule direction: {self.direction}")
+
+        self._bounds = np.asarray(self.bounds, dtype=float)
+        self._ranks = np.asarray(self.ranks, dtype=np.int8)
+        # 'below' is strict (value < bound), 'above' is strict (value > bound)
+        self._side = 'right' if self.direction == 'below' else 'left'
+
+    def rank(self, value) -> int:
+        """Severity rank for one value"""
+        if self.direction == 'flag':
+            return self.ranks[1] if value else 0
+        if self._side == 'right':
+            return self.ranks[bisect.bisect_right(self.bounds, value)]
+        return self.ranks[bisect.bisect_left(self.bounds, value)]
+
+    def rank_array(self, values: np.ndarray) -> np.ndarray:
+        """Severity rank for each value of a column (NaN, a missing value, ranks as the default)"""
+        if self.direction == 'flag':
+            return np.where(values.astype(bool), self._ranks[1], 0).astype(np.int8)
+        ranks = self._ranks[np.searchsorted(self._bounds, values, side=self._side)]
+        if values.dtype.kind == 'f':
+            missing = np.isnan(values)
+            if missing.any():
+                ranks[missing] = 0 if self.default is None else self.rank(self.default)
+        return ranks
+
+class RuleTable:
+    """The compiled range rules of one profile"""
+
+    def __init__(self, specs: Iterable[Dict], defaults: Dict):
+        self.rules = tuple(RangeRule(spec, defaults.get(spec['metric'])) for spec in specs)
+        self.metrics = tuple(dict.fromkeys(rule.metric for rule in self.rules))
+
+    def normal_ranges(self) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+        """Metric -> (low, high) limits outside which a rule fires"""
+        ranges = {}
+        for rule in self.rules:
+            if rule.direction == 'flag':
+                continue
+            low, high = ranges.get(rule.metric, (None, None))
+            if rule.direction == 'below':
+                low = rule.limit
+            else:
+                high = rule.limit
+            ranges[rule.metric] = (low, high)
+        return ranges
+
+class RuleBook:
+    """Compiled rule tables for the default profile and every cohort profile
+
+    Built once from a config shaped like ``DEFAULT_RULES`` (missing
+    sections fall back to the defaults). Profiles override fields of
+    individual rules by type, and ``assignments`` map users to profiles;
+    unassigned users get the default table.
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = merge_rules(DEFAULT_RULES, config or {})
+        self.config = config
+        self.defaults = dict(config['defaults'])
+        self.default_table = RuleTable(config['range_rules'], self.defaults)
+        self.tables: Dict[str, RuleTable] = {}
+        for name, overrides in config['profiles'].items():
+            self.tables[name] = RuleTable(_apply_profile(config['range_rules'], overrides), self.defaults)
+        self.assignments: Dict[str, str] = {}
+        for user_id, profile in config['assignments'].items():
+            self.assign(user_id, profile)
+
+        # (type, severity) -> recommendations, falling back to (type, '*')
+        self._recommendations: Dict[Tuple[str, str], Tuple[str, ...]] = {}
+        for anomaly_type, by_severity in config['recommendations'].items():
+            for severity in SEVERITY_RANK:
+                texts = by_severity.get(severity, by_severity.get('*', ()))
+                if texts:
+                    self._recommendations[(anomaly_type, severity)] = tuple(texts)
+
+    def assign(self, user_id: str, profile: Optional[str]):
+        """Put a user on a profile (None returns them to the default)"""
+        if profile is None:
+            self.assignments.pop(user_id, None)
+            return
+        if profile not in self.tables:
+            raise ValueError(f"Unknown rule profile: {profile}")
+        self.assignments[user_id] = profile
+
+    def table_for(self, user_id: Optional[str] = None) -> RuleTable:
+        """The rule table that applies to a user"""
+        profile = self.assignments.get(user_id) if self.assignments else None
+        return self.tables[profile] if profile else self.default_table
+
+    def tables_for(self, user_ids: Optional[List[str]]) -> List[Tuple[RuleTable, Optional[np.ndarray]]]:
+        """Split batch rows by rule table: (table, row indices or None for all)"""
+        if not self.assignments or user_ids is None:
+            return [(self.default_table, None)]
+        profiles = np.array([self.assignments.get(user_id, '') for user_id in user_ids])
+        names = np.unique(profiles)
+        if len(names) == 1:
+            return [(self.table_for(user_ids[0]), None)]
+        return [(self.tables[name] if name else self.default_table, np.flatnonzero(profiles == name))
+                for name in names]
+
+    def recommend(self, anomalies: List[Dict]) -> List[str]:
+        """Recommendations for a set of anomalies, deduplicated in order"""
+        lookup = self._recommendations
+        recommendations = []
+        for anomaly in anomalies:
+            recommendations.extend(lookup.get((anomaly['type'], anomaly['severity']), ()))
+        return list(dict.fromkeys(recommendations))
+
+def merge_rules(base: Dict, overrides: Dict) -> Dict:
+    """Overlay a (partial) rules config onto another
+
+    ``range_rules`` entries replace or extend the base rules by type;
+    the other sections are merged key by key.
+    """
+    merged = copy.deepcopy(base)
+    for section, value in overrides.items():
+        if section == 'range_rules':
+            by_type = {rule['type']: rule for rule in merged['range_rules']}
+            for rule in value:
+                by_type[rule['type']] = {**by_type.get(rule['type'], {}), **rule}
+            merged['range_rules'] = list(by_type.values())
+        elif isinstance(value, dict):
+            merged.setdefault(section, {}).update(copy.deepcopy(value))
+        else:
+            raise ValueError(f"Unknown rules section: {section}")
+    return merged
+
+def _apply_profile(specs: List[Dict], overrides: Dict[str, Dict]) -> List[Dict]:
+    known = {spec['type'] for spec in specs}
+    unknown = set(overrides) - known
+    if unknown:
+        raise ValueError(f"Profile overrides unknown rules: {', '.join(sorted(unknown))}")
+    return [{**spec, **overrides.get(spec['type'], {})} for spec in specs]
+
+def load_rules(path: str) -> RuleBook:
+    """Compile a rules config from a JSON file"""
+    with open(path, 'r') as f:
+        return RuleBook(json.load(f))
@@ -0,0 +1,188 @@
+"""
+Multi-user detector registry for Health Monitoring
+Routes each reading to its user's trend windows so users never mix
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from anomaly_detector import HealthAnomalyDetector, TrendState
+from state_snapshot import SnapshotReader, restore_snapshot, save_snapshot
+
+class DetectorRegistry:
+    """Per-user anomaly detection state keyed by user_id
+
+    One HealthAnomalyDetector holds the (shared) configuration; each user
+    only owns a small TrendState. Users are kept in least-recently-used
+    order, so idle users are evicted from the front once they exceed the
+    TTL or the registry is over its user or memory budget.
+    """
+
+    def __init__(self, detector: Optional[HealthAnomalyDetector] = None,
+                 max_users: Optional[int] = None,
+                 memory_budget_bytes: Optional[int] = None,
+                 idle_ttl: Optional[float] = 3600.0,
+                 sweep_interval: int = 1024,
+                 clock: Callable[[], float] = time.monotonic):
+        self.detector = detector or HealthAnomalyDetector()
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval  # Lookups between TTL sweeps
+        self.clock = clock
+        self.states: "OrderedDict[str, TrendState]" = OrderedDict()
+        self.evicted = 0
+        self.snapshot: Optional[SnapshotReader] = None  # Lazily restored states
+        self._lookups = 0
+
+        # A memory budget is enforced as a user cap derived from state size
+        self.state_bytes = self.detector.new_state().nbytes()
+        budget_cap = None if memory_budget_bytes is None else memory_budget_bytes // self.state_bytes
+        caps = [cap for cap in (max_users, budget_cap) if cap is not None]
+        self.max_users = min(caps) if caps else None
+        if self.max_users is not None and self.max_users < 1:
+            raise ValueError(f"User and memory budgets must allow at least one user "
+                             f"({self.state_bytes} bytes of state each)")
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.states
+
+    def get_state(self, user_id: str) -> TrendState:
+        """Return the user's state, creating it and evicting as needed"""
+        now = self.clock()
+        state = self.states.get(user_id)
+        if state is None:
+            state = self._from_snapshot(user_id) or self.detector.new_state()
+            self.states[user_id] = state
+            if self.max_users is not None and len(self.states) > self.max_users:
+                self.states.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.states.move_to_end(user_id)
+        state.last_seen = now
+
+        self._lookups += 1
+        if self._lookups >= self.sweep_interval:
+            self.evict_idle(now)
+        return state
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop users not seen within idle_ttl, returning how many"""
+        self._lookups = 0
+        if self.idle_ttl is None:
+            return 0
+
+        cutoff = (self.clock() if now is None else now) - self.idle_ttl
+        evicted = 0
+        # LRU order means the idle users are all at the front
+        while self.states:
+            user_id, state = next(iter(self.states.items()))
+            if state.last_seen >= cutoff:
+                break
+            del self.states[user_id]
+            evicted += 1
+
+        self.evicted += evicted
+        return evicted
+
+    def remove(self, user_id: str):
+        """Forget a user's state"""
+        self.states.pop(user_id, None)
+        if self.snapshot is not None:
+            self.snapshot.index.pop(user_id, None)
+
+    def save_snapshot(self, path: str) -> int:
+        """Write all live per-user state to ``path`` (see state_snapshot)
+
+        Users not yet seen since a lazy restore are carried over from the
+        attached snapshot without being built.
+        """
+        return save_snapshot(self, path)
+
+    def restore_snapshot(self, path: str, lazy: bool = False) -> int:
+        """Warm the registry from a snapshot written by save_snapshot"""
+        return restore_snapshot(self, path, lazy=lazy)
+
+    def attach_snapshot(self, reader: SnapshotReader):
+        """Serve unknown users from ``reader`` before starting them fresh"""
+        self.snapshot = reader
+
+    def materialize(self) -> int:
+        """Build every state still pending in an attached snapshot, returning how many"""
+        if self.snapshot is None:
+            return 0
+        pending = self.snapshot.index
+        now = self.clock()
+        restored = 0
+        # Snapshot rows are in LRU order, so pending users go in front of live ones
+        for user_id in sorted(pending, key=pending.get, reverse=True):
+            if user_id not in self.states:
+                state = self.snapshot.state(pending[user_id])
+                state.last_seen = now
+                self.states[user_id] = state
+                self.states.move_to_end(user_id, last=False)
+                restored += 1
+        while self.max_users is not None and len(self.states) > self.max_users:
+            self.states.popitem(last=False)
+        self.snapshot = None
+        return restored
+
+    def _from_snapshot(self, user_id: str) -> Optional[TrendState]:
+        if self.snapshot is None:
+            return None
+        row = self.snapshot.index.pop(user_id, None)
+        return None if row is None else self.snapshot.state(row)
+
+    def analyze_reading(self, reading: Dict) -> Dict:
+        """Analyze a reading against its own user's history"""
+        state = self.get_state(reading.get('user_id', 'unknown'))
+        return self.detector.analyze_reading(reading, state)
+
+    def analyze_batch(self, batch) -> List[Dict]:
+        """Analyze a columnar batch that may interleave many users
+
+        Rows are grouped by user_id (keeping each user's row order), each
+        group is scored with the vectorized detector path, and results are
+        returned in the original row order.
+        """
+        if isinstance(batch, np.ndarray):
+            user_ids = batch['user_id'] if 'user_id' in batch.dtype.names else None
+            take = lambda rows: batch[rows]
+        else:
+            user_ids = batch.get('user_id')
+            columns = {name: np.asarray(values) for name, values in batch.items()}
+            take = lambda rows: {name: values[rows] for name, values in columns.items()}
+
+        if user_ids is None:
+            n = len(next(iter(batch.values()))) if isinstance(batch, dict) else len(batch)
+            user_ids = np.full(n, 'unknown')
+
+        users, inverse = np.unique(np.asarray(user_ids).astype(str), return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(users) + 1))
+
+        results: List[Optional[Dict]] = [None] * len(order)
+        for k, user_id in enumerate(users.tolist()):
+            rows = order[bounds[k]:bounds[k + 1]]
+            state = self.get_state(user_id)
+            for row, result in zip(rows.tolist(), self.detector.analyze_batch(take(rows), state)):
+                results[row] = result
+        return results
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by per-user state"""
+        return len(self.states) * self.state_bytes
+
+    def stats(self) -> Dict:
+        """Summary of the registry's size and evictions"""
+        return {
+            'users': len(self.states),
+            'max_users': self.max_users,
+            'state_bytes': self.state_bytes,
+            'memory_bytes': self.memory_usage(),
+            'evicted': self.evicted
+        }
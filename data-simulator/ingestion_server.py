@@ -0,0 +1,443 @@
+"""
+asyncio ingestion service for wearable health readings
+Newline-delimited JSON over TCP, validated and scored in batches
+"""
+
+import argparse
+import asyncio
+import datetime
+import math
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from detector_registry import DetectorRegistry
+from health_data_simulator import WearableSimulator, json_codec, metrics, records_to_batch
+from readings import READING_FIELDS
+
+# Field -> accepted Python types, derived from the reading schema
+_TYPE_MAP = {int: (int,), float: (int, float), bool: (bool,), str: (str,)}
+SCHEMA = {
+    name: _TYPE_MAP[kind]
+    for name, kind in READING_FIELDS
+    if name not in ('latitude', 'longitude')
+}
+SCHEMA['location'] = (dict,)  # latitude/longitude travel nested
+logger = metrics.get_logger('ingestion')
+
+REQUIRED_FIELDS = ('timestamp', 'user_id', 'heart_rate', 'spo2', 'temperature')
+INT_LIMIT = 1 << 31  # Integer fields must fit the detector's numeric columns
+
+def validate_reading(reading) -> Dict:
+    """Check a decoded reading against the reading schema
+
+    Only ``REQUIRED_FIELDS`` must be present; every field that is present
+    must have the schema's type, and numbers must be finite and fit the
+    batch columns, so one reading can never fail a whole batch. A whole
+    float in an integer field (72.0 from clients that write all numbers
+    as floats) is converted to int in place. Raises ValueError on the
+    first problem.
+    """
+    if not isinstance(reading, dict):
+        raise ValueError("reading must be a JSON object")
+    for name in REQUIRED_FIELDS:
+        if name not in reading:
+            raise ValueError(f"missing field: {name}")
+
+    for name, value in reading.items():
+        accepted = SCHEMA.get(name)
+        if accepted is None:
+            continue  # Unknown extras are passed through untouched
+        if isinstance(value, float) and float not in accepted and int in accepted and value.is_integer():
+            value = reading[name] = int(value)
+        # bool is an int subclass, so only accept it where bool is expected
+        if not isinstance(value, accepted) or (isinstance(value, bool) and bool not in accepted):
+            raise ValueError(f"invalid type for {name}: {type(value).__name__}")
+        _check_number(name, value)
+
+    location = reading.get('location')
+    if location is not None:
+        for key in ('latitude', 'longitude'):
+            value = location.get(key)
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise ValueError(f"location.{key} must be a number")
+            _check_number(f"location.{key}", value)
+
+    try:
+        datetime.datetime.fromisoformat(reading['timestamp'])
+    except ValueError:
+        raise ValueError("timestamp must be ISO 8601") from None
+    return reading
+
+def _check_number(name: str, value):
+    if isinstance(value, bool):
+        return
+    if isinstance(value, int) and not -INT_LIMIT <= value < INT_LIMIT:
+        raise ValueError(f"{name} is out of range")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"{name} must be finite")
+
+class _Connection:
+    """A device connection and how many of its readings await scoring"""
+
+    __slots__ = ('writer', 'pending', 'idle')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+class IngestionServer:
+    """Accepts device connections and scores their readings in batches
+
+    Each connection is a coroutine that only reads lines, validates them
+    and queues them, so idle devices cost no threads. A single batcher
+    task drains the queue by size or time and runs the detector's
+    vectorized path. Devices get a JSON line back for rejected readings
+    and for readings whose analysis is not normal.
+
+    With ``snapshot_path`` the registry is restored from it on start,
+    saved there every ``snapshot_interval`` seconds between batches, and
+    saved once more on close, each time in a worker thread. Once close() has begun, new readings are
+    rejected; readings already on their way into the queue are scored.
+    """
+
+    def __init__(self, registry: Optional[DetectorRegistry] = None, batch_size: int = 500,
+                 flush_interval: float = 0.05, queue_size: int = 10000,
+                 on_results: Optional[Callable[[List[Dict], List[Dict]], None]] = None,
+                 snapshot_path: Optional[str] = None, snapshot_interval: float = 300.0):
+        self.registry = registry or DetectorRegistry()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.on_results = on_results  # Called with (readings, analyses) per batch
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_at = time.monotonic()
+        self.stats = {'connections': 0, 'open_connections': 0, 'accepted': 0,
+                      'rejected': 0, 'batches': 0, 'alerts': 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._server = None
+        self._closing = False
+        self._enqueuing = 0  # Connections waiting to put a reading on a full queue
+
+    async def start(self, host: str = '127.0.0.1', port: int = 9000):
+        """Start the batcher and listen for TCP connections"""
+        self.start_batcher()
+        self._server = await asyncio.start_server(self.handle_connection, host, port)
+        return self._server
+
+    def start_batcher(self):
+        """Start the batching task (also needed for local connections)"""
+        if self._batcher is None:
+            self.restore_snapshot()
+            self._closing = False
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            metrics.track_queue('ingestion', self._queue.qsize)
+            self._batcher = asyncio.create_task(self._run_batcher())
+
+    async def close(self):
+        """Stop accepting connections and score everything still queued"""
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            try:
+                self._queue.put_nowait(None)  # Wakes an idle batcher
+            except asyncio.QueueFull:
+                pass  # A busy batcher sees _closing once the queue runs dry
+            await self._batcher
+            self._batcher = None
+            await asyncio.get_running_loop().run_in_executor(None, self.save_snapshot)
+
+    def restore_snapshot(self) -> int:
+        """Warm the registry from the last snapshot, if there is one"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        started = time.perf_counter()
+        try:
+            users = self.registry.restore_snapshot(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Ignoring detector snapshot {self.snapshot_path}: {e}")
+            return 0
+        logger.info(f"♻️ Restored {users:,} users from {self.snapshot_path} "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return users
+
+    def save_snapshot(self) -> int:
+        """Write the registry to snapshot_path, if configured"""
+        self._snapshot_at = time.monotonic()
+        if not self.snapshot_path:
+            return 0
+        try:
+            return self.registry.save_snapshot(self.snapshot_path)
+        except OSError as e:
+            logger.error(f"❌ Failed to save detector snapshot: {e}")
+            return 0
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer):
+        """Read newline-delimited readings from one device"""
+        self.stats['connections'] += 1
+        self.stats['open_connections'] += 1
+        connection = _Connection(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    reading = validate_reading(json_codec.loads(line))
+                except ValueError as e:
+                    self.stats['rejected'] += 1
+                    self._reply(writer, {'error': str(e)})
+                    continue
+                if self._closing:
+                    self.stats['rejected'] += 1
+                    self._reply(writer, {'error': 'server is shutting down'})
+                    break
+                # Blocks when the queue is full, pushing back on the device
+                connection.pending += 1
+                connection.idle.clear()
+                self._enqueuing += 1
+                try:
+                    await self._queue.put((reading, connection))
+                finally:
+                    self._enqueuing -= 1
+            # Device finished sending: deliver its last replies, then hang up
+            await connection.idle.wait()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.stats['open_connections'] -= 1
+            writer.close()
+
+    async def _run_batcher(self):
+        """Drain the queue in batches of up to batch_size or flush_interval"""
+        while True:
+            item = await self._next_item()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._next_item(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    break
+                batch.append(item)
+            self._process(batch)
+            # Between batches no state is mid-update, so the snapshot is consistent;
+            # it is written off the loop, which keeps connections served meanwhile
+            if self.snapshot_path and time.monotonic() - self._snapshot_at >= self.snapshot_interval:
+                await asyncio.get_running_loop().run_in_executor(None, self.save_snapshot)
+
+    async def _next_item(self):
+        """The next queued reading, or None once closing and no more can arrive"""
+        while True:
+            if self._closing and self._queue.empty() and not self._enqueuing:
+                return None
+            if self._closing:
+                # Readings blocked on a full queue land after close() began
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    continue
+            else:
+                item = await self._queue.get()
+            if item is not None:  # None only wakes the batcher up
+                return item
+
+    def _process(self, batch: List[Tuple[Dict, object]]):
+        readings = [reading for reading, _ in batch]
+        try:
+            try:
+                analyses = self.registry.analyze_batch(records_to_batch(readings))
+            except Exception as e:
+                # Never let one bad batch stall the batcher or its connections
+                logger.error("❌ Failed to analyze batch: %s", e)
+                for _, connection in batch:
+                    self._reply(connection.writer, {'error': 'analysis failed'})
+                return
+            self.stats['accepted'] += len(readings)
+            self.stats['batches'] += 1
+
+            for (_, connection), analysis in zip(batch, analyses):
+                if analysis['status'] != 'normal':
+                    self.stats['alerts'] += 1
+                    self._reply(connection.writer, {
+                        'user_id': analysis['user_id'],
+                        'timestamp': analysis['timestamp'],
+                        'status': analysis['status'],
+                        'anomalies': [anomaly['type'] for anomaly in analysis['anomalies']]
+                    })
+        finally:
+            for _, connection in batch:
+                connection.pending -= 1
+                if not connection.pending:
+                    connection.idle.set()
+        if self.on_results:
+            try:
+                self.on_results(readings, analyses)
+            except Exception as e:
+                logger.error("❌ Result callback failed: %s", e)
+
+    @staticmethod
+    def _reply(writer, message: Dict):
+        if not writer.is_closing():
+            writer.write(json_codec.encode_line(message))
+
+class LocalWriter:
+    """In-process stand-in for asyncio.StreamWriter that feeds a peer reader"""
+
+    def __init__(self, peer: asyncio.StreamReader):
+        self._peer = peer
+        self._closing = False
+
+    def write(self, data: bytes):
+        if not self._closing:
+            self._peer.feed_data(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    async def drain(self):
+        await asyncio.sleep(0)  # Let the peer run, like a real transport would
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def can_write_eof(self) -> bool:
+        return True
+
+    def write_eof(self):
+        self._peer.feed_eof()
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._peer.feed_eof()
+
+    async def wait_closed(self):
+        pass
+
+    def get_extra_info(self, name, default=None):
+        return {'peername': ('local', 0)}.get(name, default)
+
+async def open_local_connection(server: IngestionServer) -> Tuple[asyncio.StreamReader, LocalWriter]:
+    """Connect to a server in-process, without sockets"""
+    server.start_batcher()
+    client_reader = asyncio.StreamReader()
+    server_reader = asyncio.StreamReader()
+    asyncio.create_task(server.handle_connection(server_reader, LocalWriter(client_reader)))
+    return client_reader, LocalWriter(server_reader)
+
+async def run_load(connect: Callable, devices: int = 100, readings: int = 10,
+                   interval: float = 0.0, concurrency: int = 1000) -> Dict:
+    """Simulate many devices, each sending readings over its own connection"""
+    limit = asyncio.Semaphore(concurrency)  # Bounds simultaneous connection setup
+    replies = {'alerts': 0, 'errors': 0}
+
+    async def device(index: int):
+        simulator = WearableSimulator(f"load_user_{index:06d}")
+        async with limit:
+            reader, writer = await connect()
+
+        async def collect():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                replies['errors' if b'"error"' in line else 'alerts'] += 1
+
+        collector = asyncio.create_task(collect())
+        for _ in range(readings):
+            reading = simulator.to_dict(simulator.generate_reading())
+            writer.write(json_codec.encode_line(reading))
+            await writer.drain()
+            if interval:
+                await asyncio.sleep(interval)
+        # Half-close so the server can still send the last replies
+        writer.write_eof()
+        await collector
+        writer.close()
+        await writer.wait_closed()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(device(i) for i in range(devices)))
+    elapsed = time.perf_counter() - started
+    total = devices * readings
+    return {'readings': total, 'seconds': round(elapsed, 3),
+            'readings_per_sec': round(total / max(elapsed, 1e-9)), **replies}
+
+async def _serve(host: str, port: int, metrics_port: Optional[int] = None,
+                 snapshot_path: Optional[str] = None, snapshot_interval: float = 300.0):
+    server = IngestionServer(snapshot_path=snapshot_path, snapshot_interval=snapshot_interval)
+    await server.start(host, port)
+    logger.info(f"📡 Ingestion server listening on {host}:{port}")
+    if metrics_port:
+        metrics.serve_metrics(metrics_port, host)
+        logger.info(f"📈 Metrics at http://{host}:{metrics_port}/metrics")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logger.info(f"📊 {server.stats}", extra={'fields': server.stats})
+    finally:
+        await server.close()
+
+async def _load(host: str, port: int, devices: int, readings: int, interval: float) -> Dict:
+    return await run_load(lambda: asyncio.open_connection(host, port), devices, readings, interval)
+
+async def _local(devices: int, readings: int) -> Dict:
+    server = IngestionServer()
+    result = await run_load(lambda: open_local_connection(server), devices, readings)
+    await server.close()
+    result['server'] = server.stats
+    return result
+
+def main():
+    """Run the ingestion server, a TCP load generator, or an in-process test"""
+    parser = argparse.ArgumentParser(description="Wearable reading ingestion service")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve = subparsers.add_parser('serve', help="listen for device connections")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=9000)
+    serve.add_argument('--metrics-port', type=int, default=None, help="serve /metrics on this port")
+    serve.add_argument('--log-json', action='store_true', default=None, help="structured JSON log lines")
+    serve.add_argument('--snapshot', default=None, help="detector state snapshot directory")
+    serve.add_argument('--snapshot-interval', type=float, default=300.0, help="seconds between snapshots")
+    load = subparsers.add_parser('load', help="simulate devices against a running server")
+    load.add_argument('--host', default='127.0.0.1')
+    load.add_argument('--port', type=int, default=9000)
+    load.add_argument('--devices', type=int, default=1000)
+    load.add_argument('--readings', type=int, default=10)
+    load.add_argument('--interval', type=float, default=0.0)
+    local = subparsers.add_parser('local', help="server and devices in-process, no sockets")
+    local.add_argument('--devices', type=int, default=1000)
+    local.add_argument('--readings', type=int, default=10)
+    args = parser.parse_args()
+    metrics.configure_logging(structured=getattr(args, 'log_json', None))
+
+    try:
+        if args.command == 'serve':
+            asyncio.run(_serve(args.host, args.port, args.metrics_port,
+                               args.snapshot, args.snapshot_interval))
+        elif args.command == 'load':
+            print(f"📈 {asyncio.run(_load(args.host, args.port, args.devices, args.readings, args.interval))}")
+        else:
+            print(f"📈 {asyncio.run(_local(args.devices, args.readings))}")
+    except KeyboardInterrupt:
+        print("\n🛑 Stopped")
+
+if __name__ == "__main__":
+    main()
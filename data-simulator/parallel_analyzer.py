@@ -0,0 +1,233 @@
+"""
+Multi-core anomaly analysis for Health Monitoring
+Partitions readings by user_id across worker processes
+"""
+
+import argparse
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from detector_registry import DetectorRegistry
+from health_data_simulator import metrics
+
+logger = metrics.get_logger('parallel')
+
+def partition_for(user_id: str, partitions: int) -> int:
+    """Stable partition for a user (unlike hash(), same in every process)"""
+    return zlib.crc32(str(user_id).encode('utf-8')) % partitions
+
+def _worker_main(inbox, outbox, registry_options: Dict):
+    """Worker loop: owns the registry for every user hashed to it"""
+    registry = DetectorRegistry(**registry_options)
+    while True:
+        chunk = inbox.get()
+        if chunk is None:
+            break
+        try:
+            outbox.put([(seq, registry.analyze_reading(reading)) for seq, reading in chunk])
+        except Exception:
+            outbox.put(('error', traceback.format_exc()))
+
+class ParallelAnalyzer:
+    """Process pool that analyzes readings with per-user ordering
+
+    Every user is pinned to one worker by a stable hash of user_id, so each
+    worker's DetectorRegistry sees that user's readings in order and no
+    state is shared between processes. Results are merged back into input
+    order as they arrive.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 256,
+                 queue_depth: int = 8, registry_options: Optional[Dict] = None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.queue_depth = queue_depth  # Chunks buffered per worker
+        self.registry_options = registry_options or {}
+        self._processes = []
+        self._inboxes = []
+        self._outbox = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        """Spawn the worker processes"""
+        if self._processes:
+            return
+        ctx = multiprocessing.get_context()
+        self._outbox = ctx.Queue()
+        for _ in range(self.workers):
+            inbox = ctx.Queue(maxsize=self.queue_depth)
+            process = ctx.Process(target=_worker_main, args=(inbox, self._outbox, self.registry_options), daemon=True)
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+
+    def close(self):
+        """Stop the workers once they have drained their queues
+
+        Results nobody will read (after an error or an early exit) are
+        drained while waiting, since a worker blocked on a full outbox
+        pipe could otherwise never exit. Dead workers are skipped.
+        """
+        for inbox, process in zip(self._inboxes, self._processes):
+            while process.is_alive():
+                try:
+                    inbox.put(None, timeout=0.05)
+                    break
+                except queue.Full:
+                    self._drain()
+        while any(process.is_alive() for process in self._processes):
+            self._drain()
+            for process in self._processes:
+                process.join(timeout=0.01)
+        for inbox in self._inboxes:
+            # Chunks still buffered for a dead worker must not block interpreter exit
+            inbox.cancel_join_thread()
+            inbox.close()
+        self._processes = []
+        self._inboxes = []
+        self._outbox = None
+
+    def _drain(self):
+        try:
+            while True:
+                self._outbox.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _check_workers(self):
+        """Fail instead of waiting forever on a worker that died (OOM kill, segfault)"""
+        for process in self._processes:
+            if not process.is_alive():
+                raise RuntimeError(f"Analysis worker {process.pid} exited unexpectedly "
+                                   f"(exit code {process.exitcode})")
+
+    def analyze(self, readings: Iterable[Dict]) -> Iterator[Dict]:
+        """Analyze readings in parallel, yielding results in input order"""
+        self.start()
+        progress = {'sent': 0, 'done': False, 'error': None}
+        stopped = threading.Event()
+
+        def put(worker: int, chunk: List):
+            # Time out so the feeder notices when results are no longer wanted
+            while not stopped.is_set():
+                try:
+                    self._inboxes[worker].put(chunk, timeout=0.05)
+                    return
+                except queue.Full:
+                    continue
+            raise InterruptedError
+
+        def feed():
+            # Runs in a thread so full worker queues never block result merging
+            buffers: List[List] = [[] for _ in range(self.workers)]
+            try:
+                for seq, reading in enumerate(readings):
+                    worker = partition_for(reading.get('user_id', 'unknown'), self.workers)
+                    buffers[worker].append((seq, reading))
+                    progress['sent'] = seq + 1
+                    if len(buffers[worker]) >= self.chunk_size:
+                        put(worker, buffers[worker])
+                        buffers[worker] = []
+                for worker, buffer in enumerate(buffers):
+                    if buffer:
+                        put(worker, buffer)
+            except InterruptedError:
+                pass
+            except Exception as e:
+                progress['error'] = e
+            progress['done'] = True
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        pending = {}
+        next_seq = 0
+        try:
+            while True:
+                if progress['done'] and next_seq >= progress['sent']:
+                    break
+                try:
+                    chunk = self._outbox.get(timeout=0.05)
+                except queue.Empty:
+                    self._check_workers()
+                    continue
+                if isinstance(chunk, tuple) and chunk[0] == 'error':
+                    raise RuntimeError(f"Analysis worker failed:\n{chunk[1]}")
+                pending.update(chunk)
+                # Release everything that is now contiguous with the output
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+        finally:
+            # Also reached on errors and when the consumer stops early
+            stopped.set()
+            feeder.join()
+        if progress['error'] is not None:
+            raise progress['error']
+
+def generate_benchmark_readings(count: int, users: int, seed: int = 42) -> List[Dict]:
+    """Synthetic readings spread round-robin over many users"""
+    import random
+    from health_data_simulator import WearableSimulator
+
+    random.seed(seed)
+    simulators = [WearableSimulator(f"bench_user_{i:06d}") for i in range(users)]
+    return [
+        simulators[i % users].to_dict(simulators[i % users].generate_reading())
+        for i in range(count)
+    ]
+
+def run_benchmark(readings: int = 200000, users: int = 1000, max_workers: Optional[int] = None,
+                  chunk_size: int = 256) -> List[Dict]:
+    """Measure throughput from a single process up to max_workers"""
+    max_workers = max_workers or multiprocessing.cpu_count()
+    data = generate_benchmark_readings(readings, users)
+
+    # In-process baseline without any IPC
+    registry = DetectorRegistry()
+    start = time.perf_counter()
+    for reading in data:
+        registry.analyze_reading(reading)
+    baseline = len(data) / (time.perf_counter() - start)
+
+    results = [{'workers': 0, 'readings_per_sec': round(baseline), 'speedup': 1.0}]
+    logger.info(f"📈 Parallel analysis benchmark: {readings} readings, {users} users, chunk size {chunk_size}")
+    logger.info(f"   in-process: {baseline:,.0f} readings/sec", extra={'fields': results[0]})
+
+    # 1, 2, 4, ... up to and including max_workers
+    worker_counts = [1 << i for i in range(max_workers.bit_length()) if 1 << i < max_workers] + [max_workers]
+    for workers in worker_counts:
+        with ParallelAnalyzer(workers=workers, chunk_size=chunk_size) as analyzer:
+            start = time.perf_counter()
+            count = sum(1 for _ in analyzer.analyze(data))
+            rate = count / (time.perf_counter() - start)
+        results.append({'workers': workers, 'readings_per_sec': round(rate), 'speedup': round(rate / baseline, 2)})
+        logger.info(f"   {workers:>2} worker(s): {rate:,.0f} readings/sec ({rate / baseline:.2f}x)",
+                    extra={'fields': results[-1]})
+
+    return results
+
+def main():
+    """Run the parallel throughput benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark multi-core anomaly analysis")
+    parser.add_argument('--readings', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--max-workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args()
+    metrics.configure_logging()
+    run_benchmark(args.readings, args.users, args.max_workers, args.chunk_size)
+
+if __name__ == "__main__":
+    main()
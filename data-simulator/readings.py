@@ -0,0 +1,226 @@
+"""
+Compact health reading types for Health Monitoring
+Slotted readings, dict / columnar conversion and array-backed history
+"""
+
+import datetime
+from array import array
+from typing import Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+# Field name -> Python type, in record order. The wire and storage format
+# nests latitude/longitude under 'location'; a HealthReading keeps them flat.
+READING_FIELDS = (
+    ('timestamp', str),
+    ('user_id', str),
+    ('heart_rate', int),
+    ('spo2', float),
+    ('temperature', float),
+    ('fall_detected', bool),
+    ('activity_level', str),
+    ('latitude', float),
+    ('longitude', float),
+    ('battery_level', int)
+)
+FIELD_NAMES = tuple(name for name, _ in READING_FIELDS)
+
+class HealthReading:
+    """One sensor reading with fixed slots instead of a per-reading dict
+
+    ``get`` mirrors dict.get, so the detector accepts a HealthReading
+    wherever it accepts a reading dict.
+    """
+
+    __slots__ = FIELD_NAMES
+
+    def __init__(self, timestamp: str, user_id: str, heart_rate: int, spo2: float,
+                 temperature: float, fall_detected: bool, activity_level: str,
+                 latitude: float, longitude: float, battery_level: int):
+        self.timestamp = timestamp
+        self.user_id = user_id
+        self.heart_rate = heart_rate
+        self.spo2 = spo2
+        self.temperature = temperature
+        self.fall_detected = fall_detected
+        self.activity_level = activity_level
+        self.latitude = latitude
+        self.longitude = longitude
+        self.battery_level = battery_level
+
+    def __repr__(self) -> str:
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in FIELD_NAMES)
+        return f"HealthReading({values})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, HealthReading):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in FIELD_NAMES)
+
+    def get(self, name: str, default=None):
+        """Field value, or default when the field is unknown or unset"""
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    @property
+    def location(self) -> Dict[str, float]:
+        return {'latitude': self.latitude, 'longitude': self.longitude}
+
+    @location.setter
+    def location(self, location: Optional[Dict[str, float]]):
+        location = location or {}
+        self.latitude = location.get('latitude')
+        self.longitude = location.get('longitude')
+
+    def to_dict(self) -> Dict:
+        """Reading dict in the wire/storage format (nested location)"""
+        return {
+            'timestamp': self.timestamp,
+            'user_id': self.user_id,
+            'heart_rate': self.heart_rate,
+            'spo2': self.spo2,
+            'temperature': self.temperature,
+            'fall_detected': self.fall_detected,
+            'activity_level': self.activity_level,
+            'location': {'latitude': self.latitude, 'longitude': self.longitude},
+            'battery_level': self.battery_level
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'HealthReading':
+        """Build a reading from a dict, missing fields become None"""
+        location = data.get('location') or {}
+        return cls(
+            data.get('timestamp'), data.get('user_id'), data.get('heart_rate'),
+            data.get('spo2'), data.get('temperature'), data.get('fall_detected'),
+            data.get('activity_level'), location.get('latitude'), location.get('longitude'),
+            data.get('battery_level')
+        )
+
+def to_columns(readings: List[HealthReading]) -> Dict[str, np.ndarray]:
+    """Readings as a FleetSimulator-style columnar batch"""
+    batch = {}
+    for name, kind in READING_FIELDS:
+        values = [getattr(reading, name) for reading in readings]
+        if kind is str:
+            batch[name] = np.asarray(values, dtype=object)
+        elif name in ('latitude', 'longitude'):
+            batch[name] = np.asarray([np.nan if v is None else v for v in values], dtype=float)
+        else:
+            batch[name] = np.asarray(values)
+    return batch
+
+def from_columns(batch: Dict[str, np.ndarray]) -> List[HealthReading]:
+    """Rows of a columnar batch as readings (absent columns become None)"""
+    n = len(next(iter(batch.values())))
+    columns = []
+    for name in FIELD_NAMES:
+        values = batch.get(name)
+        columns.append(values.tolist() if values is not None else [None] * n)
+    return [HealthReading(*row) for row in zip(*columns)]
+
+# History field -> array typecode; only what trend analysis looks back at
+HISTORY_FIELDS = (
+    ('timestamp', 'd'),      # POSIX seconds, NaN if missing or unparseable
+    ('heart_rate', 'd'),
+    ('spo2', 'd'),
+    ('temperature', 'd'),
+    ('fall_detected', 'b')
+)
+
+def _epoch_seconds(timestamp) -> float:
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return float('nan')
+
+class ReadingHistory:
+    """Ring buffer of the newest readings' numeric fields, one array per field
+
+    About 33 bytes per entry instead of a reading dict (and its nested
+    location dict) of well over a kilobyte. Iterating and indexing (like
+    the deque it replaced, negative indexes count from the newest) yield
+    small dicts of the stored fields: the timestamp as a naive local ISO
+    string, missing numbers as None and fall_detected as a bool.
+    """
+
+    __slots__ = ('maxlen', 'columns', 'head', 'count')
+
+    def __init__(self, maxlen: int = 100):
+        self.maxlen = maxlen
+        self.columns = {name: array(code, [0]) * maxlen for name, code in HISTORY_FIELDS}
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, reading):
+        """Store one reading (a dict or a HealthReading)"""
+        columns = self.columns
+        head = self.head
+        columns['timestamp'][head] = _epoch_seconds(reading.get('timestamp'))
+        columns['heart_rate'][head] = _number(reading.get('heart_rate'))
+        columns['spo2'][head] = _number(reading.get('spo2'))
+        columns['temperature'][head] = _number(reading.get('temperature'))
+        columns['fall_detected'][head] = 1 if reading.get('fall_detected') else 0
+        self.head = (head + 1) % self.maxlen
+        self.count = min(self.count + 1, self.maxlen)
+
+    def extend_columns(self, columns: Dict[str, np.ndarray], present: Optional[set] = None):
+        """Store the newest rows of a columnar batch"""
+        n = len(columns['heart_rate'])
+        start = max(0, n - self.maxlen)
+        timestamps = columns.get('timestamp')
+        for i in range(start, n):
+            row = {}
+            for name, _ in HISTORY_FIELDS:
+                if name == 'timestamp':
+                    row[name] = timestamps[i] if timestamps is not None else None
+                elif name in columns and (present is None or name in present):
+                    row[name] = columns[name][i].item()
+            self.append(row)
+
+    def column(self, name: str) -> np.ndarray:
+        """One field, oldest entry first"""
+        values = np.frombuffer(self.columns[name], dtype=np.int8 if name == 'fall_detected' else float)
+        if self.count < self.maxlen:
+            return values[:self.count].copy()
+        return np.concatenate([values[self.head:], values[:self.head]])
+
+    def __iter__(self) -> Iterator[Dict]:
+        columns = [self.column(name).tolist() for name, _ in HISTORY_FIELDS]
+        for row in zip(*columns):
+            yield _entry(*row)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict, List[Dict]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("history index out of range")
+        slot = (self.head - self.count + index) % self.maxlen
+        return _entry(*(self.columns[name][slot] for name, _ in HISTORY_FIELDS))
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in self.columns.values())
+
+def _number(value) -> float:
+    return float('nan') if value is None else float(value)
+
+def _entry(timestamp: float, heart_rate: float, spo2: float, temperature: float, fall_detected: int) -> Dict:
+    """A history row as a reading-style dict"""
+    return {
+        'timestamp': None if timestamp != timestamp else datetime.datetime.fromtimestamp(timestamp).isoformat(),
+        'heart_rate': None if heart_rate != heart_rate else heart_rate,
+        'spo2': None if spo2 != spo2 else spo2,
+        'temperature': None if temperature != temperature else temperature,
+        'fall_detected': bool(fall_detected)
+    }
@@ -0,0 +1,399 @@
+"""
+Historical re-scoring job for Health Monitoring
+Replays stored day partitions through the detector, per user and in parallel, with checkpoints
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import time
+import traceback
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from anomaly_detector import HealthAnomalyDetector
+from detection_rules import load_rules
+from health_data_simulator import import_storage_module, json_codec, metrics
+from parallel_analyzer import partition_for
+
+CHECKPOINT_FILE = "checkpoint.json"
+STATE_FILE = "state_{worker}.pkl"
+ANOMALIES_FILE = "anomalies_{day}.part{worker}.jsonl"
+STATUS_FILE = "status_{day}.part{worker}.jsonl"
+PROGRESS_POLL = 1.0  # Seconds between worker liveness checks while waiting
+
+# Columns the detector scores; a row missing any of them takes the scalar path
+SCORED_FIELDS = ('heart_rate', 'spo2', 'temperature', 'fall_detected')
+
+_USER_ID_RE = re.compile(rb'"user_id"\s*:\s*("(?:[^"\\]|\\.)*")')
+_COLUMNAR_DAY_RE = re.compile(r"health_data_(\d{8})\.cols$")
+
+logger = metrics.get_logger('rescore')
+
+def config_fingerprint(detector: HealthAnomalyDetector) -> str:
+    """Hash of the rules and trend settings a run was scored with"""
+    config = {'rules': detector.rules.config, 'trend': detector.trend_config}
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+def partition_days(data_dir: str, first: Optional[str] = None, last: Optional[str] = None) -> List[str]:
+    """Days with JSON, JSONL, cold or columnar partitions, oldest first"""
+    days = set(import_storage_module('local_storage').list_partition_days(data_dir))
+    for name in os.listdir(data_dir):
+        match = _COLUMNAR_DAY_RE.match(name)
+        if match:
+            days.add(match.group(1))
+    return [day for day in sorted(days) if (first is None or day >= first) and (last is None or day <= last)]
+
+def _write_atomic(path: str, data: bytes):
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+class ShardReader:
+    """Readings of one worker's users from a day's partitions
+
+    Users are assigned to workers with the same stable hash the
+    ParallelAnalyzer uses. JSONL lines of other shards are skipped on
+    their raw user_id before being parsed, and columnar and cold
+    partitions are filtered on their user dictionary or index.
+    """
+
+    def __init__(self, data_dir: str, worker: int, workers: int):
+        self.data_dir = data_dir
+        self.worker = worker
+        self.workers = workers
+        self.range_query = import_storage_module('range_query')
+        self.columnar = import_storage_module('columnar_store')
+        self.storage = import_storage_module('local_storage')
+        self.compaction = import_storage_module('compaction')
+        self._mine: Dict[bytes, bool] = {}  # Encoded user_id -> belongs to this shard
+
+    def owns(self, user_id) -> bool:
+        return partition_for(user_id if user_id is not None else 'unknown', self.workers) == self.worker
+
+    def _owns_encoded(self, token: bytes) -> bool:
+        mine = self._mine.get(token)
+        if mine is None:
+            mine = self._mine[token] = self.owns(json.loads(token))
+        return mine
+
+    def read_day(self, day: str) -> Iterator[Dict]:
+        for path in self.range_query.day_sources(self.data_dir, day):
+            if path.endswith(self.columnar.COLUMNAR_SUFFIX):
+                partition = self.columnar.ColumnarPartition(path)
+                users = [user_id for user_id in partition.user_ids if self.owns(user_id)]
+                yield from partition.iter_records(partition.select(user_ids=users))
+            elif path.endswith(self.storage.COLD_SUFFIX):
+                partition = self.compaction.ColdPartition(path)
+                yield from partition.records([user_id for user_id in partition.user_ids if self.owns(user_id)])
+            elif path.endswith(self.storage.LEGACY_SUFFIX):
+                for record in self.storage.iter_partition(path):
+                    if self.owns(record.get('user_id')):
+                        yield record
+            else:
+                yield from self._read_jsonl(path)
+
+    def _read_jsonl(self, path: str) -> Iterator[Dict]:
+        with open(path, 'rb') as f:
+            for line in f:
+                found = _USER_ID_RE.search(line)
+                if found is not None and not self._owns_encoded(found.group(1)):
+                    continue
+                try:
+                    record = json_codec.loads(line)
+                except ValueError:
+                    continue  # Blank or torn final line
+                if found is not None or self.owns(record.get('user_id')):
+                    yield record
+
+def group_by_user(records: Iterator[Dict]) -> Dict[str, List[Tuple]]:
+    """Compact (timestamp, heart_rate, spo2, temperature, fall_detected) rows per user"""
+    users: Dict[str, List[Tuple]] = {}
+    for record in records:
+        row = (record.get('timestamp'),) + tuple(record.get(name) for name in SCORED_FIELDS)
+        users.setdefault(record.get('user_id', 'unknown'), []).append(row)
+    return users
+
+class UserRescorer:
+    """Scores one worker's users, keeping their trend state and last status between days"""
+
+    def __init__(self, detector: HealthAnomalyDetector, batch_size: int = 4096):
+        self.detector = detector
+        self.batch_size = batch_size
+        self.states = {}
+        self.statuses: Dict[str, str] = {}
+        self.finished: Dict[str, Dict] = {}  # Day -> rescore_day result, saved with the state
+
+    def score_user(self, user_id: str, rows: List[Tuple]) -> Iterator[Dict]:
+        """Results for a user's rows in timestamp order
+
+        Runs of complete rows are scored with analyze_batch; a row missing
+        a metric goes through analyze_reading, which applies the per-key
+        defaults exactly as live scoring would.
+        """
+        state = self.states.get(user_id)
+        if state is None:
+            state = self.states[user_id] = self.detector.new_state()
+        rows.sort(key=lambda row: row[0] or '')
+
+        run: List[Tuple] = []
+        for row in rows:
+            if None in row[1:]:
+                yield from self._score_run(user_id, run, state)
+                run = []
+                reading = {'user_id': user_id, 'timestamp': row[0]}
+                reading.update((name, value) for name, value in zip(SCORED_FIELDS, row[1:]) if value is not None)
+                yield self.detector.analyze_reading(reading, state)
+                continue
+            run.append(row)
+            if len(run) >= self.batch_size:
+                yield from self._score_run(user_id, run, state)
+                run = []
+        yield from self._score_run(user_id, run, state)
+
+    def _score_run(self, user_id: str, run: List[Tuple], state) -> Iterator[Dict]:
+        if not run:
+            return
+        timestamps, heart_rate, spo2, temperature, fall_detected = zip(*run)
+        batch = {
+            'timestamp': np.asarray(timestamps, dtype=object),
+            'user_id': np.full(len(run), user_id, dtype=object),
+            'heart_rate': np.asarray(heart_rate),
+            'spo2': np.asarray(spo2),
+            'temperature': np.asarray(temperature),
+            'fall_detected': np.asarray(fall_detected, dtype=bool)
+        }
+        yield from self.detector.analyze_batch(batch, state)
+
+    def status_delta(self, result: Dict) -> Optional[Dict]:
+        """A record of the user's status changing, or None"""
+        previous = self.statuses.get(result['user_id'], 'normal')
+        if result['status'] == previous:
+            return None
+        self.statuses[result['user_id']] = result['status']
+        return {
+            'timestamp': result['timestamp'],
+            'user_id': result['user_id'],
+            'previous_status': previous,
+            'status': result['status'],
+            'risk_level': result['risk_level']
+        }
+
+    def save(self, path: str):
+        saved = {'states': self.states, 'statuses': self.statuses, 'finished': self.finished}
+        _write_atomic(path, pickle.dumps(saved, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def load(self, path: str):
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        self.states, self.statuses = saved['states'], saved['statuses']
+        self.finished = saved.get('finished', {})
+
+def rescore_day(reader: ShardReader, rescorer: UserRescorer, day: str, out_dir: str) -> Dict:
+    """Re-score one day for one shard and write its anomalies and status deltas"""
+    started = time.perf_counter()
+    users = group_by_user(reader.read_day(day))
+    readings = anomalies = deltas = 0
+    anomaly_lines: List[bytes] = []
+    status_lines: List[bytes] = []
+    encode = import_storage_module('local_storage').encode_record
+    for user_id in sorted(users, key=str):
+        # Popping releases each user's rows as soon as they are scored
+        for result in rescorer.score_user(user_id, users.pop(user_id)):
+            readings += 1
+            if result['anomaly_count']:
+                anomalies += 1
+                anomaly_lines.append(encode(result))
+            delta = rescorer.status_delta(result)
+            if delta is not None:
+                deltas += 1
+                status_lines.append(encode(delta))
+
+    # Outputs are replaced whole, so a day redone after a crash is not duplicated
+    _write_atomic(os.path.join(out_dir, ANOMALIES_FILE.format(day=day, worker=reader.worker)), b''.join(anomaly_lines))
+    _write_atomic(os.path.join(out_dir, STATUS_FILE.format(day=day, worker=reader.worker)), b''.join(status_lines))
+    return {'day': day, 'worker': reader.worker, 'readings': readings, 'anomalies': anomalies,
+            'status_changes': deltas, 'seconds': time.perf_counter() - started}
+
+def _detector(options: Dict) -> HealthAnomalyDetector:
+    rules = load_rules(options['rules']) if options.get('rules') else None
+    return HealthAnomalyDetector(options.get('trend_config'), rules)
+
+def _worker_main(worker: int, workers: int, days: List[str], options: Dict, progress):
+    """Re-score every pending day for one shard, checkpointing after each
+
+    The state file records the days already folded into it. A day it
+    holds that the checkpoint missed (the job stopped between the two
+    writes) is reported again from the saved result rather than replayed
+    on top of state that already includes it.
+    """
+    try:
+        reader = ShardReader(options['data_dir'], worker, workers)
+        rescorer = UserRescorer(_detector(options), options['batch_size'])
+        out_dir = options['out_dir']
+        state_path = os.path.join(out_dir, STATE_FILE.format(worker=worker))
+        if days and os.path.exists(state_path):
+            rescorer.load(state_path)
+        for day in days:
+            result = rescorer.finished.get(day)
+            if result is None:
+                result = rescore_day(reader, rescorer, day, out_dir)
+                rescorer.finished[day] = result
+                rescorer.save(state_path)
+            progress.put(result)
+    except Exception:
+        progress.put({'worker': worker, 'error': traceback.format_exc()})
+
+class RescoreJob:
+    """Resumable, parallel re-scoring of stored readings
+
+    Each worker process owns a fixed shard of users and replays every
+    day partition in order, so a user's trend windows carry across days
+    exactly as in live scoring. After a day, a worker writes its
+    anomalies and status changes and then saves its users' state along
+    with the days it covers; the checkpoint lists the days every shard
+    has finished. A rerun skips those, and refuses to resume results scored with different rules or
+    a different number of workers unless ``restart`` is set.
+    """
+
+    def __init__(self, data_dir: str, out_dir: Optional[str] = None, workers: Optional[int] = None,
+                 batch_size: int = 4096, rules: Optional[str] = None,
+                 trend_config: Optional[Dict] = None):
+        self.options = {
+            'data_dir': data_dir,
+            'out_dir': out_dir or os.path.join(data_dir, 'rescore'),
+            'batch_size': batch_size,
+            'rules': rules,
+            'trend_config': trend_config
+        }
+        self.workers = workers or multiprocessing.cpu_count()
+        self.fingerprint = config_fingerprint(_detector(self.options))
+        self.checkpoint_path = os.path.join(self.options['out_dir'], CHECKPOINT_FILE)
+
+    def load_checkpoint(self, restart: bool = False) -> Dict:
+        fresh = {'fingerprint': self.fingerprint, 'workers': self.workers, 'days': {}}
+        if restart or not os.path.exists(self.checkpoint_path):
+            return fresh
+        with open(self.checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint['fingerprint'] != self.fingerprint or checkpoint['workers'] != self.workers:
+            raise ValueError("Checkpoint was written with different rules or workers; pass restart=True")
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: Dict):
+        _write_atomic(self.checkpoint_path, json.dumps(checkpoint, indent=2).encode('utf-8'))
+
+    def _clear_outputs(self):
+        for name in os.listdir(self.options['out_dir']):
+            if name.startswith(('anomalies_', 'status_', 'state_')) or name == CHECKPOINT_FILE:
+                os.remove(os.path.join(self.options['out_dir'], name))
+
+    @staticmethod
+    def _check_workers(processes: List, left: Dict[int, int], progress):
+        """Fail instead of waiting forever on a worker that died (OOM kill, segfault)"""
+        for worker, process in enumerate(processes):
+            if left[worker] and process.exitcode is not None and progress.empty():
+                raise RuntimeError(f"Re-scoring worker {worker} exited unexpectedly "
+                                   f"(exit code {process.exitcode}) with {left[worker]} day(s) left")
+
+    def run(self, first_day: Optional[str] = None, last_day: Optional[str] = None,
+            restart: bool = False) -> Dict:
+        """Re-score all pending days and return a throughput report"""
+        os.makedirs(self.options['out_dir'], exist_ok=True)
+        checkpoint = self.load_checkpoint(restart)
+        if restart:
+            self._clear_outputs()
+        days = partition_days(self.options['data_dir'], first_day, last_day)
+        done = checkpoint['days']
+
+        # Each shard resumes after the last day it finished
+        pending = {}
+        for worker in range(self.workers):
+            finished = [day for day, entry in done.items() if worker in entry['workers']]
+            pending[worker] = [day for day in days if day not in finished]
+            if finished and pending[worker] and pending[worker][0] < max(finished):
+                raise ValueError("New partitions predate checkpointed days; pass restart=True to re-score in order")
+        report = {'days': {}, 'readings': 0, 'anomalies': 0, 'status_changes': 0}
+        started = time.perf_counter()
+
+        ctx = multiprocessing.get_context()
+        progress = ctx.Queue()
+        processes = []
+        for worker in range(self.workers):
+            process = ctx.Process(target=_worker_main, args=(worker, self.workers, pending[worker],
+                                                             self.options, progress), daemon=True)
+            process.start()
+            processes.append(process)
+
+        left = {worker: len(worker_days) for worker, worker_days in pending.items()}
+        remaining = sum(left.values())
+        try:
+            while remaining:
+                try:
+                    result = progress.get(timeout=PROGRESS_POLL)
+                except queue.Empty:
+                    self._check_workers(processes, left, progress)
+                    continue
+                if 'error' in result:
+                    raise RuntimeError(f"Re-scoring worker {result['worker']} failed:\n{result['error']}")
+                remaining -= 1
+                left[result['worker']] -= 1
+                entry = done.setdefault(result['day'], {'workers': [], 'readings': 0, 'anomalies': 0,
+                                                        'status_changes': 0})
+                entry['workers'].append(result['worker'])
+                for key in ('readings', 'anomalies', 'status_changes'):
+                    entry[key] += result[key]
+                    report[key] += result[key]
+                self._save_checkpoint(checkpoint)
+                if len(entry['workers']) == self.workers:
+                    report['days'][result['day']] = entry
+                    elapsed = time.perf_counter() - started
+                    logger.info(f"📅 {result['day']}: {entry['readings']:,} readings, {entry['anomalies']:,} anomalous "
+                                f"({report['readings'] / max(elapsed, 1e-9):,.0f} readings/sec overall)")
+        finally:
+            for process in processes:
+                if remaining:
+                    process.terminate()  # Failed or interrupted: the checkpoint has the finished days
+                process.join()
+
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        report['readings_per_sec'] = round(report['readings'] / max(report['seconds'], 1e-9))
+        report['workers'] = self.workers
+        return report
+
+def main():
+    """Re-score stored readings with the current detector configuration"""
+    parser = argparse.ArgumentParser(description="Re-score stored health readings")
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--out-dir', default=None, help="default: <data-dir>/rescore")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--rules', help="JSON rules config (default: built-in rules)")
+    parser.add_argument('--trend-config', help="JSON file of per-metric trend overrides")
+    parser.add_argument('--first-day', help="YYYYMMDD")
+    parser.add_argument('--last-day', help="YYYYMMDD")
+    parser.add_argument('--restart', action='store_true', help="discard the checkpoint and start over")
+    args = parser.parse_args()
+    metrics.configure_logging()
+
+    trend_config = None
+    if args.trend_config:
+        with open(args.trend_config, 'r') as f:
+            trend_config = json.load(f)
+    job = RescoreJob(args.data_dir, args.out_dir, args.workers, args.batch_size, args.rules, trend_config)
+    report = job.run(args.first_day, args.last_day, args.restart)
+    print(f"✅ Re-scored {report['readings']:,} readings in {report['seconds']}s "
+          f"({report['readings_per_sec']:,} readings/sec, {report['workers']} worker(s))")
+    print(f"   {report['anomalies']:,} anomalous readings, {report['status_changes']:,} status changes")
+
+if __name__ == "__main__":
+    main()
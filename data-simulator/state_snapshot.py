@@ -0,0 +1,204 @@
+"""
+Detector state snapshots for Health Monitoring
+Per-user trend windows saved as NumPy arrays and restored in bulk or on demand
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import time
+from array import array
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from anomaly_detector import HealthAnomalyDetector, RollingWindow, TrendState
+from health_data_simulator import metrics
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+# Per trend metric: raw ring buffer, plus the RollingWindow fields that
+# make a restored window behave bit-for-bit like the saved one
+WINDOW_ARRAYS = (
+    ('values', '<f8'),
+    ('head', '<i4'),
+    ('count', '<i4'),
+    ('mean', '<f8'),
+    ('m2', '<f8'),
+    ('evictions', '<i4')
+)
+
+def _layout(detector: HealthAnomalyDetector) -> List[Dict]:
+    return [{'metric': metric, 'window': detector.trend_config[metric]['window']}
+            for metric in detector.trend_metrics]
+
+@metrics.timed('detector_snapshot', items=lambda users: users)
+def save_snapshot(registry, path: str) -> int:
+    """Write every user's trend state to a snapshot directory, returning the user count
+
+    Users are written oldest-used first, so a restore rebuilds the same
+    LRU order. Users still pending in a lazily attached snapshot have
+    their rows copied from it as arrays, ahead of the live users and
+    without building their states. The snapshot is built next to
+    ``path`` and swapped in, so a crash mid-write leaves the previous
+    snapshot intact.
+    """
+    user_ids = list(registry.states)
+    states = [registry.states[user_id] for user_id in user_ids]
+    layout = _layout(registry.detector)
+    reader, rows = _pending_rows(registry)
+    temp = path + '.tmp'
+    shutil.rmtree(temp, ignore_errors=True)
+    os.makedirs(temp)
+
+    if len(rows):
+        user_ids = reader.user_ids[rows].tolist() + user_ids
+    np.save(os.path.join(temp, 'user_ids.npy'), np.asarray(user_ids, dtype=str))
+    for j, entry in enumerate(layout):
+        windows = [state.windows[j] for state in states]
+        size = entry['window']
+        values = np.frombuffer(b''.join(window.values.tobytes() for window in windows), dtype='<f8')
+        columns = {
+            'values': values.reshape(len(windows), size),
+            'head': np.fromiter((window.head for window in windows), '<i4', len(windows)),
+            'count': np.fromiter((window.count for window in windows), '<i4', len(windows)),
+            'mean': np.fromiter((window.mean for window in windows), '<f8', len(windows)),
+            'm2': np.fromiter((window.m2 for window in windows), '<f8', len(windows)),
+            'evictions': np.fromiter((window._evictions for window in windows), '<i4', len(windows))
+        }
+        for name, dtype in WINDOW_ARRAYS:
+            column = columns[name].astype(dtype, copy=False)
+            if len(rows):
+                column = np.concatenate([reader.columns[j][name][rows].astype(dtype, copy=False), column])
+            np.save(os.path.join(temp, f"{entry['metric']}.{name}.npy"), column)
+
+    with open(os.path.join(temp, META_FILE), 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'count': len(user_ids), 'windows': layout,
+                   'saved_at': datetime.datetime.now().isoformat()}, f, indent=2)
+
+    # Swap directories: old -> .old, new -> path, then drop the old one
+    previous = path + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, previous)
+    os.replace(temp, path)
+    shutil.rmtree(previous, ignore_errors=True)
+    return len(user_ids)
+
+def _pending_rows(registry):
+    """The attached lazy snapshot and its rows not yet restored, oldest first"""
+    reader = registry.snapshot
+    if reader is None:
+        return None, np.zeros(0, dtype=np.int64)
+    rows = np.fromiter((row for user_id, row in reader.index.items() if user_id not in registry.states),
+                       np.int64)
+    rows.sort()
+    if registry.max_users is not None:
+        # Pending users are older than every live one, so they go first
+        rows = rows[max(0, len(rows) - max(0, registry.max_users - len(registry.states))):]
+    return reader, rows
+
+class SnapshotReader:
+    """Memory-mapped view of a snapshot that builds TrendStates per row"""
+
+    def __init__(self, path: str, detector: HealthAnomalyDetector):
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {self.meta['version']}")
+        if self.meta['windows'] != _layout(detector):
+            raise ValueError("Snapshot was taken with different trend metrics or window sizes")
+        self.path = path
+        self.user_ids = np.load(os.path.join(path, 'user_ids.npy'), mmap_mode='r')
+        self.columns = [
+            {name: np.load(os.path.join(path, f"{entry['metric']}.{name}.npy"), mmap_mode='r')
+             for name, _ in WINDOW_ARRAYS}
+            for entry in self.meta['windows']
+        ]
+        self._index: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return self.meta['count']
+
+    @property
+    def index(self) -> Dict[str, int]:
+        """user_id -> row, built on first use"""
+        if self._index is None:
+            self._index = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
+        return self._index
+
+    def states(self, start: int, stop: int) -> List[TrendState]:
+        """TrendStates for a range of rows"""
+        per_metric = []
+        for columns in self.columns:
+            values = columns['values'][start:stop]
+            width = values.shape[1] * 8
+            raw = np.ascontiguousarray(values).tobytes()
+            fields = [columns[name][start:stop].tolist() for name in ('head', 'count', 'mean', 'm2', 'evictions')]
+            per_metric.append([
+                _window(raw[k * width:(k + 1) * width], values.shape[1], *row)
+                for k, row in enumerate(zip(*fields))
+            ])
+        return [TrendState(windows) for windows in zip(*per_metric)]
+
+    def state(self, row: int) -> TrendState:
+        return self.states(row, row + 1)[0]
+
+def _window(raw: bytes, size: int, head: int, count: int, mean: float, m2: float, evictions: int) -> RollingWindow:
+    window = RollingWindow.__new__(RollingWindow)  # Fields come from the snapshot, not __init__
+    window.size = size
+    window.values = array('d', raw)
+    window.head = head
+    window.count = count
+    window.mean = mean
+    window.m2 = m2
+    window._evictions = evictions
+    return window
+
+def restore_snapshot(registry, path: str, lazy: bool = False, chunk_size: int = 10000) -> int:
+    """Load a snapshot into a registry, returning how many users it holds
+
+    Eager restore builds every state, ``chunk_size`` rows at a time, and
+    keeps only the most recently used users when the registry has a cap.
+    With ``lazy`` the snapshot stays memory-mapped and each user's state
+    is built the first time the registry sees them.
+    """
+    reader = SnapshotReader(path, registry.detector)
+    if lazy:
+        registry.attach_snapshot(reader)
+        return len(reader)
+
+    first = 0
+    if registry.max_users is not None:
+        first = max(0, len(reader) - registry.max_users)
+    now = registry.clock()
+    user_ids = reader.user_ids
+    for start in range(first, len(reader), chunk_size):
+        stop = min(start + chunk_size, len(reader))
+        for user_id, state in zip(user_ids[start:stop].tolist(), reader.states(start, stop)):
+            state.last_seen = now
+            registry.states[user_id] = state
+            registry.states.move_to_end(user_id)
+    return len(reader) - first
+
+def main():
+    """Inspect a snapshot, or time a restore of it"""
+    parser = argparse.ArgumentParser(description="Detector state snapshots")
+    parser.add_argument('path')
+    parser.add_argument('--restore', action='store_true', help="time an eager restore")
+    args = parser.parse_args()
+
+    from detector_registry import DetectorRegistry
+    registry = DetectorRegistry(idle_ttl=None)
+    reader = SnapshotReader(args.path, registry.detector)
+    print(f"📦 {len(reader):,} users, saved {reader.meta['saved_at']}")
+    if args.restore:
+        started = time.perf_counter()
+        count = restore_snapshot(registry, args.path)
+        print(f"♻️  Restored {count:,} users in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+Storage Module Loader
+Imports the firebase-config storage modules from the sibling folder
+"""
+
+import importlib
+import os
+import sys
+
+# Storage modules live in the sibling firebase-config folder
+STORAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'firebase-config')
+
+def import_storage_module(name: str):
+    """Import a module from the firebase-config folder"""
+    if STORAGE_DIR not in sys.path:
+        sys.path.append(STORAGE_DIR)
+    return importlib.import_module(name)
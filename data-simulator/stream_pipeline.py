@@ -0,0 +1,296 @@
+"""
+Streaming pipeline for Health Monitoring
+Composable generator stages: source -> analyze -> alert filter -> sinks
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from health_data_simulator import json_codec, metrics, records_to_batch
+
+Stage = Callable[[Iterable], Iterable]
+
+# Analyzed items flow through the pipeline as (reading, analysis) pairs
+Event = Tuple[Dict, Dict]
+
+RISK_ORDER = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}
+
+_DONE = object()
+
+class Pipeline:
+    """A chain of generator stages pulled one item at a time
+
+    Each stage is a function that takes the upstream iterable and returns
+    a new one, so items flow through without building whole lists, and a
+    slow stage naturally slows everything upstream. Adding a sink is just
+    another pipe() call.
+    """
+
+    def __init__(self, source: Iterable):
+        self._stream = source
+
+    def pipe(self, stage: Stage) -> 'Pipeline':
+        """Append a stage"""
+        self._stream = stage(self._stream)
+        return self
+
+    def __iter__(self) -> Iterator:
+        return iter(self._stream)
+
+    def run(self) -> int:
+        """Drain the pipeline, returning how many items reached the end"""
+        count = 0
+        for _ in self._stream:
+            count += 1
+        return count
+
+# Seconds a blocked producer waits between checks for a stopped consumer
+PUT_POLL = 0.1
+
+def _produce(upstream: Iterable, items: queue.Queue, stop: threading.Event):
+    """Feed a bounded queue from a background thread (blocks when full)
+
+    The thread gives up once ``stop`` is set, so a consumer that stops
+    early does not leave it blocked on a full queue forever.
+    """
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=PUT_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for item in upstream:
+            if not put(item):
+                return
+    except BaseException as e:
+        put((_DONE, e))
+        return
+    put((_DONE, None))
+
+def _start_producer(upstream: Iterable, maxsize: int, name: str) -> Tuple[queue.Queue, threading.Event]:
+    items: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    metrics.track_queue(name, items.qsize)
+    threading.Thread(target=_produce, args=(upstream, items, stop), name=f"{name}-producer", daemon=True).start()
+    return items, stop
+
+def _stop_producer(stop: threading.Event, name: str):
+    stop.set()
+    metrics.track_queue(name, None)
+
+def _is_end(item) -> bool:
+    return isinstance(item, tuple) and len(item) == 2 and item[0] is _DONE
+
+def buffered(maxsize: int = 1000) -> Stage:
+    """Decouple upstream and downstream with a bounded queue
+
+    The upstream runs in its own thread and blocks once ``maxsize`` items
+    are waiting, which is how backpressure reaches the source.
+    """
+    def stage(upstream: Iterable) -> Iterator:
+        items, stop = _start_producer(upstream, maxsize, 'pipeline_buffered')
+        try:
+            while True:
+                item = items.get()
+                if _is_end(item):
+                    if item[1] is not None:
+                        raise item[1]
+                    return
+                yield item
+        finally:
+            _stop_producer(stop, 'pipeline_buffered')
+    return stage
+
+def batched(size: int = 500, flush_interval: Optional[float] = 1.0, maxsize: int = 1000) -> Stage:
+    """Group items into lists of up to ``size``
+
+    A partial batch is emitted once ``flush_interval`` seconds have passed
+    since its first item, even if the source is idle. Items are pulled
+    through a bounded queue of ``maxsize``.
+    """
+    def stage(upstream: Iterable) -> Iterator[List]:
+        items, stop = _start_producer(upstream, maxsize, 'pipeline_batched')
+        try:
+            batch: List = []
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = items.get(timeout=timeout)
+                except queue.Empty:
+                    yield batch
+                    batch, deadline = [], None
+                    continue
+
+                if _is_end(item):
+                    if batch:
+                        yield batch
+                    if item[1] is not None:
+                        raise item[1]
+                    return
+
+                batch.append(item)
+                if deadline is None and flush_interval is not None:
+                    deadline = time.monotonic() + flush_interval
+                if len(batch) >= size:
+                    yield batch
+                    batch, deadline = [], None
+        finally:
+            _stop_producer(stop, 'pipeline_batched')
+    return stage
+
+def unbatched() -> Stage:
+    """Flatten lists produced by batched() back into single items"""
+    def stage(upstream: Iterable[List]) -> Iterator:
+        for batch in upstream:
+            yield from batch
+    return stage
+
+def simulator_source(simulators: Iterable, interval: Optional[float] = None,
+                     count: Optional[int] = None) -> Iterator[Dict]:
+    """Readings from one or more WearableSimulators, round by round
+
+    With ``interval`` the source sleeps between rounds like a real device;
+    ``count`` limits the number of rounds (default: forever).
+    """
+    simulators = list(simulators)
+    rounds = 0
+    while count is None or rounds < count:
+        for simulator in simulators:
+            yield simulator.to_dict(simulator.generate_reading())
+        rounds += 1
+        if interval:
+            time.sleep(interval)
+
+def analyze(analyzer) -> Stage:
+    """Score readings with a HealthAnomalyDetector or DetectorRegistry
+
+    Single readings become (reading, analysis) events. Lists coming from
+    batched() are scored with the vectorized analyze_batch path and become
+    lists of events.
+    """
+    def stage(upstream: Iterable) -> Iterator:
+        for item in upstream:
+            if isinstance(item, list):
+                if item:
+                    yield list(zip(item, analyzer.analyze_batch(records_to_batch(item))))
+                else:
+                    yield []
+            else:
+                yield item, analyzer.analyze_reading(item)
+    return stage
+
+def ml_score(detector) -> Stage:
+    """Add an MLAnomalyDetector's multivariate anomalies to analyzed events
+
+    Place it after batched() and analyze() so every micro-batch costs one
+    model call per user model rather than one per reading.
+    """
+    def stage(upstream: Iterable) -> Iterator:
+        for item in upstream:
+            events = item if isinstance(item, list) else [item]
+            if events:
+                detector.augment([reading for reading, _ in events], [analysis for _, analysis in events])
+            yield item
+    return stage
+
+def alert_filter(min_risk: str = 'medium') -> Stage:
+    """Keep only events whose risk level is at least ``min_risk``"""
+    threshold = RISK_ORDER[min_risk]
+
+    def is_alert(event: Event) -> bool:
+        return RISK_ORDER.get(event[1]['risk_level'], 0) >= threshold
+
+    def stage(upstream: Iterable) -> Iterator:
+        for item in upstream:
+            if isinstance(item, list):
+                yield [event for event in item if is_alert(event)]
+            elif is_alert(item):
+                yield item
+    return stage
+
+def sink(write: Callable[[Event], None]) -> Stage:
+    """Pass-through stage that hands every event to ``write``"""
+    def stage(upstream: Iterable) -> Iterator:
+        for item in upstream:
+            for event in (item if isinstance(item, list) else (item,)):
+                write(event)
+            yield item
+    return stage
+
+def alert_sink(engine, write: Callable[[Dict], None], hospitals=None, nearest: int = 3) -> Stage:
+    """Run events through an AlertEngine and hand its state changes to ``write``
+
+    Place it before alert_filter() so the engine also sees normal
+    readings, which is what lets episodes resolve. With a HospitalIndex,
+    critical alerts that open or escalate carry the ``nearest`` hospitals
+    to the reading's location, looked up for a whole batch at once.
+    """
+    def handle(events: Iterable[Event]):
+        alerts = [(reading, alert) for reading, analysis in events for alert in engine.process(analysis)]
+        if hospitals is not None:
+            urgent = [(reading, alert) for reading, alert in alerts
+                      if alert['severity'] == 'critical' and alert['event'] != 'resolved']
+            if urgent:
+                matches = hospitals.for_readings([reading for reading, _ in urgent], nearest)
+                for (_, alert), found in zip(urgent, matches):
+                    alert['nearest_hospitals'] = found
+        for _, alert in alerts:
+            write(alert)
+
+    def stage(upstream: Iterable) -> Iterator:
+        for item in upstream:
+            handle(item if isinstance(item, list) else (item,))
+            yield item
+    return stage
+
+def storage_sink(db) -> Stage:
+    """Persist readings with FirebaseHealthDB.save_health_data"""
+    return sink(lambda event: db.save_health_data(event[0]))
+
+def jsonl_sink(path: str) -> Stage:
+    """Append each analysis result to a JSON Lines file"""
+    def stage(upstream: Iterable) -> Iterator:
+        with open(path, 'ab') as f:
+            yield from sink(lambda event: f.write(json_codec.encode_line(event[1])))(upstream)
+    return stage
+
+def latest_reading_sink(path: str = 'latest_reading.json') -> Stage:
+    """Overwrite a file with the most recent reading"""
+    def write(event: Event):
+        json_codec.dump(event[0], path)
+    return sink(write)
+
+def print_sink() -> Stage:
+    """Log each reading and its detected anomalies (one record per reading)"""
+    logger = metrics.get_logger('simulator')
+
+    def write(event: Event):
+        reading, analysis = event
+        lines = [
+            f"⏰ {reading['timestamp']}",
+            f"❤️  Heart Rate: {reading['heart_rate']} bpm",
+            f"🫁 SpO₂: {reading['spo2']}%",
+            f"🌡️  Temperature: {reading['temperature']}°F",
+            f"🚶 Activity: {reading['activity_level']}",
+            f"🔋 Battery: {reading['battery_level']}%"
+        ]
+        for anomaly in analysis['anomalies']:
+            icon = "🚨" if anomaly['severity'] == 'critical' else "⚠️ "
+            lines.append(f"{icon} {anomaly['message']}")
+        lines.append("-" * 50)
+
+        level = logging.WARNING if analysis['anomalies'] else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, '\n'.join(lines), extra={'fields': {
+                'user_id': reading.get('user_id'), 'status': analysis['status'],
+                'anomalies': [anomaly['type'] for anomaly in analysis['anomalies']]
+            }})
+    return sink(write)
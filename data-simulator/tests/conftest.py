@@ -0,0 +1,13 @@
+"""
+Test setup for the data simulator
+Puts data-simulator and firebase-config on sys.path, as running the scripts does
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for path in (os.path.join(HERE, '..'), os.path.join(HERE, '..', '..', 'firebase-config')):
+    path = os.path.normpath(path)
+    if path not in sys.path:
+        sys.path.insert(0, path)
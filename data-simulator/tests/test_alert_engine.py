@@ -0,0 +1,64 @@
+"""
+Tests for alert episode tracking
+Episodes open and resolve with hysteresis, and cooldown state is purged as readings arrive
+"""
+
+import datetime
+
+from alert_engine import AlertEngine
+
+START = datetime.datetime(2024, 3, 1, 8, 0)
+
+def _analysis(seconds, severity=None, user_id='u1', when=None):
+    when = when or START + datetime.timedelta(seconds=seconds)
+    anomalies = [] if severity is None else [{'type': 'tachycardia', 'severity': severity, 'message': 'High heart rate'}]
+    return {'user_id': user_id, 'timestamp': when.isoformat(), 'anomalies': anomalies}
+
+def _events(engine, steps):
+    return [(event['event'], event['severity']) for t, severity in steps
+            for event in engine.process(_analysis(t, severity))]
+
+def test_episode_opens_after_consecutive_hits_and_resolves_after_misses():
+    engine = AlertEngine(open_after=2, resolve_after=3)
+    assert _events(engine, [(0, 'high'), (1, None), (2, 'high')]) == []  # Hits must be consecutive
+    assert _events(engine, [(3, 'high')]) == [('opened', 'high')]
+    assert _events(engine, [(4, None), (5, None), (6, 'high'), (7, None), (8, None)]) == []
+    assert _events(engine, [(9, None)]) == [('resolved', 'high')]
+
+def test_critical_opens_at_once_and_escalation_is_reported():
+    engine = AlertEngine(open_after=3)
+    assert _events(engine, [(0, 'critical')]) == [('opened', 'critical')]
+    engine = AlertEngine(open_after=2)
+    assert _events(engine, [(0, 'medium'), (1, 'medium'), (2, 'medium'), (3, 'high')]) == \
+        [('opened', 'medium'), ('escalated', 'high')]
+
+def test_reopening_within_cooldown_is_silent_unless_more_severe():
+    engine = AlertEngine(open_after=1, resolve_after=1, cooldown_seconds=60)
+    assert _events(engine, [(0, 'high'), (1, None)]) == [('opened', 'high'), ('resolved', 'high')]
+    assert _events(engine, [(10, 'high'), (11, None)]) == []
+    assert _events(engine, [(20, 'critical')]) == [('opened', 'critical')]
+
+def test_expired_cooldowns_are_purged_while_processing():
+    engine = AlertEngine(open_after=1, resolve_after=1, cooldown_seconds=60)
+    for i in range(50):
+        engine.process(_analysis(0, 'high', user_id=f"u{i}"))
+        engine.process(_analysis(1, None, user_id=f"u{i}"))
+    assert len(engine._resolved) == 50
+    engine.process(_analysis(3600, None, user_id='someone_else'))
+    assert engine._resolved == {}
+
+def test_aware_and_naive_timestamps_mix():
+    engine = AlertEngine(open_after=1, resolve_after=1, cooldown_seconds=60)
+    engine.process(_analysis(0, 'high'))
+    aware = (START + datetime.timedelta(seconds=1)).astimezone(datetime.timezone.utc)
+    events = engine.process(_analysis(0, None, when=aware))
+    assert [event['event'] for event in events] == ['resolved']
+    assert events[0]['timestamp'] == (START + datetime.timedelta(seconds=1)).isoformat()
+
+def test_episode_ids_are_unique_across_engines():
+    ids = []
+    for _ in range(2):  # Two runs (or workers) over the same readings
+        engine = AlertEngine(open_after=1, resolve_after=1, cooldown_seconds=0)
+        for t, severity in [(0, 'high'), (1, None), (2, 'high'), (3, None)]:
+            ids.extend(event['episode_id'] for event in engine.process(_analysis(t, severity)))
+    assert len(ids) == 8 and len(set(ids)) == 4  # Opened and resolved events share their episode's id
@@ -0,0 +1,119 @@
+"""
+Tests for the detector's rolling windows and batch path
+Running moments and z-scores must match NumPy, and analyze_batch must match analyze_reading
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from anomaly_detector import EXACT_Z_SCORES, HealthAnomalyDetector, RollingWindow
+from health_data_simulator import records_to_batch
+
+def _filled(values, size=10):
+    window = RollingWindow(size)
+    for value in values:
+        window.push(value)
+    return window
+
+def test_window_keeps_newest_values_in_order():
+    window = _filled(range(15), size=10)
+    assert window.ordered() == [float(v) for v in range(5, 15)]
+    assert window.full
+
+def test_moments_match_numpy_through_many_evictions():
+    rng = random.Random(7)
+    window = RollingWindow(10)
+    history = []
+    for _ in range(1000):
+        value = rng.uniform(40, 140)
+        window.push(value)
+        history.append(value)
+        expected = history[-10:]
+        assert window.mean == pytest.approx(np.mean(expected), abs=1e-9)
+        assert window.variance() == pytest.approx(np.var(expected), abs=1e-7)
+
+def test_extend_matches_pushes():
+    values = [70, 72, 75, 71, 90, 65, 88, 73, 74, 76, 80, 81]
+    pushed = _filled(values)
+    extended = RollingWindow(10)
+    extended.extend(values)
+    assert extended.ordered() == pushed.ordered()
+    assert extended.mean == pytest.approx(pushed.mean)
+
+def test_z_score_matches_numpy():
+    rng = random.Random(3)
+    for _ in range(200):
+        values = [rng.randint(50, 120) for _ in range(10)]
+        window = _filled(values)
+        value = rng.randint(40, 150)
+        std = np.std(values)
+        expected = abs(value - np.mean(values)) / std if std > 0 else None
+        got = window.z_score(value, threshold=2.5)
+        if expected is None:
+            assert got is None
+        else:
+            assert round(got, 2) == round(float(expected), 2)
+
+def test_flat_window_takes_exact_path_and_is_counted():
+    before = EXACT_Z_SCORES.values.get(('flat',), 0)
+    window = _filled([98.5] * 10)
+    assert window.z_score(98.5) is None
+    assert window.z_score(99.0) is None
+    assert EXACT_Z_SCORES.values.get(('flat',), 0) == before + 2
+
+def test_missing_values_score_alike_on_both_paths():
+    records = [
+        {'timestamp': '2024-03-01T10:00:00', 'user_id': 'u1', 'heart_rate': 72, 'spo2': 98.0,
+         'temperature': 98.6, 'fall_detected': False},
+        {'timestamp': '2024-03-01T10:00:01', 'user_id': 'u1', 'heart_rate': None, 'spo2': 85.0,
+         'temperature': None, 'fall_detected': None},
+        {'timestamp': '2024-03-01T10:00:02', 'user_id': 'u1', 'spo2': 97.0, 'fall_detected': False},
+    ] * 6
+    scalar = HealthAnomalyDetector()
+    expected = [scalar.analyze_reading(dict(record)) for record in records]
+    got = HealthAnomalyDetector().analyze_batch(records_to_batch(records))
+    assert [result['anomalies'] for result in got] == [result['anomalies'] for result in expected]
+    # An absent key and an explicit None both read as the rules default (heart rate 0)
+    assert [anomaly['type'] for anomaly in got[1]['anomalies']][:2] == ['bradycardia', 'hypoxemia']
+    assert got[2]['anomalies'][0] == expected[2]['anomalies'][0] and got[2]['anomalies'][0]['value'] == 0
+
+def _vitals(count, seed):
+    rng = random.Random(seed)
+    return [{'timestamp': f"2024-03-01T10:{i // 60:02d}:{i % 60:02d}", 'user_id': 'u1',
+             'heart_rate': rng.choice([72, 72, rng.randint(40, 140)]),
+             'spo2': rng.choice([98.5, round(rng.uniform(85, 100), 1)]),
+             'temperature': round(rng.uniform(96, 102.5), 1), 'fall_detected': rng.random() < 0.02}
+            for i in range(count)]
+
+def _structured(readings):
+    return np.array([(r['timestamp'], r['user_id'], r['heart_rate'], r['spo2'], r['temperature'], r['fall_detected'])
+                     for r in readings],
+                    dtype=[('timestamp', 'U32'), ('user_id', 'U8'), ('heart_rate', 'i8'), ('spo2', 'f8'),
+                           ('temperature', 'f8'), ('fall_detected', '?')])
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 25, 1000])
+def test_batch_matches_scalar_scoring(chunk_size):
+    readings = _vitals(600, seed=chunk_size)
+    scalar = HealthAnomalyDetector()
+    expected = [scalar.analyze_reading(dict(reading)) for reading in readings]
+    batch = HealthAnomalyDetector()
+    got = []
+    for k, start in enumerate(range(0, len(readings), chunk_size)):
+        chunk = readings[start:start + chunk_size]
+        # Alternate dict-of-arrays and structured-array batches
+        got += batch.analyze_batch(records_to_batch(chunk) if k % 2 else _structured(chunk))
+    assert got == expected
+    assert batch.history[-1] == scalar.history[-1]
+
+def test_batch_without_optional_columns_uses_defaults():
+    readings = [{'heart_rate': 130, 'spo2': 97.0}, {'heart_rate': 72, 'spo2': 88.0}]
+    columns = {name: np.array([reading[name] for reading in readings]) for name in ('heart_rate', 'spo2')}
+    got = HealthAnomalyDetector().analyze_batch(columns)
+    scalar = HealthAnomalyDetector()
+    expected = [scalar.analyze_reading(dict(reading)) for reading in readings]
+    for result, reference in zip(got, expected):
+        assert result['anomalies'] == reference['anomalies']
+        assert result['status'] == reference['status']
+        assert result['user_id'] == 'unknown'
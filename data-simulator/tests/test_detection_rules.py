@@ -0,0 +1,59 @@
+"""
+Tests for the compiled detection rules
+Limits are strict, scalar and column checks agree at every boundary, and profiles only change their own users
+"""
+
+import numpy as np
+import pytest
+
+from detection_rules import SEVERITY_RANK, RuleBook
+
+MEDIUM, HIGH, CRITICAL = SEVERITY_RANK['medium'], SEVERITY_RANK['high'], SEVERITY_RANK['critical']
+
+def _rule(book, rule_type, user_id=None):
+    return next(rule for rule in book.table_for(user_id).rules if rule.type == rule_type)
+
+@pytest.mark.parametrize('rule_type, cases', [
+    ('bradycardia', [(61, 0), (60, 0), (59.9, MEDIUM), (50, MEDIUM), (49.9, HIGH), (0, HIGH)]),
+    ('tachycardia', [(99, 0), (100, 0), (100.1, MEDIUM), (120, MEDIUM), (120.1, HIGH), (250, HIGH)]),
+    ('hypoxemia', [(95, 0), (94.9, HIGH), (90, HIGH), (89.9, CRITICAL)]),
+    ('fever', [(99.5, 0), (99.6, MEDIUM), (101, MEDIUM), (101.1, HIGH)]),
+    ('hypothermia', [(97.0, 0), (96.9, MEDIUM), (80.0, MEDIUM)]),
+])
+def test_limits_are_strict_and_tiers_escalate(rule_type, cases):
+    rule = _rule(RuleBook(), rule_type)
+    values = [value for value, _ in cases]
+    ranks = [rank for _, rank in cases]
+    assert [rule.rank(value) for value in values] == ranks
+    assert rule.rank_array(np.asarray(values, dtype=float)).tolist() == ranks
+
+def test_flag_rule_fires_on_true_only():
+    rule = _rule(RuleBook(), 'fall')
+    assert [rule.rank(value) for value in (False, True)] == [0, CRITICAL]
+    assert rule.rank_array(np.array([False, True, False])).tolist() == [0, CRITICAL, 0]
+
+def test_profiles_override_only_their_users():
+    book = RuleBook({'profiles': {'athlete': {'bradycardia': {'limit': 45, 'tiers': [{'limit': 38, 'severity': 'high'}]}}},
+                     'assignments': {'a1': 'athlete'}})
+    assert _rule(book, 'bradycardia', 'a1').rank(50) == 0
+    assert _rule(book, 'bradycardia', 'a1').rank(40) == MEDIUM
+    assert _rule(book, 'bradycardia', 'u1').rank(50) == MEDIUM
+    split = book.tables_for(['u1', 'a1', 'u2', 'a1'])
+    assert [(table is book.default_table, rows.tolist()) for table, rows in split] == [(True, [0, 2]), (False, [1, 3])]
+    assert book.tables_for(['a1', 'a1'])[0] == (book.tables['athlete'], None)
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        RuleBook({'profiles': {'x': {'no_such_rule': {'limit': 1}}}})
+    with pytest.raises(ValueError):
+        RuleBook({'range_rules': [{'type': 'bradycardia', 'tiers': [{'limit': 70, 'severity': 'high'}]}]})
+    with pytest.raises(ValueError):
+        RuleBook().assign('u1', 'missing')
+
+def test_recommendations_fall_back_by_severity_and_deduplicate():
+    book = RuleBook()
+    anomalies = [{'type': 'tachycardia', 'severity': 'high'}, {'type': 'bradycardia', 'severity': 'high'},
+                 {'type': 'hypoxemia', 'severity': 'high'}, {'type': 'unknown', 'severity': 'medium'}]
+    assert book.recommend(anomalies) == ["❤️ Monitor heart rate closely, consider medical consultation",
+                                         "💨 Check breathing, consider medical consultation"]
+    assert book.recommend([{'type': 'hypoxemia', 'severity': 'critical'}]) == ["🏥 Seek immediate medical attention"]
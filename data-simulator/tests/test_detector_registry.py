@@ -0,0 +1,65 @@
+"""
+Tests for the per-user detector registry
+Interleaved users must score as if each had a detector of their own, within the user and idle limits
+"""
+
+import random
+
+import pytest
+
+from anomaly_detector import HealthAnomalyDetector
+from detector_registry import DetectorRegistry
+from health_data_simulator import records_to_batch
+
+def _interleaved(count=400, users=5, seed=11):
+    rng = random.Random(seed)
+    return [{'timestamp': f"2024-03-01T10:00:{i:04d}", 'user_id': f"u{rng.randrange(users)}",
+             'heart_rate': rng.randint(45, 140), 'spo2': round(rng.uniform(86, 100), 1),
+             'temperature': round(rng.uniform(96, 102), 1), 'fall_detected': False}
+            for i in range(count)]
+
+def _own_detectors(readings):
+    detectors = {}
+    return [detectors.setdefault(reading['user_id'], HealthAnomalyDetector()).analyze_reading(dict(reading))
+            for reading in readings]
+
+def test_users_never_share_trend_windows():
+    readings = _interleaved()
+    registry = DetectorRegistry()
+    assert [registry.analyze_reading(dict(reading)) for reading in readings] == _own_detectors(readings)
+
+def test_interleaved_batch_matches_per_user_scoring():
+    readings = _interleaved(seed=12)
+    registry = DetectorRegistry()
+    got = registry.analyze_batch(records_to_batch(readings[:150])) + \
+        registry.analyze_batch(records_to_batch(readings[150:]))
+    assert got == _own_detectors(readings)
+
+def test_user_cap_evicts_least_recently_used():
+    registry = DetectorRegistry(max_users=2, idle_ttl=None)
+    for user_id in ('a', 'b', 'a', 'c'):
+        registry.get_state(user_id)
+    assert list(registry.states) == ['a', 'c']
+    assert registry.evicted == 1
+
+def test_idle_users_expire_on_sweep():
+    now = [0.0]
+    registry = DetectorRegistry(idle_ttl=10, sweep_interval=1000, clock=lambda: now[0])
+    registry.get_state('old')
+    now[0] = 5.0
+    registry.get_state('recent')
+    now[0] = 12.0
+    assert registry.evict_idle() == 1
+    assert 'old' not in registry and 'recent' in registry
+
+def test_memory_budget_becomes_a_user_cap():
+    state_bytes = DetectorRegistry().state_bytes
+    registry = DetectorRegistry(memory_budget_bytes=state_bytes * 3, idle_ttl=None)
+    for i in range(10):
+        registry.get_state(f"u{i}")
+    assert len(registry) == 3
+
+@pytest.mark.parametrize('limits', [{'max_users': 0}, {'memory_budget_bytes': 10}, {'memory_budget_bytes': 0}])
+def test_budgets_below_one_user_are_rejected(limits):
+    with pytest.raises(ValueError):
+        DetectorRegistry(**limits)
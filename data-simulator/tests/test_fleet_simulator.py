@@ -0,0 +1,41 @@
+"""
+Tests for the vectorized fleet simulator
+Seeded fleets must be reproducible and produce the same reading shape as WearableSimulator
+"""
+
+import numpy as np
+import pytest
+
+from health_data_simulator import FleetSimulator, WearableSimulator
+
+def test_same_seed_same_readings():
+    first, second = FleetSimulator(50, seed=4), FleetSimulator(50, seed=4)
+    for _ in range(5):
+        a, b = first.tick('2024-03-01T10:00:00'), second.tick('2024-03-01T10:00:00')
+        assert a.keys() == b.keys()
+        for name in a:
+            assert np.array_equal(a[name], b[name])
+
+def test_tick_columns_are_aligned_and_in_range():
+    fleet = FleetSimulator(1000, seed=1)
+    for _ in range(20):
+        batch = fleet.tick('2024-03-01T10:00:00')
+    assert {len(values) for values in batch.values()} == {1000}
+    assert batch['heart_rate'].min() >= 45 and batch['heart_rate'].max() <= 180
+    assert batch['spo2'].min() >= 85.0 and batch['spo2'].max() <= 100.0
+    assert batch['fall_detected'].dtype == bool
+    assert set(batch['activity_level'].tolist()) <= set(FleetSimulator.ACTIVITY_STATES)
+    assert (batch['battery_level'] <= 100).all() and (batch['battery_level'] >= 0).all()
+    assert batch['user_id'][7] == 'user_000007'
+
+def test_dicts_have_the_single_device_shape():
+    simulator = WearableSimulator('u1')
+    expected = simulator.to_dict(simulator.generate_reading())
+    record = FleetSimulator.to_dicts(FleetSimulator(3, seed=2).tick('2024-03-01T10:00:00'))[0]
+    assert record.keys() == expected.keys()
+    assert record['location'].keys() == expected['location'].keys()
+    assert type(record['heart_rate']) is int and type(record['fall_detected']) is bool
+
+def test_user_ids_must_match_devices():
+    with pytest.raises(ValueError):
+        FleetSimulator(3, user_ids=['a', 'b'])
@@ -0,0 +1,110 @@
+"""
+Tests for the asyncio ingestion service
+Bad readings and failing callbacks must never stall the batcher or its connections
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from health_data_simulator import WearableSimulator, json_codec
+from ingestion_server import IngestionServer, open_local_connection, validate_reading
+
+def _readings(user_id, count):
+    simulator = WearableSimulator(user_id)
+    return [simulator.to_dict(simulator.generate_reading()) for _ in range(count)]
+
+async def _send(server, readings):
+    """Send readings over a local connection and collect the replies"""
+    reader, writer = await open_local_connection(server)
+    for reading in readings:
+        writer.write(json_codec.encode_line(reading))
+        await writer.drain()
+    writer.write_eof()
+    replies = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            return replies
+        replies.append(json_codec.loads(line))
+
+def test_out_of_range_and_non_finite_values_are_rejected():
+    reading = _readings('u1', 1)[0]
+    for field, value in (('heart_rate', 10 ** 30), ('spo2', float('nan')), ('temperature', float('inf'))):
+        with pytest.raises(ValueError):
+            validate_reading(dict(reading, **{field: value}))
+    with pytest.raises(ValueError):
+        validate_reading(dict(reading, location={'latitude': True, 'longitude': 1.0}))
+    assert validate_reading(reading) is reading
+
+def test_whole_floats_are_accepted_for_integer_fields():
+    reading = dict(_readings('u1', 1)[0], heart_rate=72.0, battery_level=80.0)
+    assert validate_reading(reading) is reading
+    assert reading['heart_rate'] == 72 and type(reading['heart_rate']) is int
+    assert type(reading['battery_level']) is int
+    for value in (72.5, 1e30, float('inf')):
+        with pytest.raises(ValueError):
+            validate_reading(dict(reading, heart_rate=value))
+
+def test_one_bad_reading_only_rejects_itself():
+    async def run():
+        server = IngestionServer(flush_interval=0.01)
+        readings = _readings('u1', 5)
+        readings.insert(2, dict(readings[0], heart_rate=1 << 40))
+        replies = await asyncio.wait_for(_send(server, readings), 5)
+        await server.close()
+        return server, replies
+
+    server, replies = asyncio.run(run())
+    assert server.stats['accepted'] == 5
+    assert server.stats['rejected'] == 1
+    assert [reply for reply in replies if 'error' in reply] == [{'error': 'heart_rate is out of range'}]
+
+def test_failing_callback_does_not_stop_the_batcher():
+    calls = []
+
+    def on_results(readings, analyses):
+        calls.append(len(readings))
+        raise RuntimeError("sink down")
+
+    async def run():
+        server = IngestionServer(flush_interval=0.01, on_results=on_results)
+        await asyncio.wait_for(_send(server, _readings('u1', 3)), 5)
+        await asyncio.wait_for(_send(server, _readings('u2', 3)), 5)
+        await asyncio.wait_for(server.close(), 5)
+        return server
+
+    server = asyncio.run(run())
+    assert server.stats['accepted'] == 6
+    assert sum(calls) == 6
+
+def test_close_with_blocked_senders_does_not_hang():
+    async def run():
+        server = IngestionServer(queue_size=2, batch_size=4, flush_interval=0.01)
+        senders = [asyncio.create_task(_send(server, _readings(f"u{i}", 50))) for i in range(5)]
+        await asyncio.sleep(0.02)
+        await asyncio.wait_for(server.close(), 5)
+        replies = await asyncio.wait_for(asyncio.gather(*senders), 5)
+        return server, replies
+
+    server, replies = asyncio.run(run())
+    assert server.stats['open_connections'] == 0
+    assert server.stats['accepted'] + server.stats['rejected'] <= 250
+    # Readings sent after close began were refused, not dropped silently
+    refused = sum(1 for device in replies for reply in device if reply.get('error') == 'server is shutting down')
+    assert refused == server.stats['rejected']
+
+def test_snapshots_are_written_off_the_event_loop(tmp_path):
+    threads = []
+
+    async def run():
+        server = IngestionServer(flush_interval=0.01, snapshot_path=str(tmp_path / 'snapshot'),
+                                 snapshot_interval=0)
+        server.save_snapshot = lambda: threads.append(threading.current_thread()) or 0
+        await asyncio.wait_for(_send(server, _readings('u1', 3)), 5)
+        await asyncio.wait_for(server.close(), 5)
+
+    asyncio.run(run())
+    assert len(threads) >= 2  # Between batches and on close
+    assert threading.main_thread() not in threads
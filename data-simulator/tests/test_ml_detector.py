@@ -0,0 +1,62 @@
+"""
+Tests for the compiled forest, the ML model store and model selection
+Compiled forests must score like scikit-learn, known misses must not evict loaded models, and model choices must follow retraining
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from ml_detector import GLOBAL_MODEL, CompiledForest, MLAnomalyDetector, ModelStore
+
+@pytest.mark.parametrize('max_features', [1.0, 0.67])
+def test_compiled_forest_scores_like_isolation_forest(max_features):
+    ensemble = pytest.importorskip('sklearn.ensemble')
+    rng = np.random.default_rng(5)
+    train = rng.normal([72, 98, 98.6], [8, 1, 0.5], size=(500, 3))
+    model = ensemble.IsolationForest(n_estimators=50, max_features=max_features, random_state=3).fit(train)
+    rows = np.vstack([train[:200], rng.normal([72, 98, 98.6], [40, 6, 3], size=(200, 3))])
+    expected = model.decision_function(rows)
+    compiled = pickle.loads(pickle.dumps(CompiledForest(model)))
+    np.testing.assert_allclose(compiled.decision_function(rows), expected, rtol=0, atol=1e-9)
+    assert ((compiled.decision_function(rows) < 0) == (model.predict(rows) == -1)).all()
+
+def test_misses_do_not_evict_loaded_models(tmp_path):
+    store = ModelStore(str(tmp_path), capacity=2)
+    store.save('u1', 'forest', 10)
+    assert store.get('u1')['samples'] == 10
+    for i in range(50):
+        assert store.get(f"absent{i}") is None
+    assert list(store.cache) == ['u1']
+    assert store.loads == 1 and store.evicted == 0
+    assert len(store.missing) == 50
+
+def test_miss_cache_is_bounded(tmp_path):
+    store = ModelStore(str(tmp_path), miss_capacity=8)
+    for i in range(20):
+        store.get(f"absent{i}")
+    assert list(store.missing) == [f"absent{i}" for i in range(12, 20)]
+
+def test_model_choice_follows_a_new_model(tmp_path):
+    store = ModelStore(str(tmp_path))
+    store.save(GLOBAL_MODEL, 'forest', 10)
+    detector = MLAnomalyDetector(store)
+    assert detector.model_key('u1') == GLOBAL_MODEL
+    store.save('u1', 'forest', 10)
+    assert detector.model_key('u1') == 'u1'
+
+def test_models_written_elsewhere_are_picked_up(tmp_path):
+    store = ModelStore(str(tmp_path), refresh_interval=0)
+    detector = MLAnomalyDetector(store)
+    assert detector.model_key('u1') is None
+    ModelStore(str(tmp_path)).save('u1', 'forest', 10)
+    os.utime(tmp_path, (0, 0))  # A new mtime even on coarse-grained filesystems
+    assert detector.model_key('u1') == 'u1'
+
+def test_model_keys_are_bounded(tmp_path):
+    detector = MLAnomalyDetector(ModelStore(str(tmp_path)), max_users=4)
+    for i in range(10):
+        detector.model_key(f"u{i}")
+    assert list(detector._model_keys) == ['u6', 'u7', 'u8', 'u9']
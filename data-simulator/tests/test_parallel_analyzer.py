@@ -0,0 +1,40 @@
+"""
+Tests for multi-core anomaly analysis
+Parallel results must match in-process analysis, and dead workers must not hang the caller
+"""
+
+import os
+import signal
+
+import pytest
+
+from detector_registry import DetectorRegistry
+from parallel_analyzer import ParallelAnalyzer, generate_benchmark_readings
+
+def test_results_match_in_process_analysis():
+    readings = generate_benchmark_readings(600, users=12, seed=5)
+    registry = DetectorRegistry()
+    expected = [registry.analyze_reading(reading) for reading in readings]
+    with ParallelAnalyzer(workers=2, chunk_size=16) as analyzer:
+        assert list(analyzer.analyze(readings)) == expected
+
+def test_dead_worker_raises_instead_of_hanging():
+    readings = generate_benchmark_readings(200, users=4, seed=6)
+    analyzer = ParallelAnalyzer(workers=2, chunk_size=8)
+    analyzer.start()
+    try:
+        victim = analyzer._processes[0]
+        os.kill(victim.pid, signal.SIGKILL)
+        victim.join(timeout=5)
+        with pytest.raises(RuntimeError, match="exited unexpectedly"):
+            list(analyzer.analyze(readings))
+    finally:
+        analyzer.close()
+    assert analyzer._processes == []
+
+def test_close_after_early_exit_does_not_hang():
+    readings = generate_benchmark_readings(2000, users=20, seed=7)
+    with ParallelAnalyzer(workers=2, chunk_size=4, queue_depth=2) as analyzer:
+        for i, _ in enumerate(analyzer.analyze(readings)):
+            if i == 10:
+                break
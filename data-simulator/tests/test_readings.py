@@ -0,0 +1,54 @@
+"""
+Tests for compact reading types
+The slotted types must keep the original HealthData constructor and list-style history access
+"""
+
+import datetime
+
+import pytest
+
+from anomaly_detector import HealthAnomalyDetector
+from health_data_simulator import HealthData, WearableSimulator
+from readings import HealthReading, ReadingHistory
+
+def test_health_data_keeps_the_dataclass_constructor():
+    data = HealthData(timestamp='2024-03-01T10:00:00', user_id='u1', heart_rate=72, spo2=98.0,
+                      temperature=98.6, fall_detected=False, activity_level='resting',
+                      location={'latitude': 28.6, 'longitude': 77.2}, battery_level=90)
+    assert isinstance(data, HealthReading)
+    assert data.location == {'latitude': 28.6, 'longitude': 77.2}
+    assert data.to_dict()['location'] == {'latitude': 28.6, 'longitude': 77.2}
+    data.location = {'latitude': 1.0, 'longitude': 2.0}
+    assert (data.latitude, data.longitude) == (1.0, 2.0)
+    assert HealthReading.from_dict(data.to_dict()) == data
+
+def test_simulator_returns_health_data():
+    reading = WearableSimulator('u1').generate_reading()
+    assert isinstance(reading, HealthData)
+    assert set(reading.location) == {'latitude', 'longitude'}
+
+def test_history_supports_deque_style_indexing():
+    history = ReadingHistory(maxlen=3)
+    start = datetime.datetime(2024, 3, 1, 10, 0)
+    for i in range(5):
+        history.append({'timestamp': (start + datetime.timedelta(minutes=i)).isoformat(),
+                        'heart_rate': 70 + i, 'spo2': None, 'fall_detected': i == 4})
+    assert [entry['heart_rate'] for entry in history] == [72.0, 73.0, 74.0]
+    assert history[0]['timestamp'] == '2024-03-01T10:02:00'
+    assert history[-1] == {'timestamp': '2024-03-01T10:04:00', 'heart_rate': 74.0, 'spo2': None,
+                           'temperature': None, 'fall_detected': True}
+    assert list(history) == [history[i] for i in range(len(history))]
+    assert history[-2:] == list(history)[1:]
+    assert history[-10:] == list(history) and history[::-1] == list(history)[::-1]
+    assert history[5:] == []
+    with pytest.raises(IndexError):
+        history[3]
+
+def test_detector_history_is_indexable():
+    detector = HealthAnomalyDetector()
+    simulator = WearableSimulator('u1')
+    readings = [simulator.to_dict(simulator.generate_reading()) for _ in range(3)]
+    for reading in readings:
+        detector.analyze_reading(reading)
+    assert detector.history[-1]['heart_rate'] == readings[-1]['heart_rate']
+    assert detector.history[-1]['timestamp'] == readings[-1]['timestamp']
@@ -0,0 +1,63 @@
+"""
+Tests for historical re-scoring
+Resuming must not replay a day into state that already holds it, and dead workers must not hang the job
+"""
+
+import json
+import os
+import pickle
+import random
+
+import pytest
+
+import rescore_job
+from health_data_simulator import import_storage_module
+from rescore_job import CHECKPOINT_FILE, STATE_FILE, RescoreJob
+
+local_storage = import_storage_module('local_storage')
+
+DAYS = ['20240301', '20240302', '20240303']
+
+def _write_days(data_dir):
+    rng = random.Random(3)
+    for day in DAYS:
+        with open(local_storage.partition_path(str(data_dir), day), 'w') as f:
+            for second in range(3):
+                for user in ('u1', 'u2'):
+                    f.write(json.dumps({
+                        'timestamp': f"{day[:4]}-{day[4:6]}-{day[6:]}T10:00:0{second}", 'user_id': user,
+                        'heart_rate': rng.randint(55, 110), 'spo2': round(rng.uniform(93, 100), 1),
+                        'temperature': round(rng.uniform(97, 100), 1), 'fall_detected': False
+                    }) + '\n')
+
+def _windows(out_dir):
+    with open(os.path.join(out_dir, STATE_FILE.format(worker=0)), 'rb') as f:
+        states = pickle.load(f)['states']
+    return {user: [window.ordered() for window in state.windows] for user, state in states.items()}
+
+def test_day_missing_from_checkpoint_is_not_replayed(tmp_path):
+    _write_days(tmp_path)
+    clean = str(tmp_path / 'clean')
+    RescoreJob(str(tmp_path), clean, workers=1).run()
+
+    resumed = str(tmp_path / 'resumed')
+    first = RescoreJob(str(tmp_path), resumed, workers=1).run(last_day=DAYS[1])
+    # Stopped after the worker saved its state for day 2 but before the checkpoint
+    checkpoint_path = os.path.join(resumed, CHECKPOINT_FILE)
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    del checkpoint['days'][DAYS[1]]
+    with open(checkpoint_path, 'w') as f:
+        json.dump(checkpoint, f)
+
+    report = RescoreJob(str(tmp_path), resumed, workers=1).run()
+    assert sorted(report['days']) == DAYS[1:]
+    assert report['days'][DAYS[1]]['readings'] == first['days'][DAYS[1]]['readings'] == 6
+    assert _windows(resumed) == _windows(clean)
+
+def test_dead_worker_raises_instead_of_hanging(tmp_path, monkeypatch):
+    _write_days(tmp_path)
+    monkeypatch.setattr(rescore_job, 'PROGRESS_POLL', 0.05)
+    monkeypatch.setattr(rescore_job, '_worker_main', lambda *args: os._exit(3))
+    with pytest.raises(RuntimeError, match="exited unexpectedly"):
+        RescoreJob(str(tmp_path), str(tmp_path / 'out'), workers=1).run()
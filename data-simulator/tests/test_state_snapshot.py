@@ -0,0 +1,50 @@
+"""
+Tests for detector state snapshots
+Saving after a lazy restore must carry untouched users over without building their states
+"""
+
+from detector_registry import DetectorRegistry
+from health_data_simulator import WearableSimulator
+
+def _fill(registry, users, count=12):
+    for user_id in users:
+        simulator = WearableSimulator(user_id)
+        for _ in range(count):
+            registry.analyze_reading(simulator.to_dict(simulator.generate_reading()))
+
+def _windows(registry):
+    return {user_id: [window.ordered() for window in state.windows] for user_id, state in registry.states.items()}
+
+def test_save_after_lazy_restore_copies_untouched_users(tmp_path):
+    path = str(tmp_path / 'snapshot')
+    original = DetectorRegistry(idle_ttl=None)
+    _fill(original, ['a', 'b', 'c'])
+    original.save_snapshot(path)
+
+    lazy = DetectorRegistry(idle_ttl=None)
+    lazy.restore_snapshot(path, lazy=True)
+    _fill(lazy, ['b'], count=3)
+    assert lazy.save_snapshot(path) == 3
+    assert list(lazy.states) == ['b']  # Nothing was materialized
+
+    restored = DetectorRegistry(idle_ttl=None)
+    restored.restore_snapshot(path)
+    assert list(restored.states) == ['a', 'c', 'b']
+    expected = _windows(original)
+    expected['b'] = _windows(lazy)['b']
+    assert _windows(restored) == expected
+
+def test_save_after_lazy_restore_keeps_the_user_cap(tmp_path):
+    path = str(tmp_path / 'snapshot')
+    original = DetectorRegistry(idle_ttl=None)
+    _fill(original, ['a', 'b', 'c', 'd'])
+    original.save_snapshot(path)
+
+    lazy = DetectorRegistry(idle_ttl=None, max_users=3)
+    lazy.restore_snapshot(path, lazy=True)
+    _fill(lazy, ['a'], count=1)
+    assert lazy.save_snapshot(path) == 3
+
+    restored = DetectorRegistry(idle_ttl=None)
+    restored.restore_snapshot(path)
+    assert list(restored.states) == ['c', 'd', 'a']
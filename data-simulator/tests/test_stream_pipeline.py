@@ -0,0 +1,72 @@
+"""
+Tests for the streaming pipeline
+Batched and unbatched pipelines must score alike, flush idle batches, and surface source errors
+"""
+
+import itertools
+import random
+import threading
+import time
+
+import pytest
+
+from anomaly_detector import HealthAnomalyDetector
+from health_data_simulator import WearableSimulator, metrics
+from stream_pipeline import (Pipeline, alert_filter, analyze, batched, buffered, sink, simulator_source,
+                             unbatched)
+
+def _readings(count):
+    random.seed(21)
+    simulator = WearableSimulator('u1')
+    return [simulator.to_dict(simulator.generate_reading()) for _ in range(count)]
+
+def test_batched_pipeline_scores_like_one_at_a_time():
+    readings = _readings(300)
+    single = list(Pipeline(readings).pipe(analyze(HealthAnomalyDetector())))
+    in_batches = list(Pipeline(readings).pipe(batched(size=32, flush_interval=None))
+                      .pipe(analyze(HealthAnomalyDetector())).pipe(unbatched()))
+    assert in_batches == single
+
+def test_alert_filter_and_sink_see_the_same_events():
+    seen = []
+    events = list(Pipeline(_readings(300)).pipe(analyze(HealthAnomalyDetector()))
+                  .pipe(alert_filter('high')).pipe(sink(seen.append)))
+    assert events and events == seen
+    assert all(analysis['risk_level'] in ('high', 'critical') for _, analysis in events)
+
+def test_partial_batch_is_flushed_while_source_is_idle():
+    def slow_source():
+        yield 1
+        yield 2
+        time.sleep(0.5)
+        yield 3
+
+    started = time.monotonic()
+    stream = iter(Pipeline(slow_source()).pipe(batched(size=10, flush_interval=0.05)))
+    assert next(stream) == [1, 2]
+    assert time.monotonic() - started < 0.4
+    assert next(stream) == [3]
+
+def test_source_errors_reach_the_consumer():
+    def failing():
+        yield 1
+        raise RuntimeError("sensor unplugged")
+
+    with pytest.raises(RuntimeError, match="sensor unplugged"):
+        list(Pipeline(failing()).pipe(buffered(4)))
+
+def test_simulator_source_counts_rounds():
+    simulators = [WearableSimulator('a'), WearableSimulator('b')]
+    assert [reading['user_id'] for reading in simulator_source(simulators, count=2)] == ['a', 'b', 'a', 'b']
+
+@pytest.mark.parametrize('stage, name', [(buffered(maxsize=2), 'pipeline_buffered'),
+                                         (batched(size=1, flush_interval=None, maxsize=2), 'pipeline_batched')])
+def test_producer_stops_when_the_consumer_does(stage, name):
+    stream = iter(Pipeline(itertools.count()).pipe(stage))
+    assert len(list(itertools.islice(stream, 3))) == 3
+    producers = [thread for thread in threading.enumerate() if thread.name == f"{name}-producer"]
+    stream.close()
+    for thread in producers:
+        thread.join(timeout=2)
+    assert producers and not any(thread.is_alive() for thread in producers)
+    assert f'queue="{name}"' not in metrics.REGISTRY.to_prometheus()
@@ -0,0 +1,386 @@
+"""
+Columnar binary storage for Health Monitor readings
+One fixed-width NumPy array per field, memory-mapped on read
+"""
+
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+import json_codec
+from local_storage import encode_record, iter_partition, naive_local
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+COLUMNAR_SUFFIX = ".cols"
+
+# Column name -> on-disk dtype. Strings are dictionary-encoded, timestamps
+# are microseconds since the epoch of the ISO timestamp as naive local
+# time. A boolean cannot hold a missing marker, so fall_detected has a
+# presence column next to it.
+COLUMNS = {
+    'timestamp': '<i8',
+    'user_id': '<i4',
+    'heart_rate': '<i2',
+    'spo2': '<f8',
+    'temperature': '<f8',
+    'fall_detected': '|b1',
+    'fall_detected_present': '|b1',
+    'activity_level': '<i2',
+    'latitude': '<f8',
+    'longitude': '<f8',
+    'battery_level': '<i2'
+}
+
+# Value stored when a reading lacks the field (or has it as null); omitted again on export
+MISSING = {
+    'timestamp': np.iinfo(np.int64).min,
+    'user_id': -1,
+    'heart_rate': -1,
+    'spo2': np.nan,
+    'temperature': np.nan,
+    'fall_detected': False,
+    'fall_detected_present': False,
+    'activity_level': -1,
+    'latitude': np.nan,
+    'longitude': np.nan,
+    'battery_level': -1
+}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+def _encode_datetime(when: datetime) -> int:
+    return (naive_local(when) - _EPOCH) // _MICROSECOND
+
+def _encode_timestamp(value: Optional[str]) -> int:
+    if value is None:
+        return MISSING['timestamp']
+    return _encode_datetime(datetime.fromisoformat(value))
+
+def _decode_timestamp(value: int) -> str:
+    return (_EPOCH + timedelta(microseconds=int(value))).isoformat()
+
+def records_to_columns(records: Iterable[Dict]) -> Dict:
+    """Encode reading dicts into column arrays plus string dictionaries"""
+    user_codes: Dict[str, int] = {}
+    activity_codes: Dict[str, int] = {}
+    rows: Dict[str, List] = {name: [] for name in COLUMNS}
+
+    for record in records:
+        location = record.get('location') or {}
+        user_id = record.get('user_id')
+        activity = record.get('activity_level')
+        rows['timestamp'].append(_encode_timestamp(record.get('timestamp')))
+        rows['user_id'].append(-1 if user_id is None else user_codes.setdefault(user_id, len(user_codes)))
+        rows['activity_level'].append(-1 if activity is None else activity_codes.setdefault(activity, len(activity_codes)))
+        rows['fall_detected_present'].append(record.get('fall_detected') is not None)
+        for name, value in (('latitude', location.get('latitude')), ('longitude', location.get('longitude'))):
+            rows[name].append(MISSING[name] if value is None else value)
+        for name in ('heart_rate', 'spo2', 'temperature', 'fall_detected', 'battery_level'):
+            value = record.get(name)
+            rows[name].append(MISSING[name] if value is None else value)
+
+    columns = {name: np.asarray(values, dtype=COLUMNS[name]) for name, values in rows.items()}
+    return {
+        'columns': columns,
+        'user_ids': list(user_codes),
+        'activity_levels': list(activity_codes)
+    }
+
+def write_columnar(path: str, encoded: Dict):
+    """Write encoded columns to a partition directory"""
+    os.makedirs(path, exist_ok=True)
+    columns = encoded['columns']
+    for name, values in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), values)
+    _write_meta(path, len(columns['timestamp']), encoded['user_ids'], encoded['activity_levels'])
+
+def _write_meta(path: str, count: int, user_ids: List[str], activity_levels: List[str]):
+    meta = {
+        'version': FORMAT_VERSION,
+        'count': count,
+        'columns': dict(COLUMNS),
+        'user_ids': user_ids,
+        'activity_levels': activity_levels
+    }
+    # Metadata goes last so a half-written partition is never opened
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f, separators=(',', ':'))
+
+class ColumnarWriter:
+    """Incrementally build a columnar partition from columnar batches
+
+    Batches use the simulator's layout (string user_id, timestamp and
+    activity_level columns, location split into latitude/longitude).
+    Column data is appended to raw scratch files as it arrives, so memory
+    stays bounded by one batch; close() wraps each one into a .npy file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.count = 0
+        self._codes = {'user_id': {}, 'activity_level': {}}
+        self._scratch = {name: open(self._scratch_path(name), 'wb') for name in COLUMNS}
+
+    def _scratch_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.raw")
+
+    @staticmethod
+    def _by_distinct(values, encode, dtype: str, missing) -> np.ndarray:
+        """Encode a string column with one call per distinct value, None as ``missing``"""
+        values = np.asarray(values, dtype=object)
+        out = np.full(len(values), missing, dtype=dtype)
+        present = ~np.equal(values, None)
+        if present.any():
+            uniques, inverse = np.unique(values[present].astype(str), return_inverse=True)
+            out[present] = np.array([encode(value) for value in uniques.tolist()], dtype=dtype)[inverse]
+        return out
+
+    def _encode_strings(self, name: str, values) -> np.ndarray:
+        """Dictionary-encode a string column, one lookup per distinct value"""
+        codes = self._codes[name]
+        return self._by_distinct(values, lambda value: codes.setdefault(value, len(codes)), COLUMNS[name], MISSING[name])
+
+    @staticmethod
+    def _encode_numbers(name: str, values) -> np.ndarray:
+        """A numeric column with None or NaN stored as the field's MISSING value"""
+        values = np.asarray(values)
+        if values.dtype == object:
+            values = np.array([np.nan if value is None else value for value in values.tolist()], dtype=np.float64)
+        if values.dtype.kind == 'f' and np.dtype(COLUMNS[name]).kind != 'f':
+            missing = np.isnan(values)
+            if missing.any():
+                return np.where(missing, MISSING[name], np.nan_to_num(values)).astype(COLUMNS[name])
+        return values.astype(COLUMNS[name], copy=False)
+
+    def append(self, batch: Dict):
+        """Append a columnar batch
+
+        Missing values may be given as None or, in numeric columns, NaN.
+        """
+        n = len(batch['user_id'])
+        encoded = {
+            'timestamp': self._by_distinct(batch['timestamp'], _encode_timestamp, COLUMNS['timestamp'], MISSING['timestamp']),
+            'user_id': self._encode_strings('user_id', batch['user_id']),
+            'activity_level': self._encode_strings('activity_level', batch['activity_level'])
+                              if 'activity_level' in batch else np.full(n, -1, dtype=COLUMNS['activity_level'])
+        }
+        for name in ('heart_rate', 'spo2', 'temperature', 'fall_detected', 'latitude', 'longitude', 'battery_level'):
+            encoded[name] = self._encode_numbers(name, batch[name]) if name in batch else np.full(n, MISSING[name], dtype=COLUMNS[name])
+        if 'fall_detected' in batch:
+            falls = np.asarray(batch['fall_detected'])
+            encoded['fall_detected_present'] = ~np.equal(falls, None) if falls.dtype == object else \
+                ~np.isnan(falls) if falls.dtype.kind == 'f' else np.ones(n, dtype=bool)
+        else:
+            encoded['fall_detected_present'] = np.zeros(n, dtype=bool)
+
+        for name, values in encoded.items():
+            self._scratch[name].write(values.tobytes())
+        self.count += n
+
+    def close(self) -> str:
+        """Turn the scratch files into .npy columns and write the metadata"""
+        for name, scratch in self._scratch.items():
+            scratch.close()
+            header = {'descr': np.dtype(COLUMNS[name]).str, 'fortran_order': False, 'shape': (self.count,)}
+            with open(os.path.join(self.path, f"{name}.npy"), 'wb') as out, open(self._scratch_path(name), 'rb') as raw:
+                np.lib.format.write_array_header_1_0(out, header)
+                shutil.copyfileobj(raw, out)
+            os.remove(self._scratch_path(name))
+
+        _write_meta(self.path, self.count, list(self._codes['user_id']), list(self._codes['activity_level']))
+        return self.path
+
+class ColumnarPartition:
+    """Read-only view of a columnar partition
+
+    Columns are memory-mapped, so slicing them or handing them to
+    HealthAnomalyDetector.analyze_batch does not copy or parse the data.
+    """
+
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported columnar format version: {self.meta['version']}")
+        self.user_ids = self.meta['user_ids']
+        self.activity_levels = self.meta['activity_levels']
+        self._mmap_mode = 'r' if mmap else None
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.meta['count']
+
+    def column(self, name: str) -> np.ndarray:
+        """A raw (encoded) column, memory-mapped on first access"""
+        if name not in self._columns:
+            if name not in self.meta['columns']:
+                raise KeyError(f"No such column: {name}")
+            self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode=self._mmap_mode)
+        return self._columns[name]
+
+    def user_id_column(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Decoded user ids for a row range"""
+        codes = self.column('user_id')[start:stop]
+        lookup = np.asarray(self.user_ids + ['unknown'], dtype=object)
+        return lookup[codes]  # Code -1 maps to the trailing 'unknown'
+
+    def timestamp_column(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Decoded ISO timestamps for a row range"""
+        values = self.column('timestamp')[start:stop]
+        return np.asarray([_decode_timestamp(v) for v in values.tolist()], dtype=object)
+
+    def number_column(self, name: str, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """A numeric column for a row range with missing values as NaN
+
+        Columns without missing values stay zero-copy slices of the memory
+        map; an integer column holding its MISSING sentinel becomes float,
+        as records_to_batch does for None.
+        """
+        values = self.column(name)[start:stop]
+        missing = MISSING[name]
+        if isinstance(missing, float) or values.dtype.kind == 'b':
+            return values
+        gaps = values == missing
+        if gaps.any():
+            return np.where(gaps, np.nan, values)
+        return values
+
+    def detector_batch(self, start: int = 0, stop: Optional[int] = None,
+                       with_labels: bool = True) -> Dict[str, np.ndarray]:
+        """Columns in the layout HealthAnomalyDetector.analyze_batch expects
+
+        Numeric columns are slices of the memory map (missing values as
+        NaN); with ``with_labels`` the user_id and timestamp columns are
+        decoded too.
+        """
+        batch = {
+            name: self.number_column(name, start, stop)
+            for name in ('heart_rate', 'spo2', 'temperature', 'fall_detected')
+        }
+        if with_labels:
+            batch['user_id'] = self.user_id_column(start, stop)
+            batch['timestamp'] = self.timestamp_column(start, stop)
+        return batch
+
+    def to_batch(self, start: int = 0, stop: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """All fields for a row range as a simulator-style columnar batch"""
+        batch = self.detector_batch(start, stop)
+        activity = np.asarray(self.activity_levels + [None], dtype=object)
+        batch['activity_level'] = activity[self.column('activity_level')[start:stop]]
+        for name in ('latitude', 'longitude', 'battery_level'):
+            batch[name] = self.number_column(name, start, stop)
+        return batch
+
+    def select(self, start: int = 0, stop: Optional[int] = None, user_ids: Optional[Iterable[str]] = None,
+               since: Optional[datetime] = None, until: Optional[datetime] = None) -> np.ndarray:
+        """Row numbers in [start, stop) for the given users and time range (inclusive)"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        mask = np.ones(max(0, stop - start), dtype=bool)
+        if user_ids is not None:
+            codes = {user_id: code for code, user_id in enumerate(self.user_ids)}
+            wanted = [codes[user_id] for user_id in user_ids if user_id in codes]
+            if not wanted:
+                return np.empty(0, dtype=np.int64)
+            mask &= np.isin(self.column('user_id')[start:stop], wanted)
+        if since is not None or until is not None:
+            timestamps = self.column('timestamp')[start:stop]
+            mask &= timestamps != MISSING['timestamp']
+            if since is not None:
+                mask &= timestamps >= _encode_datetime(since)
+            if until is not None:
+                mask &= timestamps <= _encode_datetime(until)
+        return np.flatnonzero(mask) + start
+
+    def iter_records(self, rows: Optional[np.ndarray] = None, chunk_size: int = 65536) -> Iterator[Dict]:
+        """Rebuild reading dicts in their original JSON shape
+
+        ``rows`` limits the output to those row numbers (e.g. from
+        select()); columns are decoded ``chunk_size`` rows at a time.
+        """
+        total = len(self) if rows is None else len(rows)
+        for offset in range(0, total, chunk_size):
+            if rows is None:
+                index = slice(offset, min(offset + chunk_size, total))
+            else:
+                index = rows[offset:offset + chunk_size]
+            yield from self._records(index)
+
+    def _records(self, index) -> Iterator[Dict]:
+        columns = {name: self.column(name)[index].tolist() for name in self.meta['columns']}
+        if 'fall_detected_present' not in columns:
+            columns['fall_detected_present'] = [True] * len(columns['timestamp'])  # Older partitions
+        for i in range(len(columns['timestamp'])):
+            record = {}
+            if columns['timestamp'][i] != MISSING['timestamp']:
+                record['timestamp'] = _decode_timestamp(columns['timestamp'][i])
+            if columns['user_id'][i] >= 0:
+                record['user_id'] = self.user_ids[columns['user_id'][i]]
+            for name in ('heart_rate', 'spo2', 'temperature'):
+                value = columns[name][i]
+                if not self._is_missing(name, value):
+                    record[name] = value
+            if columns['fall_detected_present'][i]:
+                record['fall_detected'] = columns['fall_detected'][i]
+            if columns['activity_level'][i] >= 0:
+                record['activity_level'] = self.activity_levels[columns['activity_level'][i]]
+            latitude, longitude = columns['latitude'][i], columns['longitude'][i]
+            if latitude == latitude and longitude == longitude:  # Not NaN
+                record['location'] = {'latitude': latitude, 'longitude': longitude}
+            if columns['battery_level'][i] >= 0:
+                record['battery_level'] = columns['battery_level'][i]
+            yield record
+
+    @staticmethod
+    def _is_missing(name: str, value) -> bool:
+        missing = MISSING[name]
+        if isinstance(missing, float):
+            return value != value  # NaN
+        return value == missing
+
+def json_to_columnar(src_path: str, dst_path: Optional[str] = None) -> str:
+    """Convert a JSON array or JSONL day file into a columnar partition"""
+    if dst_path is None:
+        dst_path = os.path.splitext(src_path)[0] + COLUMNAR_SUFFIX
+    write_columnar(dst_path, records_to_columns(iter_partition(src_path)))
+    return dst_path
+
+def columnar_to_json(src_path: str, dst_path: str) -> str:
+    """Convert a columnar partition back to JSONL (or a JSON array for .json)"""
+    partition = ColumnarPartition(src_path, mmap=False)
+    if dst_path.endswith('.jsonl'):
+        with open(dst_path, 'wb') as f:
+            for record in partition.iter_records():
+                f.write(encode_record(record))
+    else:
+        json_codec.dump(list(partition.iter_records()), dst_path)
+    return dst_path
+
+def main():
+    """Convert day files between JSON and the columnar format"""
+    parser = argparse.ArgumentParser(description="Convert health readings to/from columnar storage")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    to_columnar = subparsers.add_parser('to-columnar', help="JSON/JSONL day file -> columnar partition")
+    to_columnar.add_argument('source')
+    to_columnar.add_argument('destination', nargs='?')
+    to_json = subparsers.add_parser('to-json', help="columnar partition -> JSON/JSONL day file")
+    to_json.add_argument('source')
+    to_json.add_argument('destination')
+    args = parser.parse_args()
+
+    if args.command == 'to-columnar':
+        path = json_to_columnar(args.source, args.destination)
+    else:
+        path = columnar_to_json(args.source, args.destination)
+    print(f"📦 Wrote {path}")
+
+if __name__ == "__main__":
+    main()
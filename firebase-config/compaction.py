@@ -0,0 +1,480 @@
+"""
+Compaction and retention for Health Monitor storage
+Finished day partitions become compressed, block-indexed cold files; old ones are expired by tier
+"""
+
+import argparse
+import bisect
+import heapq
+import os
+import shutil
+import struct
+import threading
+import zlib
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import json_codec
+import metrics
+from local_storage import (COLD_SUFFIX, INDEX_SUFFIX, JSONL_SUFFIX, LEGACY_SUFFIX, day_partitions,
+                           iter_partition, list_partition_days, naive_local, partition_path)
+
+COLD_FORMAT_VERSION = 1
+COLD_MAGIC = b"HMCOLD01"
+BLOCK_SIZE = 1 << 15  # Uncompressed bytes of JSONL per block
+SPILL_BYTES = 64 << 20  # Encoded lines grouped in memory before a sorted run is spilled
+_TRAILER = struct.Struct('<Q8s')  # Footer offset, magic
+
+logger = metrics.get_logger('compaction')
+
+def default_codec() -> str:
+    """zstd when the zstandard package is installed, zlib otherwise"""
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return 'zlib'
+    return 'zstd'
+
+def _compressor(codec: str) -> Callable[[bytes], bytes]:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress
+    if codec == 'zlib':
+        return lambda data: zlib.compress(data, 6)
+    raise ValueError(f"Unknown codec: {codec}")
+
+def _decompressor(codec: str) -> Callable[[bytes], bytes]:
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Cold partition is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress
+    if codec == 'zlib':
+        return zlib.decompress
+    raise ValueError(f"Unknown codec: {codec}")
+
+def _timestamp(record: Dict) -> Optional[datetime]:
+    try:
+        when = datetime.fromisoformat(record['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return naive_local(when)
+
+def write_cold(path: str, records: Iterable[Dict], block_size: int = BLOCK_SIZE,
+               codec: Optional[str] = None, spill_bytes: int = SPILL_BYTES) -> int:
+    """Write records as a cold partition, returning how many were written
+
+    Records are grouped by user (keeping each user's order) and written
+    as JSONL lines in independently compressed blocks of about
+    ``block_size`` bytes. A footer maps every block to its offset, line
+    count and time span, and every user to their run of lines, so reads
+    decompress only the blocks they need. Grouping happens in memory, as
+    encoded lines; past ``spill_bytes`` the groups are written to sorted
+    run files next to ``path`` and merged, so memory stays bounded
+    however large the day is.
+    """
+    codec = codec or default_codec()
+    compress = _compressor(codec)
+    users: Dict = {}
+    spans: Dict = {}
+    runs: List[str] = []
+    grouped = 0
+    try:
+        for record in records:
+            user_id = record.get('user_id')
+            key = json_codec.dumps(user_id)  # Hashable for any JSON user id
+            lines = users.get(key)
+            if lines is None:
+                lines = users[key] = []
+            line = json_codec.encode_line(record)
+            lines.append(line)
+            grouped += len(line)
+            when = _timestamp(record)
+            span = spans.get(key)
+            spans[key] = (when, when) if span is None else _widen(span, when)
+            if grouped >= spill_bytes:
+                runs.append(_spill_run(f"{path}.run{len(runs)}", users))
+                users, grouped = {}, 0
+        if runs and users:
+            runs.append(_spill_run(f"{path}.run{len(runs)}", users))
+            users = {}
+        return _write_blocks(path, _merge_runs(runs) if runs else _grouped_lines(users),
+                             spans, block_size, codec, compress)
+    finally:
+        for run in runs:
+            _remove(run)
+
+def _spill_run(path: str, users: Dict) -> str:
+    """Write grouped lines as ``key<TAB>line`` sorted by key (JSON never holds a raw tab)"""
+    with open(path, 'wb') as f:
+        for key in sorted(users):
+            f.writelines(key + b'\t' + line for line in users[key])
+    return path
+
+def _read_run(path: str) -> Iterator[Tuple[bytes, bytes]]:
+    with open(path, 'rb') as f:
+        for entry in f:
+            key, _, line = entry.partition(b'\t')
+            yield key, line
+
+def _merge_runs(runs: List[str]) -> Iterator[Tuple[bytes, bytes]]:
+    # heapq.merge is stable, so each user's lines keep their spill order
+    return heapq.merge(*(_read_run(run) for run in runs), key=lambda entry: entry[0])
+
+def _grouped_lines(users: Dict) -> Iterator[Tuple[bytes, bytes]]:
+    for key in sorted(users):
+        for line in users.pop(key):
+            yield key, line
+
+def _write_blocks(path: str, entries: Iterator[Tuple[bytes, bytes]], spans: Dict, block_size: int,
+                  codec: str, compress: Callable[[bytes], bytes]) -> int:
+    """Write (user key, line) pairs, sorted by key, as a cold partition"""
+    temporary = path + '.tmp'
+    blocks: List[list] = []
+    user_runs: List[list] = []
+    count = 0
+    with open(temporary, 'wb') as f:
+        f.write(COLD_MAGIC)
+        buffer: List[bytes] = []
+        buffered = 0
+        low = high = None
+        unbounded = False
+
+        def flush_block():
+            data = compress(b''.join(buffer))
+            blocks.append([f.tell(), len(data), len(buffer),
+                           None if unbounded or low is None else low.isoformat(),
+                           None if unbounded or high is None else high.isoformat()])
+            f.write(data)
+
+        current = None
+        for key, line in entries:
+            if key != current:
+                current = key
+                user_runs.append([json_codec.loads(key), count, 0])
+                # A block's span is widened per user, which is all pruning needs
+                first, last = spans[key]
+            user_runs[-1][2] += 1
+            count += 1
+            if not buffer:
+                low = high = None
+                unbounded = False
+            buffer.append(line)
+            buffered += len(line)
+            if first is None or last is None:
+                unbounded = True
+            else:
+                low = first if low is None or first < low else low
+                high = last if high is None or last > high else high
+            if buffered >= block_size:
+                flush_block()
+                buffer, buffered = [], 0
+        if buffer:
+            flush_block()
+
+        footer_offset = f.tell()
+        footer = {'version': COLD_FORMAT_VERSION, 'codec': codec, 'count': count,
+                  'blocks': blocks, 'users': user_runs}
+        f.write(zlib.compress(json_codec.dumps(footer)))
+        f.write(_TRAILER.pack(footer_offset, COLD_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return count
+
+def _widen(span: Tuple, when: Optional[datetime]) -> Tuple:
+    low, high = span
+    if when is None or low is None:
+        return (None, None)  # Any record without a time makes the span unbounded
+    return (min(low, when), max(high, when))
+
+class ColdPartition:
+    """Read access to a cold partition written by write_cold"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            f.seek(-_TRAILER.size, os.SEEK_END)
+            end = f.tell()
+            footer_offset, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+            if magic != COLD_MAGIC:
+                raise ValueError(f"Not a cold partition: {path}")
+            f.seek(footer_offset)
+            footer = json_codec.loads(zlib.decompress(f.read(end - footer_offset)))
+        if footer['version'] != COLD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported cold partition version: {footer['version']}")
+        self.codec = footer['codec']
+        self.count = footer['count']
+        self.blocks = footer['blocks']  # [offset, length, lines, min timestamp, max timestamp]
+        self.users = {user_id: (first, count) for user_id, first, count in footer['users']}
+        self._starts = [0]
+        for block in self.blocks:
+            self._starts.append(self._starts[-1] + block[2])
+        self._decompress = _decompressor(self.codec)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self.records()
+
+    @property
+    def user_ids(self) -> List:
+        return list(self.users)
+
+    def stored_bytes(self) -> int:
+        return os.path.getsize(self.path)
+
+    def _overlaps(self, index: int, start: Optional[datetime], end: Optional[datetime]) -> bool:
+        low, high = self.blocks[index][3], self.blocks[index][4]
+        if low is None or high is None:
+            return True
+        if start is not None and datetime.fromisoformat(high) < start:
+            return False
+        return end is None or datetime.fromisoformat(low) <= end
+
+    def lines(self, first: int, stop: int, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> Iterator[bytes]:
+        """Encoded lines ``first`` to ``stop``, skipping blocks outside [start, end]"""
+        if first >= stop:
+            return
+        index = bisect.bisect_right(self._starts, first) - 1
+        with open(self.path, 'rb') as f:
+            while index < len(self.blocks) and self._starts[index] < stop:
+                if self._overlaps(index, start, end):
+                    offset, length = self.blocks[index][0], self.blocks[index][1]
+                    f.seek(offset)
+                    lines = self._decompress(f.read(length)).split(b'\n')
+                    base = self._starts[index]
+                    yield from lines[max(first - base, 0):min(stop - base, len(lines) - 1)]
+                index += 1
+
+    def records(self, user_ids: Optional[Iterable] = None, start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Records, optionally only of some users and from blocks overlapping [start, end]
+
+        Time bounds only prune whole blocks; callers filter exact times.
+        """
+        if user_ids is None:
+            runs = [(0, self.count)]
+        else:
+            runs = sorted(self.users[user_id] for user_id in set(user_ids) if user_id in self.users)
+        loads = json_codec.loads
+        for first, count in runs:
+            for line in self.lines(first, first + count, start, end):
+                yield loads(line)
+
+    def recent(self, user_id, limit: int = 10) -> List[Dict]:
+        """A user's newest ``limit`` records, oldest first"""
+        first, count = self.users.get(user_id, (0, 0))
+        if limit <= 0 or not count:
+            return []
+        stop = first + count
+        return [json_codec.loads(line) for line in self.lines(max(first, stop - limit), stop)]
+
+class RetentionPolicy:
+    """How long each storage tier keeps a day
+
+    Days newer than ``hot_days`` stay as raw JSON/JSONL files. Older days
+    are compacted into cold partitions until ``raw_days``, when the raw
+    readings are deleted and only the rollups remain. Minute rollups are
+    deleted after ``minute_rollup_days``; hourly and daily rollups are
+    kept. ``None`` keeps a tier forever; with raw readings kept forever,
+    minute rollups may still expire.
+    """
+
+    def __init__(self, hot_days: int = 7, raw_days: Optional[int] = 90,
+                 minute_rollup_days: Optional[int] = 365):
+        if hot_days < 1:
+            raise ValueError("hot_days must be at least 1: today's partition is still being written")
+        if raw_days is not None and raw_days < hot_days:
+            raise ValueError("raw_days must be at least hot_days")
+        if minute_rollup_days is not None and raw_days is not None and minute_rollup_days < raw_days:
+            # Expiring raw days rebuilds missing minute rollups, which would double-count
+            # into the hourly and daily files if minute rollups were dropped first
+            raise ValueError("minute_rollup_days must be at least raw_days")
+        self.hot_days = hot_days
+        self.raw_days = raw_days
+        self.minute_rollup_days = minute_rollup_days
+
+    def to_dict(self) -> Dict:
+        return {'hot_days': self.hot_days, 'raw_days': self.raw_days,
+                'minute_rollup_days': self.minute_rollup_days}
+
+def _day_age(day: str, today: date) -> int:
+    return (today - datetime.strptime(day, '%Y%m%d').date()).days
+
+class Compactor:
+    """Applies a RetentionPolicy to a data directory
+
+    Compaction only touches days at least ``hot_days`` old, so the
+    partition being appended to is never rewritten. An in-process writer
+    may still hold yesterday's file open: FirebaseHealthDB.compact closes
+    it first, and ``open_days`` (the days such writers hold) are left
+    alone, as the background thread cannot close them. ``on_change`` is
+    called with every day compacted or expired, e.g. to drop caches.
+    """
+
+    def __init__(self, data_dir: str, policy: Optional[RetentionPolicy] = None,
+                 block_size: int = BLOCK_SIZE, codec: Optional[str] = None,
+                 open_days: Optional[Callable[[], Iterable[str]]] = None,
+                 on_change: Optional[Callable[[str], None]] = None):
+        self.data_dir = data_dir
+        self.policy = policy or RetentionPolicy()
+        self.block_size = block_size
+        self.codec = codec or default_codec()
+        self.open_days = open_days
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def plan(self, today: Optional[date] = None) -> List[Tuple[str, str]]:
+        """(action, day) pairs a run would perform, oldest day first"""
+        today = today or date.today()
+        busy = set(self.open_days()) if self.open_days else set()
+        actions = []
+        for day in list_partition_days(self.data_dir):
+            if day in busy:
+                continue  # Picked up by a later run, once the writer has moved on
+            age = _day_age(day, today)
+            if self.policy.raw_days is not None and age >= self.policy.raw_days:
+                actions.append(('expire', day))
+            elif age >= self.policy.hot_days and day_partitions(self.data_dir, day, cold=False):
+                actions.append(('compact', day))
+        if self.policy.minute_rollup_days is not None:
+            for day in self._minute_rollup_days():
+                if _day_age(day, today) >= self.policy.minute_rollup_days:
+                    actions.append(('expire_rollups', day))
+        return actions
+
+    def run(self, today: Optional[date] = None) -> Dict:
+        """Compact and expire everything that is due, returning a summary"""
+        summary = {'compacted': [], 'expired': [], 'expired_rollups': [],
+                   'raw_bytes': 0, 'cold_bytes': 0, 'freed_bytes': 0}
+        for action, day in self.plan(today):
+            try:
+                if action == 'compact':
+                    result = self.compact_day(day)
+                    summary['compacted'].append(day)
+                    summary['raw_bytes'] += result['raw_bytes']
+                    summary['cold_bytes'] += result['cold_bytes']
+                elif action == 'expire':
+                    summary['freed_bytes'] += self.expire_day(day)
+                    summary['expired'].append(day)
+                else:
+                    summary['freed_bytes'] += _remove(self._minute_rollup_path(day))
+                    summary['expired_rollups'].append(day)
+                    continue
+                if self.on_change:
+                    self.on_change(day)
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Failed to {action.replace('_', ' ')} {day}: {e}")
+        return summary
+
+    def compact_day(self, day: str) -> Dict:
+        """Rewrite a day's raw files as one cold partition and delete them"""
+        sources = day_partitions(self.data_dir, day, cold=False)
+        raw_bytes = sum(os.path.getsize(path) for path in sources)
+        cold_path = partition_path(self.data_dir, day, COLD_SUFFIX)
+        # Legacy array first, then JSONL: the same order get_recent_data assumes
+        records = (record for path in sources for record in iter_partition(path))
+        count = write_cold(cold_path, records, self.block_size, self.codec)
+        for path in sources + [partition_path(self.data_dir, day, INDEX_SUFFIX)]:
+            _remove(path)
+        cold_bytes = os.path.getsize(cold_path)
+        logger.info(f"🗜️ Compacted {day}: {count:,} readings, {raw_bytes:,} -> {cold_bytes:,} bytes")
+        return {'day': day, 'records': count, 'raw_bytes': raw_bytes, 'cold_bytes': cold_bytes}
+
+    def expire_day(self, day: str) -> int:
+        """Delete a day's raw readings, keeping its rollups; returns bytes freed"""
+        if not os.path.exists(self._minute_rollup_path(day)):
+            self._rebuild_rollups(day)
+        freed = 0
+        for suffix in (LEGACY_SUFFIX, JSONL_SUFFIX, INDEX_SUFFIX, COLD_SUFFIX):
+            freed += _remove(partition_path(self.data_dir, day, suffix))
+        # A columnar copy holds the same raw readings
+        from columnar_store import COLUMNAR_SUFFIX
+        columnar = partition_path(self.data_dir, day, COLUMNAR_SUFFIX)
+        if os.path.isdir(columnar):
+            freed += sum(entry.stat().st_size for entry in os.scandir(columnar))
+            shutil.rmtree(columnar)
+        logger.info(f"🧹 Expired raw readings for {day}")
+        return freed
+
+    def _rebuild_rollups(self, day: str):
+        """Roll up a day that never was (rollups disabled, or older data) before its raw files go"""
+        from rollup_store import RollupStore
+
+        store = RollupStore(self.data_dir)
+        for path in day_partitions(self.data_dir, day):
+            store.add_many(iter_partition(path))
+        store.close()
+
+    def _minute_rollup_path(self, day: str) -> str:
+        from rollup_store import ROLLUP_PREFIX
+        return os.path.join(self.data_dir, f"{ROLLUP_PREFIX}1m_{day}.jsonl")
+
+    def _minute_rollup_days(self) -> List[str]:
+        from rollup_store import ROLLUP_PREFIX
+        prefix = f"{ROLLUP_PREFIX}1m_"
+        return sorted(name[len(prefix):-len('.jsonl')] for name in os.listdir(self.data_dir)
+                      if name.startswith(prefix) and name.endswith('.jsonl'))
+
+    def start(self, interval: float = 3600.0) -> 'Compactor':
+        """Run every ``interval`` seconds on a daemon thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True, name='compaction')
+            self._thread.start()
+        return self
+
+    def _run(self, interval: float):
+        while True:
+            self.run()
+            if self._stop.wait(interval):
+                return
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+def _remove(path: str) -> int:
+    """Delete a file if present, returning its size"""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return size
+
+def main():
+    """Show or apply the retention plan for a data directory"""
+    parser = argparse.ArgumentParser(description="Compact and expire Health Monitor day partitions")
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--hot-days', type=int, default=7)
+    parser.add_argument('--raw-days', type=int, default=90, help="0 keeps raw readings forever")
+    parser.add_argument('--minute-rollup-days', type=int, default=365, help="0 keeps minute rollups forever")
+    parser.add_argument('--codec', choices=('zlib', 'zstd'), default=None)
+    parser.add_argument('--dry-run', action='store_true', help="only print what would be done")
+    args = parser.parse_args()
+    metrics.configure_logging()
+
+    try:
+        policy = RetentionPolicy(args.hot_days, args.raw_days or None, args.minute_rollup_days or None)
+    except ValueError as e:
+        parser.error(str(e))
+    compactor = Compactor(args.data_dir, policy, codec=args.codec)
+    if args.dry_run:
+        for action, day in compactor.plan():
+            print(f"{action:>15} {day}")
+        return
+    summary = compactor.run()
+    saved = summary['raw_bytes'] - summary['cold_bytes']
+    print(f"🗜️ Compacted {len(summary['compacted'])} day(s), saving {saved:,} bytes; "
+          f"expired {len(summary['expired'])} day(s) and {len(summary['expired_rollups'])} minute rollup file(s)")
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,55 @@ Firebase Configuration for Health Monitor
 Educational project - sets up Firestore database connection
 """
 
-import firebase_admin
-from firebase_admin import credentials, firestore
 import json
 import os
-from datetime import datetime
-from typing import Dict, Optional
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, Optional
+
+import json_codec
+import metrics
+from firestore_writer import FirestoreBatchWriter, get_firestore_client
+from local_storage import (JSONL_SUFFIX, LEGACY_SUFFIX, JsonlDayWriter,
+                           RecentIndex, encode_record, partition_day, partition_path)
+from rollup_store import RollupStore
+
+if TYPE_CHECKING:
+    from range_query import RangeQuery  # NumPy-backed, imported on first query
+
+ALERTS_PREFIX = "alerts_"
+
+logger = metrics.get_logger('storage')
 
 class FirebaseHealthDB:
     """Firebase Firestore database manager for health data"""
     
-    def __init__(self, config_path: Optional[str] = None):
+    def __init__(self, config_path: Optional[str] = None, data_dir: str = ".",
+                 storage_format: str = "jsonl", fsync_every: int = 100,
+                 fsync_interval_ms: int = 1000, rollups: bool = True):
         self.db = None
         self.app = None
         self.config_path = config_path or "firebase-config.json"
         
+        # Local storage: append-only JSON Lines, or the legacy JSON array rewrite
+        if storage_format not in ("jsonl", "json"):
+            raise ValueError(f"Unknown storage format: {storage_format}")
+        self.data_dir = data_dir
+        self.storage_format = storage_format
+        self.fsync_every = fsync_every
+        self.fsync_interval_ms = fsync_interval_ms
+        self._writer = None
+        self._writer_day = None
+        
+        # Per-user offsets of recent records, so lookups avoid full-file scans
+        self._index = RecentIndex(data_dir)
+        
+        # Minute/hour/day aggregates for long-range history charts
+        self._rollups = RollupStore(data_dir, durable=True) if rollups else None
+        
+        # Batched Firestore writes, used once a client is attached
+        self._firestore_writer = None
+        self._alert_writer = None
+        
     def initialize_firebase(self) -> bool:
         """Initialize Firebase connection"""
         try:
@@ -26,9 +60,7 @@ class FirebaseHealthDB:
                 self.create_mock_config()
             
             # In a real project, you would use actual Firebase credentials
-            # cred = credentials.Certificate(self.config_path)
-            # self.app = firebase_admin.initialize_app(cred)
-            # self.db = firestore.client()
+            # self.attach_firestore(get_firestore_client(self.config_path))
             
             print("🔥 Firebase initialized (Mock mode for educational purposes)")
             print("📝 To use real Firebase:")
@@ -43,6 +75,20 @@ class FirebaseHealthDB:
             print(f"❌ Firebase initialization failed: {e}")
             return False
     
+    def attach_firestore(self, client, **writer_options):
+        """Send readings to Firestore through a batched write-behind buffer
+
+        ``client`` is a firestore.Client (see get_firestore_client) or a
+        FakeFirestoreClient; ``writer_options`` go to FirestoreBatchWriter.
+        """
+        if self._firestore_writer:
+            self._firestore_writer.close()
+        if self._alert_writer:
+            self._alert_writer.close()
+        self.db = client
+        self._firestore_writer = FirestoreBatchWriter(client, 'health_readings', **writer_options)
+        self._alert_writer = FirestoreBatchWriter(client, 'alerts', **writer_options)
+    
     def create_mock_config(self):
         """Create mock Firebase configuration for educational purposes"""
         mock_config = {
@@ -62,55 +108,182 @@ class FirebaseHealthDB:
         
         print(f"📄 Mock Firebase config created: {self.config_path}")
     
+    @metrics.timed('persist')
     def save_health_data(self, data: Dict) -> bool:
         """Save health data to Firestore (mock implementation)"""
         try:
-            # Mock implementation - in real project, this would save to Firestore
-            # doc_ref = self.db.collection('health_readings').add(data)
+            if self._rollups:
+                self._rollups.add(data)
             
-            # For now, save to local JSON file for demonstration
-            filename = f"health_data_{datetime.now().strftime('%Y%m%d')}.json"
+            if self._firestore_writer:
+                # Buffered and committed in batches of up to 500 documents
+                self._firestore_writer.add(data)
+                return True
             
-            # Load existing data
-            existing_data = []
-            if os.path.exists(filename):
-                with open(filename, 'r') as f:
-                    existing_data = json.load(f)
+            # For now, save to a local day file for demonstration
+            day = partition_day()
+            if self.storage_format == "jsonl":
+                filename = self._append_record(day, data)
+            else:
+                filename = self._rewrite_legacy_file(day, data)
             
-            # Add new data
-            existing_data.append(data)
+            logger.debug("💾 Health data saved to %s", filename)
+            return True
             
-            # Save back to file
-            with open(filename, 'w') as f:
-                json.dump(existing_data, f, indent=2)
+        except Exception as e:
+            logger.error("❌ Failed to save health data: %s", e)
+            return False
+    
+    def save_alert(self, alert: Dict) -> bool:
+        """Save an alert state change (opened, escalated or resolved)"""
+        try:
+            if self._alert_writer:
+                self._alert_writer.add(alert)
+                return True
+            
+            # Alerts are rare state changes, so a plain append per alert is enough
+            filename = os.path.join(self.data_dir, f"{ALERTS_PREFIX}{partition_day()}{JSONL_SUFFIX}")
+            with open(filename, 'ab') as f:
+                f.write(encode_record(alert))
             
-            print(f"💾 Health data saved to {filename}")
+            logger.info("🚨 Alert %s: %s for %s", alert.get('event', 'saved'), alert['alert_type'], alert['user_id'])
             return True
             
         except Exception as e:
-            print(f"❌ Failed to save health data: {e}")
+            logger.error("❌ Failed to save alert: %s", e)
             return False
     
+    def _append_record(self, day: str, data: Dict) -> str:
+        """Append one record to the day's JSONL partition"""
+        if self._writer_day != day:
+            # New day: close the finished partition and start the next one
+            self._close_writer()
+            self._index.day_index(day)  # Index existing lines before appending
+            self._writer = JsonlDayWriter(
+                partition_path(self.data_dir, day, JSONL_SUFFIX),
+                fsync_every=self.fsync_every,
+                fsync_interval_ms=self.fsync_interval_ms
+            )
+            self._writer_day = day
+        
+        offset = self._writer.append(data)
+        if data.get('user_id') is not None:
+            self._index.record(day, data['user_id'], offset)
+        return self._writer.path
+    
+    def _rewrite_legacy_file(self, day: str, data: Dict) -> str:
+        """Load, extend and rewrite the day's JSON array file (legacy mode)"""
+        filename = partition_path(self.data_dir, day, LEGACY_SUFFIX)
+        
+        # Load existing data
+        existing_data = []
+        if os.path.exists(filename):
+            existing_data = json_codec.load(filename)
+        
+        # Add new data
+        existing_data.append(data)
+        
+        # Save back to file (compact: this is rewritten on every reading)
+        json_codec.dump(existing_data, filename)
+        
+        return filename
+    
+    @metrics.timed('retrieve')
     def get_recent_data(self, user_id: str, limit: int = 10) -> list:
         """Get recent health data for a user (mock implementation)"""
         try:
             # Mock implementation - in real project, this would query Firestore
-            filename = f"health_data_{datetime.now().strftime('%Y%m%d')}.json"
-            
-            if not os.path.exists(filename):
-                return []
+            if self._writer:
+                self._writer.flush()
             
-            with open(filename, 'r') as f:
-                all_data = json.load(f)
-            
-            # Filter by user_id and get recent entries
-            user_data = [d for d in all_data if d.get('user_id') == user_id]
-            return user_data[-limit:] if user_data else []
+            # Seek to the user's newest records, walking back across days
+            return self._index.recent(user_id, limit)
             
         except Exception as e:
-            print(f"❌ Failed to retrieve health data: {e}")
+            logger.error("❌ Failed to retrieve health data: %s", e)
             return []
     
+    @metrics.timed('history')
+    def get_history(self, user_id: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, resolution: Optional[str] = None,
+                    max_points: int = 500) -> Dict:
+        """Aggregated history for charts (default: the last 7 days)
+        
+        Returns min/max/mean/count per metric at the finest of 1m/1h/1d
+        that fits ``max_points``, unless ``resolution`` is given.
+        """
+        if not self._rollups:
+            return {'user_id': user_id, 'resolution': None, 'points': []}
+        end = end or datetime.now()
+        start = start or end - timedelta(days=7)
+        try:
+            return self._rollups.query(user_id, start, end, resolution, max_points)
+        except Exception as e:
+            logger.error("❌ Failed to retrieve history: %s", e)
+            return {'user_id': user_id, 'resolution': None, 'points': []}
+    
+    def query_range(self, start: datetime, end: Optional[datetime] = None,
+                    user_ids: Optional[list] = None, **options) -> 'RangeQuery':
+        """Stream raw readings between start and end (inclusive) across day files
+        
+        Iterate the result for reading dicts or call chunks() for columnar
+        batches; memory stays bounded however long the range is.
+        """
+        from range_query import RangeQuery
+        
+        if self._writer:
+            self._writer.flush()
+        return RangeQuery(self.data_dir, start, end or datetime.now(), user_ids, **options)
+    
+    def compact(self, policy=None, today=None) -> Dict:
+        """Compact finished days and apply retention tiers (see compaction)
+        
+        Reads keep working across tiers: compacted days are served from
+        their cold files, and expired days from the rollups.
+        """
+        from compaction import Compactor
+        
+        compactor = Compactor(self.data_dir, policy, on_change=self._index.forget)
+        due = {day for _, day in compactor.plan(today)}
+        if self._writer_day in due:
+            self._close_writer()  # Never rewrite a partition under an open writer
+        if self._rollups:
+            self._rollups.flush_pending()  # Expiry checks the rollup files for each day
+        return compactor.run(today)
+    
+    def start_compaction(self, policy=None, interval: float = 3600.0):
+        """Compact and expire on a background thread every ``interval`` seconds
+        
+        The thread leaves the day of an open writer alone (a later run
+        picks it up) and drops cached offsets of the days it rewrites.
+        Returns the Compactor; call its stop() before close().
+        """
+        from compaction import Compactor
+        
+        compactor = Compactor(self.data_dir, policy, on_change=self._index.forget,
+                              open_days=lambda: [self._writer_day] if self._writer else [])
+        return compactor.start(interval)
+    
+    def close(self):
+        """Flush and close any open storage files"""
+        self._close_writer()
+        if self._rollups:
+            self._rollups.close()
+        if self._firestore_writer:
+            self._firestore_writer.close()
+            self._firestore_writer = None
+        if self._alert_writer:
+            self._alert_writer.close()
+            self._alert_writer = None
+    
+    def _close_writer(self):
+        """Close the current day's writer and persist its index sidecar"""
+        if self._writer:
+            self._writer.close()
+            self._index.save(self._writer_day)
+            self._writer = None
+            self._writer_day = None
+    
     def setup_database_structure(self):
         """Set up Firestore collections and indexes (mock implementation)"""
         collections = {
@@ -147,6 +320,7 @@ class FirebaseHealthDB:
 
 def main():
     """Test Firebase setup"""
+    metrics.configure_logging()
     print("🔥 Firebase Health Monitor Setup")
     print("=" * 50)
     
@@ -179,6 +353,8 @@ def main():
         recent_data = firebase_db.get_recent_data('demo_user_001', 5)
         print(f"📊 Retrieved {len(recent_data)} recent readings")
         
+        firebase_db.close()
+        
     else:
         print("❌ Firebase setup failed")
 
@@ -0,0 +1,280 @@
+"""
+Batched Firestore writes for Health Monitor readings
+Write-behind buffer, shared client and an in-process fake for testing
+"""
+
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import metrics
+
+FIRESTORE_BATCH_LIMIT = 500  # Firestore's maximum operations per batch
+
+logger = metrics.get_logger('firestore')
+
+_clients: Dict[str, object] = {}
+_clients_lock = threading.Lock()
+
+def get_firestore_client(config_path: str):
+    """Shared Firestore client for a service account file
+
+    A single client multiplexes requests over its pooled gRPC channel, so
+    every writer in the process should reuse it rather than open its own.
+    """
+    with _clients_lock:
+        client = _clients.get(config_path)
+        if client is None:
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+
+            try:
+                app = firebase_admin.get_app()
+            except ValueError:
+                app = firebase_admin.initialize_app(credentials.Certificate(config_path))
+            client = _clients[config_path] = firestore.client(app)
+        return client
+
+def transient_errors() -> Tuple[type, ...]:
+    """Commit errors worth retrying: timeouts, unavailability and aborted writes
+
+    Anything else (bad credentials, invalid documents, quota) fails the
+    same way on every attempt, so it is not retried.
+    """
+    errors: Tuple[type, ...] = (ConnectionError, TimeoutError)
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return errors
+    return errors + (exceptions.DeadlineExceeded, exceptions.ServiceUnavailable, exceptions.Aborted)
+
+class FirestoreBatchWriter:
+    """Write-behind buffer that groups documents into batched commits
+
+    Documents are buffered and committed in batches of up to 500 writes
+    by a background thread, as soon as a batch is full or every
+    ``flush_interval`` seconds. Transient commit errors are retried with
+    exponential backoff and jitter, rewriting the same document ids so a
+    commit whose response was lost is not duplicated. Documents that
+    still fail are kept in ``failed``, newest ``max_failed`` only.
+    add() only blocks when ``max_buffered`` documents are waiting.
+    Call close() (or use it as a context manager) to flush on shutdown.
+    """
+
+    def __init__(self, client, collection: str = 'health_readings',
+                 max_batch_size: int = FIRESTORE_BATCH_LIMIT, flush_interval: Optional[float] = 1.0,
+                 max_retries: int = 5, backoff_base: float = 0.1, backoff_max: float = 5.0,
+                 retry_on: Optional[Tuple[type, ...]] = None, max_buffered: int = 20 * FIRESTORE_BATCH_LIMIT,
+                 max_failed: int = 10000):
+        if not 0 < max_batch_size <= FIRESTORE_BATCH_LIMIT:
+            raise ValueError(f"max_batch_size must be between 1 and {FIRESTORE_BATCH_LIMIT}")
+        self.client = client
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_on = retry_on or transient_errors()
+        self.max_buffered = max(max_buffered, max_batch_size)
+        self.failed: Deque[Dict] = deque(maxlen=max_failed)
+        self.stats = {'buffered': 0, 'written': 0, 'commits': 0, 'retries': 0, 'failed': 0}
+
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()  # Guards the buffer, stats and failed
+        self._space = threading.Condition(self._lock)
+        self._commit_lock = threading.Lock()  # Keeps commits in buffer order
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        metrics.track_queue(f"firestore_{collection}", lambda: len(self._buffer))
+        self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, data: Dict):
+        """Buffer one document; the background thread commits it"""
+        if self._closed.is_set():
+            raise RuntimeError("FirestoreBatchWriter is closed")
+        with self._lock:
+            while len(self._buffer) >= self.max_buffered and not self._closed.is_set():
+                self._space.wait(0.1)  # Backpressure while Firestore is slow or down
+            self._buffer.append(data)
+            self.stats['buffered'] += 1
+            full = len(self._buffer) >= self.max_batch_size
+        if full:
+            self._wake.set()
+
+    def _flush_full_batches(self):
+        while True:
+            with self._lock:
+                if len(self._buffer) < self.max_batch_size:
+                    return
+            self._commit_next()
+
+    def flush(self):
+        """Commit everything buffered so far"""
+        while self._commit_next():
+            pass
+
+    def _commit_next(self) -> bool:
+        """Commit the oldest batch, returning False when the buffer is empty"""
+        with self._commit_lock:
+            with self._lock:
+                documents = self._buffer[:self.max_batch_size]
+                del self._buffer[:self.max_batch_size]
+                self._space.notify_all()
+            if not documents:
+                return False
+            self._commit_with_retry(documents)
+            return True
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    @metrics.timed('firestore_commit')
+    def _commit_with_retry(self, documents: List[Dict]):
+        # Ids are fixed before the first attempt: a retry after a lost
+        # response overwrites the same documents instead of adding copies
+        collection = self.client.collection(self.collection)
+        references = [collection.document() for _ in documents]
+        for attempt in range(self.max_retries + 1):
+            try:
+                batch = self.client.batch()
+                for reference, data in zip(references, documents):
+                    batch.set(reference, data)
+                batch.commit()
+                with self._lock:
+                    self.stats['commits'] += 1
+                    self.stats['written'] += len(documents)
+                return
+            except self.retry_on as e:
+                if attempt == self.max_retries:
+                    self._give_up(documents, f"after {attempt + 1} attempts: {e}")
+                    return
+                self._count('retries')
+                # Exponential backoff with full jitter
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+            except Exception as e:
+                self._give_up(documents, f"with a permanent error: {e}")
+                return
+
+    def _give_up(self, documents: List[Dict], reason: str):
+        logger.error("❌ Firestore batch failed %s", reason)
+        with self._lock:
+            self.failed.extend(documents)
+            self.stats['failed'] += len(documents)
+
+    def _run_flusher(self):
+        # Commits and backoff sleeps happen here, never in the caller of add()
+        while not self._closed.is_set():
+            woken = self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._closed.is_set():
+                return
+            if woken:
+                self._flush_full_batches()
+            else:
+                self.flush()
+
+    def close(self):
+        """Stop the background flusher and commit what is left"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        metrics.track_queue(f"firestore_{self.collection}", None)
+
+class FakeDocumentReference:
+    """Document handle returned by the fake client"""
+
+    def __init__(self, collection: str, document_id: str):
+        self.collection = collection
+        self.id = document_id
+
+class FakeCollectionReference:
+    """Collection handle returned by the fake client"""
+
+    def __init__(self, client: 'FakeFirestoreClient', name: str):
+        self._client = client
+        self.name = name
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self.name, document_id or self._client.new_id())
+
+    def add(self, data: Dict):
+        ref = self.document()
+        self._client.store(ref, data)
+        return None, ref
+
+class FakeWriteBatch:
+    """Write batch that applies its sets atomically on commit"""
+
+    def __init__(self, client: 'FakeFirestoreClient'):
+        self._client = client
+        self._writes: List[Tuple[FakeDocumentReference, Dict]] = []
+
+    def set(self, reference: FakeDocumentReference, data: Dict):
+        self._writes.append((reference, dict(data)))
+
+    def commit(self):
+        if len(self._writes) > FIRESTORE_BATCH_LIMIT:
+            raise ValueError(f"Batch has {len(self._writes)} writes; the limit is {FIRESTORE_BATCH_LIMIT}")
+        self._client.commit(self._writes)
+
+class FakeFirestoreClient:
+    """In-process stand-in for firestore.Client
+
+    Implements the slice of the API the writer uses and keeps documents
+    in ``collections``. ``fail_commits`` makes that many commits raise
+    ConnectionError first, ``lose_responses`` makes that many apply their
+    writes and then raise TimeoutError, as if the reply never arrived,
+    and ``commit_latency`` adds a per-commit delay, to exercise retries
+    and batching.
+    """
+
+    def __init__(self, fail_commits: int = 0, commit_latency: float = 0.0, lose_responses: int = 0):
+        self.collections: Dict[str, Dict[str, Dict]] = {}
+        self.commits = 0
+        self.fail_commits = fail_commits
+        self.lose_responses = lose_responses
+        self.commit_latency = commit_latency
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def new_id(self) -> str:
+        return f"doc{next(self._ids):012d}"
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, name)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def store(self, reference: FakeDocumentReference, data: Dict):
+        self.commit([(reference, data)])
+
+    def commit(self, writes: List[Tuple[FakeDocumentReference, Dict]]):
+        if self.commit_latency:
+            time.sleep(self.commit_latency)
+        with self._lock:
+            if self.fail_commits > 0:
+                self.fail_commits -= 1
+                raise ConnectionError("simulated Firestore outage")
+            for reference, data in writes:
+                self.collections.setdefault(reference.collection, {})[reference.id] = data
+            self.commits += 1
+            if self.lose_responses > 0:
+                self.lose_responses -= 1
+                raise TimeoutError("simulated lost commit response")
@@ -0,0 +1,280 @@
+"""
+Spatial index of hospitals for Health Monitor emergency alerts
+Grid-bucketed k-nearest and radius lookups with incremental updates
+"""
+
+import argparse
+import json
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from local_storage import iter_partition
+
+EARTH_RADIUS_KM = 6371.0088
+
+def to_unit_vectors(latitudes, longitudes) -> np.ndarray:
+    """Points on the unit sphere (N x 3) for latitude/longitude in degrees"""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lng = np.radians(np.asarray(longitudes, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)], axis=-1)
+
+def chord_to_km(chord):
+    """Great-circle distance for a straight-line distance between unit vectors"""
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.asarray(chord) / 2.0))
+
+def km_to_chord(km: float) -> float:
+    return 2.0 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2.0)
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km (broadcasts over arrays)"""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+def coordinates_of(record: Dict) -> Optional[Tuple[float, float]]:
+    """(latitude, longitude) from a hospital's coordinates or a reading's location"""
+    point = record.get('coordinates', record.get('location'))
+    if point is None:
+        return None
+    if isinstance(point, dict):
+        latitude = point.get('latitude', point.get('lat'))
+        longitude = point.get('longitude', point.get('lng', point.get('lon')))
+    else:
+        latitude, longitude = point[0], point[1]
+    if latitude is None or longitude is None:
+        return None
+    return float(latitude), float(longitude)
+
+class HospitalIndex:
+    """Hospitals bucketed into a uniform grid over unit-sphere coordinates
+
+    Positions are stored as 3-D unit vectors, so straight-line distance
+    orders points exactly like great-circle distance and the grid has no
+    seams at the antimeridian or the poles. A k-nearest query scans
+    growing cubes of cells around the query's cell until the k-th best
+    distance is closer than anything outside the cube can be; queries
+    landing in the same cell share one scan. Adding, moving or removing a
+    hospital only touches its slot and its cell.
+    """
+
+    def __init__(self, cell_km: float = 50.0, capacity: int = 1024):
+        self.cell = km_to_chord(cell_km)
+        self.records: Dict[str, Dict] = {}
+        self.slots: Dict[str, int] = {}  # hospital id -> row in the arrays
+        self.cells: Dict[Tuple[int, int, int], List[int]] = {}
+        self._points = np.zeros((capacity, 3))
+        self._ids: List[Optional[str]] = [None] * capacity
+        self._cell_of: List[Optional[Tuple[int, int, int]]] = [None] * capacity
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, hospital_id: str) -> bool:
+        return hospital_id in self.slots
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], **options) -> 'HospitalIndex':
+        index = cls(**options)
+        index.update(records)
+        return index
+
+    @classmethod
+    def from_file(cls, path: str, **options) -> 'HospitalIndex':
+        """Load hospitals from a JSON array or JSON Lines file"""
+        return cls.from_records(iter_partition(path), **options)
+
+    def _cell_key(self, point: np.ndarray) -> Tuple[int, int, int]:
+        return tuple(int(v) for v in np.floor(point / self.cell))
+
+    def _grow(self):
+        size = len(self._points)
+        self._points = np.concatenate([self._points, np.zeros((size, 3))])
+        self._ids.extend([None] * size)
+        self._cell_of.extend([None] * size)
+        self._free.extend(range(2 * size - 1, size - 1, -1))
+
+    def upsert(self, record: Dict) -> bool:
+        """Add a hospital or apply changes to it; False if it has no usable id/coordinates"""
+        hospital_id = record.get('hospital_id', record.get('id'))
+        coordinates = coordinates_of(record)
+        if hospital_id is None or coordinates is None:
+            return False
+        point = to_unit_vectors(*coordinates)
+        key = self._cell_key(point)
+
+        slot = self.slots.get(hospital_id)
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self.slots[hospital_id] = self._free.pop()
+            self._ids[slot] = hospital_id
+        elif self._cell_of[slot] != key:
+            self._leave_cell(slot)
+        if self._cell_of[slot] != key:
+            self.cells.setdefault(key, []).append(slot)
+            self._cell_of[slot] = key
+        self._points[slot] = point
+        self.records[hospital_id] = record
+        return True
+
+    def update(self, records: Iterable[Dict]) -> int:
+        """Upsert many hospitals, returning how many were indexed"""
+        return sum(1 for record in records if self.upsert(record))
+
+    def remove(self, hospital_id: str) -> bool:
+        slot = self.slots.pop(hospital_id, None)
+        if slot is None:
+            return False
+        self._leave_cell(slot)
+        self._ids[slot] = None
+        self._free.append(slot)
+        del self.records[hospital_id]
+        return True
+
+    def _leave_cell(self, slot: int):
+        key = self._cell_of[slot]
+        members = self.cells[key]
+        members.remove(slot)
+        if not members:
+            del self.cells[key]
+        self._cell_of[slot] = None
+
+    def _slots_near(self, key: Tuple[int, int, int], rings: int) -> np.ndarray:
+        """Slots in the cube of cells within ``rings`` of a cell"""
+        span = range(-rings, rings + 1)
+        if (2 * rings + 1) ** 3 <= len(self.cells):
+            cells = self.cells
+            found = [cells.get((key[0] + i, key[1] + j, key[2] + k)) for i in span for j in span for k in span]
+        else:
+            # Cube is larger than the occupied grid: filter the cells instead
+            found = [slots for other, slots in self.cells.items()
+                     if max(abs(other[0] - key[0]), abs(other[1] - key[1]), abs(other[2] - key[2])) <= rings]
+        slots = [slot for members in found if members for slot in members]
+        return np.asarray(slots, dtype=np.int64)
+
+    def _max_rings(self) -> int:
+        return int(math.ceil(2.0 / self.cell)) + 1  # Enough to span the whole sphere
+
+    def nearest_many(self, latitudes: Sequence[float], longitudes: Sequence[float],
+                     k: int = 3, max_km: Optional[float] = None) -> List[List[Tuple[str, float]]]:
+        """The ``k`` closest hospitals to each point as (hospital_id, km), nearest first"""
+        points = to_unit_vectors(latitudes, longitudes).reshape(-1, 3)
+        results: List[List[Tuple[str, float]]] = [[] for _ in range(len(points))]
+        groups: Dict[Tuple[int, int, int], List[int]] = {}
+        for row, key in enumerate(map(tuple, np.floor(points / self.cell).astype(int).tolist())):
+            groups.setdefault(key, []).append(row)
+        for key, rows in groups.items():
+            for row, matches in zip(rows, self._nearest_in_group(key, points[rows], k, max_km)):
+                results[row] = matches
+        return results
+
+    def nearest(self, latitude: float, longitude: float, k: int = 3,
+                max_km: Optional[float] = None) -> List[Tuple[str, float]]:
+        """The ``k`` closest hospitals to one point as (hospital_id, km)"""
+        lat, lng = math.radians(latitude), math.radians(longitude)
+        point = np.array([[math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat)]])
+        return self._nearest_in_group(self._cell_key(point[0]), point, k, max_km)[0]
+
+    def _nearest_in_group(self, key: Tuple[int, int, int], queries: np.ndarray, k: int,
+                          max_km: Optional[float]) -> List[List[Tuple[str, float]]]:
+        """k-nearest for query points that share the grid cell ``key``"""
+        k = min(k, len(self.slots))
+        if k <= 0:
+            return [[] for _ in queries]
+        limit = km_to_chord(max_km) if max_km is not None else math.inf
+        rings = 1  # The query's own cell alone can never rule out its neighbours
+        while True:
+            slots = self._slots_near(key, rings)
+            reach = rings * self.cell  # Nothing outside the cube is closer than this
+            whole_sphere = rings >= self._max_rings()
+            if len(slots) >= k or min(limit, 2.0) <= reach or whole_sphere:
+                deltas = self._points[slots][None, :, :] - queries[:, None, :]
+                squared = np.einsum('qsd,qsd->qs', deltas, deltas)
+                if len(slots) <= k:
+                    nearest = np.argsort(squared, axis=1)
+                else:
+                    nearest = np.argpartition(squared, k - 1, axis=1)[:, :k]
+                chosen = np.take_along_axis(squared, nearest, axis=1)
+                kth = np.sqrt(chosen.max(axis=1)) if len(slots) >= k else math.inf
+                if (np.minimum(kth, limit) <= reach).all() or whole_sphere:
+                    break
+            rings = rings + 1 if rings < 4 else rings * 2
+
+        order = np.argsort(chosen, axis=1, kind='stable')
+        chords = np.sqrt(np.take_along_axis(chosen, order, axis=1))
+        kilometres = chord_to_km(chords).tolist()
+        picked = slots[np.take_along_axis(nearest, order, axis=1)].tolist()
+        ids = self._ids
+        results = []
+        for row_chords, row_km, row_slots in zip(chords.tolist(), kilometres, picked):
+            matches = []
+            for chord, km, slot in zip(row_chords, row_km, row_slots):
+                if chord > limit:
+                    break
+                matches.append((ids[slot], km))
+            results.append(matches)
+        return results
+
+    def within(self, latitude: float, longitude: float, radius_km: float) -> List[Tuple[str, float]]:
+        """Every hospital within ``radius_km`` as (hospital_id, km), nearest first"""
+        point = to_unit_vectors(latitude, longitude)
+        limit = km_to_chord(radius_km)
+        slots = self._slots_near(self._cell_key(point), int(math.ceil(limit / self.cell)))
+        if not len(slots):
+            return []
+        distances = np.linalg.norm(self._points[slots] - point, axis=1)
+        inside = np.flatnonzero(distances <= limit)
+        inside = inside[np.argsort(distances[inside], kind='stable')]
+        return [(self._ids[slots[i]], float(chord_to_km(distances[i]))) for i in inside.tolist()]
+
+    def describe(self, matches: List[Tuple[str, float]]) -> List[Dict]:
+        """Matches as hospital summaries for attaching to an alert"""
+        described = []
+        for hospital_id, km in matches:
+            record = self.records[hospital_id]
+            described.append({
+                'hospital_id': hospital_id,
+                'name': record.get('name'),
+                'phone': record.get('phone'),
+                'address': record.get('address'),
+                'distance_km': round(km, 2)
+            })
+        return described
+
+    def for_readings(self, readings: Sequence[Dict], k: int = 3,
+                     max_km: Optional[float] = None) -> List[List[Dict]]:
+        """Nearest hospitals for many alert readings at once (empty if no location)"""
+        located = [(i, coordinates_of(reading)) for i, reading in enumerate(readings)]
+        located = [(i, point) for i, point in located if point is not None]
+        results: List[List[Dict]] = [[] for _ in readings]
+        if located:
+            rows, points = zip(*located)
+            latitudes, longitudes = zip(*points)
+            for row, matches in zip(rows, self.nearest_many(latitudes, longitudes, k, max_km)):
+                results[row] = self.describe(matches)
+        return results
+
+def main():
+    """Look up hospitals near a point"""
+    parser = argparse.ArgumentParser(description="Nearest-hospital lookup")
+    parser.add_argument('hospitals', help="JSON array or JSON Lines file of hospital records")
+    parser.add_argument('latitude', type=float)
+    parser.add_argument('longitude', type=float)
+    parser.add_argument('-k', type=int, default=3)
+    parser.add_argument('--radius-km', type=float, default=None, help="list everything within this radius instead")
+    args = parser.parse_args()
+
+    index = HospitalIndex.from_file(args.hospitals)
+    if args.radius_km is not None:
+        matches = index.within(args.latitude, args.longitude, args.radius_km)
+    else:
+        matches = index.nearest(args.latitude, args.longitude, args.k)
+    print(f"🏥 {len(matches)} of {len(index)} hospitals")
+    print(json.dumps(index.describe(matches), indent=2))
+
+if __name__ == "__main__":
+    main()
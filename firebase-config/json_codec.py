@@ -0,0 +1,91 @@
+"""
+JSON codec for Health Monitor data paths
+Compact encoding through orjson when it is installed, stdlib json otherwise
+"""
+
+import json
+import math
+import os
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # Optional: the stdlib fallback below matches its output
+    orjson = None
+
+# HEALTH_JSON=stdlib forces the fallback, e.g. to compare the two. Both
+# write NaN and infinity, which JSON cannot represent, as null (as orjson does)
+BACKEND = 'orjson' if orjson is not None and os.environ.get('HEALTH_JSON', 'orjson') != 'stdlib' else 'stdlib'
+
+def _default(value):
+    """NumPy scalars and arrays as plain Python values"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+if BACKEND == 'orjson':
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    _LINE_OPTIONS = _OPTIONS | orjson.OPT_APPEND_NEWLINE
+
+    def dumps(value: Any) -> bytes:
+        """Compact UTF-8 JSON"""
+        return orjson.dumps(value, default=_default, option=_OPTIONS)
+
+    def encode_line(value: Any) -> bytes:
+        """Compact UTF-8 JSON plus a newline, for JSONL files and sockets"""
+        return orjson.dumps(value, default=_default, option=_LINE_OPTIONS)
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Parse JSON from bytes or str
+
+        Files written by older stdlib fallbacks may hold bare NaN or
+        Infinity, which orjson rejects; those are parsed with json.
+        """
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+else:
+    # ensure_ascii=False matches orjson, so files do not depend on the backend
+    _encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=_default, allow_nan=False)
+
+    def _finite(value):
+        """A copy of ``value`` with NaN and infinity replaced by None"""
+        if isinstance(value, float):
+            return value if math.isfinite(value) else None
+        if isinstance(value, dict):
+            return {key: _finite(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [_finite(item) for item in value]
+        if hasattr(value, 'tolist'):
+            return _finite(value.tolist())
+        return value
+
+    def _encode(value: Any) -> str:
+        try:
+            return _encoder.encode(value)
+        except ValueError:
+            # Only values holding NaN or infinity pay for the copy
+            return _encoder.encode(_finite(value))
+
+    def dumps(value: Any) -> bytes:
+        """Compact UTF-8 JSON"""
+        return _encode(value).encode('utf-8')
+
+    def encode_line(value: Any) -> bytes:
+        """Compact UTF-8 JSON plus a newline, for JSONL files and sockets"""
+        return (_encode(value) + '\n').encode('utf-8')
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Parse JSON from bytes or str"""
+        return json.loads(data)
+
+def dump(value: Any, path: str):
+    """Write ``value`` to ``path`` as compact JSON"""
+    with open(path, 'wb') as f:
+        f.write(dumps(value))
+
+def load(path: str) -> Any:
+    """Read a JSON file written by dump (or any JSON file)"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
@@ -0,0 +1,472 @@
+"""
+Local day-partitioned storage for Health Monitor readings
+Append-only JSON Lines files with batched fsync, plus legacy JSON arrays and compacted cold files
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import json_codec
+
+PARTITION_PREFIX = "health_data_"
+JSONL_SUFFIX = ".jsonl"
+LEGACY_SUFFIX = ".json"
+INDEX_SUFFIX = ".idx"
+COLD_SUFFIX = ".cold"  # Compressed, block-indexed (see compaction)
+READ_BLOCK_SIZE = 1 << 16
+
+_PARTITION_RE = re.compile(re.escape(PARTITION_PREFIX) + r"(\d{8})\.(?:jsonl?|cold)$")
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+_VALUE_END = frozenset(" \t\n\r,]")
+
+def partition_day(when: Optional[datetime] = None) -> str:
+    """Partition key (YYYYMMDD) for a point in time"""
+    return (when or datetime.now()).strftime('%Y%m%d')
+
+def naive_local(when: datetime) -> datetime:
+    """A datetime as naive local time, the zone records and partitions are written in"""
+    return when.astimezone().replace(tzinfo=None) if when.tzinfo is not None else when
+
+def partition_path(data_dir: str, day: str, suffix: str = JSONL_SUFFIX) -> str:
+    """Path of a day partition file"""
+    return os.path.join(data_dir, f"{PARTITION_PREFIX}{day}{suffix}")
+
+def encode_record(record: Dict) -> bytes:
+    """Serialize one record as a compact JSON line"""
+    return json_codec.encode_line(record)
+
+def iter_json_array(path: str, block_size: int = READ_BLOCK_SIZE) -> Iterator:
+    """Yield the elements of a JSON array file one at a time
+
+    The file is read in blocks and each element is decoded as soon as it
+    is complete, so memory stays around one block plus one element no
+    matter how large the array is.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+        expect = '['  # Then a value or ']', then ',' or ']' after each value
+        while True:
+            pos = _WHITESPACE_RE.match(buffer, pos).end()
+            if pos == len(buffer):
+                if eof:
+                    if expect != 'done':
+                        raise ValueError(f"Truncated JSON array: {path}")
+                    return
+                block = f.read(block_size)
+                buffer, pos, eof = buffer[pos:] + block, 0, not block
+                continue
+
+            char = buffer[pos]
+            if expect == '[':
+                if char != '[':
+                    raise ValueError(f"Not a JSON array: {path}")
+                pos += 1
+                expect = 'first'
+            elif expect == 'done':
+                raise ValueError(f"Trailing data after JSON array: {path}")
+            elif char == ']' and expect in ('first', 'separator'):
+                pos += 1
+                expect = 'done'
+            elif expect == 'separator':
+                if char != ',':
+                    raise ValueError(f"Expected ',' at offset {pos} in {path}")
+                pos += 1
+                expect = 'value'
+            else:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    end = None
+                if end is None or (not eof and (end == len(buffer) or buffer[end] not in _VALUE_END)):
+                    # The element (e.g. a number cut at '.') may continue in the next block
+                    block = f.read(block_size)
+                    buffer, pos, eof = buffer[pos:] + block, 0, not block
+                    continue
+                yield value
+                pos = end
+                expect = 'separator'
+
+def iter_partition(path: str) -> Iterator[Dict]:
+    """Yield records from a JSONL partition, a legacy JSON array or a cold file"""
+    if not os.path.exists(path):
+        return
+
+    if path.endswith(COLD_SUFFIX):
+        from compaction import ColdPartition
+        yield from ColdPartition(path)
+        return
+
+    if path.endswith(LEGACY_SUFFIX):
+        yield from iter_json_array(path)
+        return
+
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json_codec.loads(line)
+            except ValueError:
+                # A crash mid-append leaves at most one torn final line
+                continue
+
+def read_partition(path: str) -> List[Dict]:
+    """Load every record of a partition file"""
+    return list(iter_partition(path))
+
+def day_partitions(data_dir: str, day: str, cold: bool = True) -> List[str]:
+    """Existing files for a day, legacy JSON array first
+
+    Raw files win over a cold file: both only exist if compaction was
+    interrupted before it deleted the raw files it had copied.
+    """
+    paths = [partition_path(data_dir, day, LEGACY_SUFFIX), partition_path(data_dir, day, JSONL_SUFFIX)]
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths and cold and os.path.exists(partition_path(data_dir, day, COLD_SUFFIX)):
+        paths = [partition_path(data_dir, day, COLD_SUFFIX)]
+    return paths
+
+def list_partition_days(data_dir: str) -> List[str]:
+    """Days that have at least one partition file, oldest first"""
+    days = set()
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            match = _PARTITION_RE.match(entry.name)
+            if match:
+                days.add(match.group(1))
+    return sorted(days)
+
+class RecentIndex:
+    """Per-user byte offsets of the newest records in each JSONL partition
+
+    For every day and user the index keeps the offsets of the last
+    ``depth`` lines, so recent-N lookups seek straight to them instead of
+    parsing the partition. It is updated as records are appended and
+    persisted to a small ``.idx`` sidecar; on startup the sidecar is loaded
+    and only the part of the partition written after it is scanned.
+
+    Lookups walk back at most ``max_days`` partitions (None for all), and
+    at most ``cached_days`` days of offsets, legacy records and cold
+    footers stay in memory, least recently used dropped first. The day
+    being appended to is never dropped. The index is shared by the writer,
+    readers and the compaction thread, so its methods hold one lock.
+    """
+
+    def __init__(self, data_dir: str, depth: int = 100, max_days: Optional[int] = 31,
+                 cached_days: int = 8):
+        self.data_dir = data_dir
+        self.depth = depth
+        self.max_days = max_days
+        self.cached_days = cached_days
+        self._days: 'OrderedDict[str, Dict[str, Deque[int]]]' = OrderedDict()
+        self._active: Optional[str] = None  # Day records are being appended to
+        self._day_list: List[str] = []
+        self._dir_mtime = None
+        self._legacy: 'OrderedDict[str, Tuple[int, Dict]]' = OrderedDict()  # Day -> (mtime, user -> records)
+        self._cold: 'OrderedDict[str, Tuple[int, object]]' = OrderedDict()  # Day -> (mtime, ColdPartition)
+        self._lock = threading.RLock()
+
+    def _index_path(self, day: str) -> str:
+        return partition_path(self.data_dir, day, INDEX_SUFFIX)
+
+    def _remember(self, cache: OrderedDict, day: str, value):
+        """Cache a day's entry, dropping the least recently used beyond cached_days"""
+        cache[day] = value
+        cache.move_to_end(day)
+        for old in list(cache):
+            if len(cache) <= self.cached_days:
+                break
+            if old not in (day, self._active):
+                del cache[old]
+
+    def day_index(self, day: str) -> Dict[str, Deque[int]]:
+        """Offsets for one day's JSONL partition, loading them on first use"""
+        with self._lock:
+            users = self._days.get(day)
+            if users is None:
+                users = self._load_day(day)
+                self._remember(self._days, day, users)
+            else:
+                self._days.move_to_end(day)
+            return users
+
+    def _load_day(self, day: str) -> Dict[str, Deque[int]]:
+        """Restore a day's offsets from its sidecar and catch up on the tail"""
+        path = partition_path(self.data_dir, day, JSONL_SUFFIX)
+        users: Dict[str, Deque[int]] = {}
+        if not os.path.exists(path):
+            return users
+
+        covered = 0
+        try:
+            with open(self._index_path(day), 'r') as f:
+                sidecar = json.load(f)
+            if sidecar['size'] <= os.path.getsize(path):
+                covered = sidecar['size']
+                for user_id, offsets in sidecar['users'].items():
+                    users[user_id] = deque(offsets, maxlen=self.depth)
+        except (OSError, ValueError, KeyError):
+            users = {}  # Missing or stale sidecar: rebuild from the partition
+
+        with open(path, 'rb') as f:
+            f.seek(covered)
+            offset = covered
+            for line in f:
+                if line.endswith(b'\n'):
+                    try:
+                        user_id = json_codec.loads(line).get('user_id')
+                    except ValueError:
+                        user_id = None
+                    if user_id is not None:
+                        users.setdefault(user_id, deque(maxlen=self.depth)).append(offset)
+                offset += len(line)
+
+        if offset > covered and day != self._active:
+            # Persist the scan so a finished day is only ever scanned once
+            try:
+                self._write_sidecar(day, users)
+            except OSError:
+                pass
+        return users
+
+    def record(self, day: str, user_id: str, offset: int):
+        """Note that a user's record was appended at offset"""
+        with self._lock:
+            self._active = day
+            users = self.day_index(day)
+            users.setdefault(user_id, deque(maxlen=self.depth)).append(offset)
+
+    def save(self, day: str):
+        """Write a day's offsets to its sidecar file"""
+        with self._lock:
+            users = self._days.get(day)
+            if users is not None:
+                self._write_sidecar(day, users)
+            if day == self._active:
+                self._active = None  # Its writer is closed, so it may be dropped now
+
+    def _write_sidecar(self, day: str, users: Dict[str, Deque[int]]):
+        path = partition_path(self.data_dir, day, JSONL_SUFFIX)
+        if not os.path.exists(path):
+            return
+        # Offsets of lines still sitting in a writer's buffer are left out;
+        # the next load picks those lines up again by scanning past `size`
+        size = os.path.getsize(path)
+        sidecar = {
+            'size': size,
+            'users': {user_id: [o for o in offsets if o < size] for user_id, offsets in users.items()}
+        }
+        tmp_path = self._index_path(day) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(sidecar, f, separators=(',', ':'))
+        os.replace(tmp_path, self._index_path(day))
+
+    def days(self) -> List[str]:
+        """Partition days on disk, re-listed only when the directory changes"""
+        mtime = os.stat(self.data_dir).st_mtime_ns
+        if mtime != self._dir_mtime:
+            self._day_list = list_partition_days(self.data_dir)
+            self._dir_mtime = mtime
+        return self._day_list
+
+    def recent(self, user_id: str, limit: int = 10) -> List[Dict]:
+        """Newest ``limit`` records for a user across the last ``max_days`` partitions"""
+        with self._lock:
+            return self._recent(user_id, limit)
+
+    def _recent(self, user_id: str, limit: int) -> List[Dict]:
+        collected: List[List[Dict]] = []
+        remaining = limit
+        days = self.days()
+        if self.max_days is not None:
+            days = days[-self.max_days:] if self.max_days > 0 else []
+        for day in reversed(days):
+            if remaining <= 0:
+                break
+            records = self._recent_in_day(day, user_id, remaining)
+            if records:
+                collected.append(records)
+                remaining -= len(records)
+
+        result = [record for records in reversed(collected) for record in records]
+        return result[-limit:] if limit > 0 else []
+
+    def _recent_in_day(self, day: str, user_id: str, limit: int) -> List[Dict]:
+        """Newest records for a user within one day, oldest first"""
+        try:
+            records = self._recent_in_raw(day, user_id, limit)
+        except FileNotFoundError:
+            records = None  # Compacted (or expired) between the checks and the reads
+
+        # A compacted day has only its cold file, grouped by user and block-indexed
+        if records is None:
+            if os.path.exists(partition_path(self.data_dir, day, COLD_SUFFIX)):
+                return self.cold_partition(day).recent(user_id, limit)
+            return []
+        return records[-limit:]
+
+    def _recent_in_raw(self, day: str, user_id: str, limit: int) -> Optional[List[Dict]]:
+        """Newest records in a day's JSONL and legacy files, or None if it has neither"""
+        records: List[Dict] = []
+        jsonl_path = partition_path(self.data_dir, day, JSONL_SUFFIX)
+        if os.path.exists(jsonl_path):
+            offsets = self.day_index(day).get(user_id, ())
+            if len(offsets) < limit and len(offsets) == self.depth:
+                # Older lines fell out of the index: scan this partition
+                records = [r for r in iter_partition(jsonl_path) if r.get('user_id') == user_id]
+            else:
+                with open(jsonl_path, 'rb') as f:
+                    for offset in list(offsets)[-limit:]:
+                        f.seek(offset)
+                        records.append(json_codec.loads(f.readline()))
+
+        # Legacy JSON arrays cannot be seeked, and hold the day's older records
+        legacy_path = partition_path(self.data_dir, day, LEGACY_SUFFIX)
+        if len(records) < limit and os.path.exists(legacy_path):
+            legacy = self._legacy_records(day, user_id, limit - len(records))
+            records = legacy + records
+
+        if not records and not os.path.exists(jsonl_path) and not os.path.exists(legacy_path):
+            return None
+        return records
+
+    def _legacy_records(self, day: str, user_id: str, limit: int) -> List[Dict]:
+        """A user's newest records in a legacy JSON array, parsed once per file version"""
+        path = partition_path(self.data_dir, day, LEGACY_SUFFIX)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._legacy.get(day)
+        if cached is None or cached[0] != mtime:
+            users: Dict[str, Deque[Dict]] = {}
+            for record in iter_partition(path):
+                if isinstance(record, dict) and record.get('user_id') is not None:
+                    users.setdefault(record['user_id'], deque(maxlen=self.depth)).append(record)
+            cached = (mtime, users)
+            self._remember(self._legacy, day, cached)
+        else:
+            self._legacy.move_to_end(day)
+        records = cached[1].get(user_id, ())
+        if len(records) < limit and len(records) == self.depth:
+            # Older records were not kept: scan the file for this one lookup
+            return [r for r in iter_partition(path) if r.get('user_id') == user_id]
+        return list(records)
+
+    def cold_partition(self, day: str):
+        """The day's compacted partition, opened once and reused while unchanged"""
+        from compaction import ColdPartition
+
+        path = partition_path(self.data_dir, day, COLD_SUFFIX)
+        with self._lock:
+            mtime = os.stat(path).st_mtime_ns
+            cached = self._cold.get(day)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, ColdPartition(path))
+                self._remember(self._cold, day, cached)
+            else:
+                self._cold.move_to_end(day)
+            return cached[1]
+
+    def forget(self, day: str):
+        """Drop cached offsets, legacy records and cold footers of a day that was compacted or expired"""
+        with self._lock:
+            self._days.pop(day, None)
+            self._legacy.pop(day, None)
+            self._cold.pop(day, None)
+            if day == self._active:
+                self._active = None
+
+class JsonlDayWriter:
+    """Append-only writer for one day partition
+
+    Records are written through a userspace buffer and made durable in
+    batches: the file is flushed and fsync'd after every ``fsync_every``
+    records or once ``fsync_interval_ms`` has passed since the last sync,
+    whichever comes first. The interval is also enforced by a timer, so
+    the tail of an idle writer still reaches the disk. Set
+    ``fsync_every=1`` for per-record durability or both to 0 to leave
+    syncing to the OS.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 100, fsync_interval_ms: int = 1000):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval_ms = fsync_interval_ms
+        self._file = open(path, 'ab')
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            # Terminate a line torn by a crash so new records stay parseable
+            self._file.write(b'\n')
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()  # The timer syncs from its own thread
+        self._timer: Optional[threading.Timer] = None
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def append(self, record: Dict) -> int:
+        """Append a record, returning the byte offset of its line"""
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(encode_record(record))
+            self._pending += 1
+
+            due_by_count = self.fsync_every and self._pending >= self.fsync_every
+            due_by_time = self.fsync_interval_ms and (time.monotonic() - self._last_sync) * 1000 >= self.fsync_interval_ms
+            if due_by_count or due_by_time:
+                self._sync()
+            elif self.fsync_interval_ms and self._timer is None:
+                self._start_timer()
+        return offset
+
+    def _start_timer(self):
+        remaining = self.fsync_interval_ms / 1000 - (time.monotonic() - self._last_sync)
+        self._timer = threading.Timer(max(remaining, 0), self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._pending and not self._file.closed:
+                self._sync()
+
+    def flush(self):
+        """Push buffered records to the OS, syncing them if the interval has passed"""
+        with self._lock:
+            if self.fsync_interval_ms and self._pending and \
+                    (time.monotonic() - self._last_sync) * 1000 >= self.fsync_interval_ms:
+                self._sync()
+            else:
+                self._file.flush()
+
+    def sync(self):
+        """Flush and fsync everything appended so far"""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def close(self):
+        """Sync outstanding records and close the file"""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
@@ -0,0 +1,452 @@
+"""
+Metrics and logging for Health Monitor
+Stage counters and latency histograms, queue gauges, a sampling profiler and exporters
+"""
+
+import bisect
+import collections
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Latency buckets in seconds: 1-2.5-5 steps from 1 microsecond to 10 seconds
+LATENCY_BUCKETS = tuple(
+    round(base * 10.0 ** exponent, 9)
+    for exponent in range(-6, 1)
+    for base in (1.0, 2.5, 5.0)
+) + (10.0,)
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, labels)), value)
+                    for labels, value in sorted(self.values.items())]
+
+class Gauge:
+    """Current value per label combination, set directly or read from a callback"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self.values[labels] = value
+
+    def set_function(self, function: Optional[Callable[[], float]], *labels: str):
+        """Read the value from ``function`` at export time (None removes it)"""
+        with self._lock:
+            if function is None:
+                self.functions.pop(labels, None)
+            else:
+                self.functions[labels] = function
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for labels, function in functions.items():
+            try:
+                values[labels] = function()
+            except Exception:
+                continue  # A gauge whose owner went away simply disappears
+        return [(self.name, dict(zip(self.labelnames, labels)), value)
+                for labels, value in sorted(values.items())]
+
+class HistogramSeries:
+    """Bucket counts, sum and count for one label combination"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def read(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+class Histogram:
+    """Bucketed distribution per label combination (Prometheus-style)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labels: str) -> HistogramSeries:
+        """The series for a label combination; hot paths keep hold of it"""
+        series = self.series.get(labels)
+        if series is None:
+            with self._lock:
+                series = self.series.setdefault(labels, HistogramSeries(self.buckets))
+        return series
+
+    def observe(self, value: float, *labels: str):
+        self.labels(*labels).observe(value)
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Estimate a quantile by interpolating inside its bucket"""
+        series = self.series.get(labels)
+        if series is None:
+            return None
+        counts, _, total = series.read()
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            series_items = sorted(self.series.items())
+        samples = []
+        for labels, series in series_items:
+            counts, total_sum, total = series.read()
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**base, 'le': _format_bound(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", base, total_sum))
+            samples.append((f"{self.name}_count", base, total))
+        return samples
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+class MetricsRegistry:
+    """Named metrics plus an optional profiler, exported as text or JSON
+
+    ``enabled`` switches the stage timers off entirely, leaving a single
+    attribute check per instrumented call.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.metrics: Dict[str, object] = {}
+        self.profiler: Optional['SamplingProfiler'] = None
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} already registered differently")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    rendered = ','.join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{rendered}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict:
+        """JSON-friendly view: counters and gauges by label, histograms as count/mean/p50/p99"""
+        result = {'timestamp': time.time(), 'counters': {}, 'gauges': {}, 'histograms': {}}
+        for metric in list(self.metrics.values()):
+            if isinstance(metric, Histogram):
+                entries = {}
+                for labels, series in list(metric.series.items()):
+                    _, total_sum, count = series.read()
+                    entries[_label_key(metric.labelnames, labels)] = {
+                        'count': count,
+                        'mean': total_sum / count if count else None,
+                        'p50': metric.quantile(0.5, *labels),
+                        'p99': metric.quantile(0.99, *labels)
+                    }
+                result['histograms'][metric.name] = entries
+            else:
+                section = 'counters' if isinstance(metric, Counter) else 'gauges'
+                result[section][metric.name] = {
+                    _label_key(metric.labelnames, tuple(labels.values())): value
+                    for _, labels, value in metric.samples()
+                }
+        if self.profiler is not None:
+            result['profile'] = self.profiler.top(20)
+        return result
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_key(labelnames: Tuple[str, ...], labels: Tuple[str, ...]) -> str:
+    return ','.join(f"{name}={value}" for name, value in zip(labelnames, labels)) or 'total'
+
+REGISTRY = MetricsRegistry(enabled=os.environ.get('HEALTH_METRICS', '1') != '0')
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'health_stage_seconds', "Time spent per call of each pipeline stage", ('stage',))
+STAGE_ITEMS = REGISTRY.counter(
+    'health_stage_items_total', "Readings or records handled by each batch stage", ('stage',))
+STAGE_ERRORS = REGISTRY.counter(
+    'health_stage_errors_total', "Calls of each stage that failed", ('stage',))
+ANOMALIES = REGISTRY.counter(
+    'health_anomalies_total', "Detected anomalies by type and severity", ('type', 'severity'))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'health_queue_depth', "Items waiting in each queue or buffer", ('queue',))
+
+def timed(stage: str, items: Optional[Callable] = None):
+    """Decorator recording a call's duration under ``stage``
+
+    For batch calls, ``items(result)`` returns how many items the call
+    handled; per-item stages are counted by the histogram itself. The
+    series is bound once, so a timed call costs two clock reads and one
+    bucket increment.
+    """
+    series = STAGE_SECONDS.labels(stage)
+    clock = time.perf_counter
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return function(*args, **kwargs)
+            started = clock()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                STAGE_ERRORS.inc(stage)
+                raise
+            finally:
+                series.observe(clock() - started)
+            if items is not None:
+                STAGE_ITEMS.inc(stage, amount=items(result))
+            return result
+        return wrapper
+    return decorate
+
+def record_anomalies(anomalies: List[Dict]):
+    """Count anomalies by type and severity"""
+    if REGISTRY.enabled:
+        for anomaly in anomalies:
+            ANOMALIES.inc(anomaly['type'], anomaly['severity'])
+
+def track_queue(name: str, depth: Optional[Callable[[], float]]):
+    """Report a queue's depth at export time (None stops tracking)"""
+    QUEUE_DEPTH.set_function(depth, name)
+
+class SamplingProfiler:
+    """Opt-in statistical profiler sampling every thread's current frame
+
+    A background thread looks at sys._current_frames() every ``interval``
+    seconds and counts the innermost ``depth`` frames of each stack, which
+    is cheap enough to leave running in production for a while.
+    """
+
+    def __init__(self, interval: float = 0.01, depth: int = 3):
+        self.interval = interval
+        self.depth = depth
+        self.samples: collections.Counter = collections.Counter()
+        self.total = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'SamplingProfiler':
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='sampling-profiler')
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}")
+                    frame = frame.f_back
+                with self._lock:
+                    self.samples[' <- '.join(stack)] += 1
+                    self.total += 1
+
+    def top(self, limit: int = 20) -> List[Dict]:
+        """Most sampled stacks with their share of all samples"""
+        with self._lock:
+            common, total = self.samples.most_common(limit), self.total
+        return [{'stack': stack, 'samples': count, 'share': round(count / total, 4)}
+                for stack, count in common]
+
+def start_profiler(interval: float = 0.01, depth: int = 3) -> SamplingProfiler:
+    """Start the sampling profiler and include its hot spots in snapshots"""
+    if REGISTRY.profiler is None:
+        REGISTRY.profiler = SamplingProfiler(interval, depth)
+    return REGISTRY.profiler.start()
+
+class _MetricsHandler:
+    """Request handling mixed into http.server's handler in serve_metrics"""
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body = json.dumps(self.registry.snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        elif self.path.startswith('/metrics'):
+            body = self.registry.to_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line each
+
+def serve_metrics(port: int = 9100, host: str = '127.0.0.1',
+                  registry: MetricsRegistry = REGISTRY) -> 'ThreadingHTTPServer':
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+    # Imported here: http.server pulls in ssl and email, which batch workers never need
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = type('MetricsHandler', (_MetricsHandler, BaseHTTPRequestHandler), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics-server').start()
+    return server
+
+class JsonSnapshotWriter:
+    """Rewrites a JSON snapshot of the registry every ``interval`` seconds"""
+
+    def __init__(self, path: str, interval: float = 10.0, registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='metrics-snapshot')
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.registry.snapshot(), f, indent=2)
+        os.replace(temporary, self.path)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per log line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the health_monitor namespace"""
+    return logging.getLogger(f"health_monitor.{name}")
+
+def configure_logging(level: Optional[str] = None, structured: Optional[bool] = None):
+    """Set the level and format of health_monitor logs
+
+    Defaults come from HEALTH_LOG_LEVEL (INFO) and HEALTH_LOG_FORMAT
+    ('text' or 'json'). Text output is just the message, as before.
+    """
+    level = (level or os.environ.get('HEALTH_LOG_LEVEL', 'INFO')).upper()
+    if structured is None:
+        structured = os.environ.get('HEALTH_LOG_FORMAT', 'text') == 'json'
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if structured else logging.Formatter('%(message)s'))
+    root = logging.getLogger('health_monitor')
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
@@ -0,0 +1,279 @@
+"""
+Streaming range queries for Health Monitor storage
+Lazy scans over day partitions with user and time filters pushed down, in bounded memory
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import numpy as np
+
+import json_codec
+from columnar_store import COLUMNAR_SUFFIX, META_FILE, ColumnarPartition
+from local_storage import (COLD_SUFFIX, LEGACY_SUFFIX, day_partitions, encode_record,
+                           iter_json_array, naive_local, partition_day, partition_path)
+
+# Field extractors for JSONL lines, so filtered-out lines are never fully parsed
+_USER_ID_RE = re.compile(rb'"user_id"\s*:\s*("(?:[^"\\]|\\.)*")')
+_TIMESTAMP_RE = re.compile(rb'"timestamp"\s*:\s*"([^"\\]*)"')
+
+STRING_FIELDS = ('timestamp', 'user_id', 'activity_level')
+NUMERIC_FIELDS = ('heart_rate', 'spo2', 'temperature', 'fall_detected', 'battery_level')
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    try:
+        return naive_local(datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        return None
+
+def day_sources(data_dir: str, day: str) -> List[str]:
+    """Partitions to read for a day
+
+    A columnar copy is preferred over the JSON (or compacted cold) files
+    it was converted from, unless one of them has been written to since
+    the conversion.
+    """
+    rows = day_partitions(data_dir, day)
+    columnar = partition_path(data_dir, day, COLUMNAR_SUFFIX)
+    meta = os.path.join(columnar, META_FILE)
+    if os.path.exists(meta):
+        converted_at = os.path.getmtime(meta)
+        if all(os.path.getmtime(path) <= converted_at for path in rows):
+            return [columnar]
+    return rows
+
+def records_to_batch(records: List[Dict]) -> Dict[str, np.ndarray]:
+    """Reading dicts as a FleetSimulator-style columnar batch
+
+    A missing numeric value (absent key or None) becomes NaN in a float
+    column, which the detector reads like a missing key in a reading dict,
+    and a missing fall_detected reads as False, so every numeric column
+    keeps a numeric dtype (object arrays with None cannot be searched).
+    """
+    batch = {
+        name: np.asarray([record.get(name) for record in records], dtype=object)
+        for name in STRING_FIELDS
+    }
+    for name in NUMERIC_FIELDS:
+        values = [record.get(name) for record in records]
+        if name == 'fall_detected':
+            batch[name] = np.asarray([bool(value) for value in values], dtype=bool)
+        elif any(value is None for value in values):
+            batch[name] = np.asarray([np.nan if value is None else value for value in values], dtype=float)
+        else:
+            batch[name] = np.asarray(values)
+    for name in ('latitude', 'longitude'):
+        batch[name] = np.asarray([(record.get('location') or {}).get(name, np.nan) for record in records], dtype=float)
+    return batch
+
+class RangeQuery:
+    """Readings between ``start`` and ``end`` (inclusive), optionally for a set of users
+
+    Iterating streams records day by day: JSONL lines are checked for
+    user and timestamp with a regex before being parsed, legacy JSON
+    arrays are decoded element by element, cold partitions decompress
+    only the blocks holding the requested users, and columnar partitions
+    are filtered with vectorized masks ``chunk_size`` rows at a time.
+    Memory depends on the chunk size, not on the length of the range.
+
+    Readings land in the partition of the day they were saved, which can
+    be later than their timestamp, so ``late_days`` partitions after
+    ``end`` are scanned as well. ``stats`` counts what was read.
+    """
+
+    def __init__(self, data_dir: str, start: datetime, end: datetime,
+                 user_ids: Optional[Iterable[str]] = None, late_days: int = 1, chunk_size: int = 65536):
+        self.data_dir = data_dir
+        self.start = naive_local(start)
+        self.end = naive_local(end)
+        self.user_ids: Optional[Set[str]] = set(user_ids) if user_ids is not None else None
+        self.late_days = late_days
+        self.chunk_size = chunk_size
+        self._encoded_ids = None
+        if self.user_ids is not None:
+            # Older lines escape non-ASCII ids, newer ones are plain UTF-8
+            self._encoded_ids = {json.dumps(user_id).encode('utf-8') for user_id in self.user_ids}
+            self._encoded_ids.update(json_codec.dumps(user_id) for user_id in self.user_ids)
+        self.stats = {'partitions': 0, 'scanned': 0, 'parsed': 0, 'matched': 0}
+
+    def days(self) -> List[str]:
+        """Partition keys covering the range, plus the late days"""
+        days = []
+        day = self.start.replace(hour=0, minute=0, second=0, microsecond=0)
+        last = self.end + timedelta(days=self.late_days)
+        while day <= last:
+            days.append(partition_day(day))
+            day += timedelta(days=1)
+        return days
+
+    def sources(self) -> Iterator[str]:
+        for day in self.days():
+            yield from day_sources(self.data_dir, day)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for path in self.sources():
+            self.stats['partitions'] += 1
+            if path.endswith(COLUMNAR_SUFFIX):
+                records = self._scan_columnar(path)
+            elif path.endswith(COLD_SUFFIX):
+                records = self._scan_cold(path)
+            elif path.endswith(LEGACY_SUFFIX):
+                records = self._scan_json_array(path)
+            else:
+                records = self._scan_jsonl(path)
+            for record in records:
+                self.stats['matched'] += 1
+                yield record
+
+    def matches(self, record: Dict) -> bool:
+        """Exact user and time filter on a parsed record"""
+        if self.user_ids is not None and record.get('user_id') not in self.user_ids:
+            return False
+        when = _parse_timestamp(record.get('timestamp'))
+        return when is not None and self.start <= when <= self.end
+
+    def _scan_jsonl(self, path: str) -> Iterator[Dict]:
+        stats = self.stats
+        with open(path, 'rb') as f:
+            for line in f:
+                stats['scanned'] += 1
+                if self._encoded_ids is not None:
+                    found = _USER_ID_RE.search(line)
+                    if found is not None and found.group(1) not in self._encoded_ids:
+                        continue
+                found = _TIMESTAMP_RE.search(line)
+                if found is not None:
+                    when = _parse_timestamp(found.group(1).decode('ascii', 'replace'))
+                    if when is None or not self.start <= when <= self.end:
+                        continue
+                stats['parsed'] += 1
+                try:
+                    record = json_codec.loads(line)
+                except ValueError:
+                    continue  # Blank or torn final line
+                if self.matches(record):
+                    yield record
+
+    def _scan_json_array(self, path: str) -> Iterator[Dict]:
+        for record in iter_json_array(path):
+            self.stats['scanned'] += 1
+            self.stats['parsed'] += 1
+            if isinstance(record, dict) and self.matches(record):
+                yield record
+
+    def _scan_cold(self, path: str) -> Iterator[Dict]:
+        from compaction import ColdPartition
+
+        # Only the requested users' runs, in blocks overlapping the range, are decompressed
+        for record in ColdPartition(path).records(self.user_ids, self.start, self.end):
+            self.stats['scanned'] += 1
+            self.stats['parsed'] += 1
+            if self.matches(record):
+                yield record
+
+    def _scan_columnar(self, path: str) -> Iterator[Dict]:
+        partition = ColumnarPartition(path)
+        for start in range(0, len(partition), self.chunk_size):
+            rows = partition.select(start, start + self.chunk_size, self.user_ids, self.start, self.end)
+            self.stats['scanned'] += min(self.chunk_size, len(partition) - start)
+            self.stats['parsed'] += len(rows)
+            yield from partition.iter_records(rows)
+
+    def chunks(self, size: int = 10000) -> Iterator[Dict[str, np.ndarray]]:
+        """The matching readings as columnar batches of up to ``size`` rows"""
+        records = []
+        for record in self:
+            records.append(record)
+            if len(records) >= size:
+                yield records_to_batch(records)
+                records = []
+        if records:
+            yield records_to_batch(records)
+
+def query_range(data_dir: str, start: datetime, end: datetime,
+                user_ids: Optional[Iterable[str]] = None, **options) -> RangeQuery:
+    """Lazy query over the day partitions in ``data_dir``"""
+    return RangeQuery(data_dir, start, end, user_ids, **options)
+
+class UserSummary:
+    """Running per-user counts and min/max/mean, for reports over long ranges"""
+
+    METRICS = ('heart_rate', 'spo2', 'temperature')
+
+    def __init__(self):
+        self.users: Dict[str, Dict] = {}
+
+    def add(self, record: Dict):
+        user = self.users.get(record.get('user_id'))
+        if user is None:
+            user = self.users[record.get('user_id')] = {
+                'readings': 0, 'falls': 0, 'first': record.get('timestamp'), 'last': record.get('timestamp'),
+                'metrics': {}
+            }
+        user['readings'] += 1
+        user['falls'] += 1 if record.get('fall_detected') else 0
+        timestamp = record.get('timestamp')
+        if timestamp is not None:
+            if user['first'] is None or timestamp < user['first']:
+                user['first'] = timestamp
+            if user['last'] is None or timestamp > user['last']:
+                user['last'] = timestamp
+        for metric in self.METRICS:
+            value = record.get(metric)
+            if value is None:
+                continue
+            stats = user['metrics'].get(metric)
+            if stats is None:
+                user['metrics'][metric] = [1, value, value, value]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                stats[2] = min(stats[2], value)
+                stats[3] = max(stats[3], value)
+
+    def to_dict(self) -> Dict:
+        report = {}
+        for user_id, user in sorted(self.users.items(), key=lambda item: str(item[0])):
+            entry = {key: user[key] for key in ('readings', 'falls', 'first', 'last')}
+            for metric, (count, total, low, high) in user['metrics'].items():
+                entry[metric] = {'min': low, 'max': high, 'mean': round(total / count, 2), 'count': count}
+            report[user_id] = entry
+        return report
+
+def main():
+    """Stream matching readings as JSONL, or print a per-user summary"""
+    parser = argparse.ArgumentParser(description="Query stored health readings over a time range")
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--start', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--end', type=datetime.fromisoformat, default=None)
+    parser.add_argument('--users', nargs='+', default=None, help="only these user ids")
+    parser.add_argument('--late-days', type=int, default=1)
+    parser.add_argument('--summary', action='store_true', help="print per-user aggregates instead of records")
+    parser.add_argument('--output', help="write records here instead of stdout")
+    args = parser.parse_args()
+
+    query = query_range(args.data_dir, args.start, args.end or datetime.now(), args.users,
+                        late_days=args.late_days)
+    if args.summary:
+        summary = UserSummary()
+        for record in query:
+            summary.add(record)
+        print(json.dumps(summary.to_dict(), indent=2))
+    else:
+        out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for record in query:
+                out.write(encode_record(record))
+        finally:
+            if args.output:
+                out.close()
+    print(f"🔎 {query.stats['matched']:,} of {query.stats['scanned']:,} readings matched "
+          f"across {query.stats['partitions']} partition(s)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+Rollup store for Health Monitor history
+Per-user min/max/mean/count at 1-minute, 1-hour and 1-day resolution, kept up to date on save
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import json_codec
+from local_storage import (day_partitions, encode_record, iter_partition, list_partition_days,
+                           naive_local)
+
+# Resolution name -> (bucket seconds, file partition key format)
+RESOLUTIONS = {
+    '1m': (60, '%Y%m%d'),
+    '1h': (3600, '%Y%m'),
+    '1d': (86400, '%Y')
+}
+ROLLUP_METRICS = ('heart_rate', 'spo2', 'temperature')
+ROLLUP_PREFIX = "rollup_"
+STATE_FILE = ROLLUP_PREFIX + "state.json"  # Open buckets and unwritten aggregates of a durable store
+
+_USER_ID_RE = re.compile(rb'"user_id"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+_EPOCH = datetime(1970, 1, 1)  # Readings carry naive local timestamps
+
+def bucket_start(when: datetime, seconds: int) -> int:
+    """Start of the bucket containing ``when``, as seconds since the naive epoch"""
+    elapsed = int((when - _EPOCH).total_seconds())
+    return elapsed - elapsed % seconds
+
+def _to_datetime(start: int) -> datetime:
+    return _EPOCH + timedelta(seconds=start)
+
+def rollup_path(data_dir: str, resolution: str, start: int) -> str:
+    """File holding a resolution's rollups for the partition containing ``start``"""
+    key = _to_datetime(start).strftime(RESOLUTIONS[resolution][1])
+    return os.path.join(data_dir, f"{ROLLUP_PREFIX}{resolution}_{key}.jsonl")
+
+class Aggregate:
+    """count/sum/min/max for each rolled-up metric over one bucket"""
+
+    __slots__ = ('user_id', 'start', 'stats')
+
+    def __init__(self, user_id: str, start: int, stats: Optional[Dict[str, List[float]]] = None):
+        self.user_id = user_id
+        self.start = start
+        self.stats = stats if stats is not None else {}  # metric -> [count, sum, min, max]
+
+    def add(self, reading: Dict):
+        for metric in ROLLUP_METRICS:
+            value = reading.get(metric)
+            if value is None:
+                continue
+            stats = self.stats.get(metric)
+            if stats is None:
+                self.stats[metric] = [1, value, value, value]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                if value < stats[2]:
+                    stats[2] = value
+                if value > stats[3]:
+                    stats[3] = value
+
+    def merge(self, other: 'Aggregate'):
+        """Fold in another partial aggregate of the same bucket"""
+        for metric, (count, total, low, high) in other.stats.items():
+            stats = self.stats.get(metric)
+            if stats is None:
+                self.stats[metric] = [count, total, low, high]
+            else:
+                stats[0] += count
+                stats[1] += total
+                stats[2] = min(stats[2], low)
+                stats[3] = max(stats[3], high)
+
+    def to_record(self) -> Dict:
+        return {'user_id': self.user_id, 'start': self.start, 'stats': self.stats}
+
+    @classmethod
+    def from_record(cls, record: Dict) -> 'Aggregate':
+        return cls(record['user_id'], record['start'], {m: list(s) for m, s in record['stats'].items()})
+
+    def to_point(self) -> Dict:
+        """Chart-friendly view: start time, then min/max/mean/count per metric"""
+        point = {'timestamp': _to_datetime(self.start).isoformat()}
+        for metric, (count, total, low, high) in self.stats.items():
+            point[metric] = {'min': low, 'max': high, 'mean': round(total / count, 2), 'count': count}
+        return point
+
+class RollupStore:
+    """Incrementally maintained rollups, persisted as JSONL per resolution
+
+    Each user has one open bucket per resolution in memory. When a
+    reading lands in a later bucket, the open one is closed and queued
+    for writing; late readings for an older bucket are written as a
+    separate partial aggregate, and queries merge partials of the same
+    bucket. Buckets of users who stop reporting are closed once
+    ``idle_close_every`` readings later their end has passed.
+
+    Queries read only the requesting user's lines, through a per-user
+    offset index of each rollup file that is built on first use and
+    caught up from the file's tail afterwards (``cached_files`` files
+    are indexed at a time).
+
+    A ``durable`` store also saves its open buckets and queued aggregates
+    to ``STATE_FILE`` whenever it writes, at least every
+    ``persist_interval`` seconds, and recovers them on startup, so a
+    crash loses at most that much. Only one durable store may use a
+    directory.
+    """
+
+    def __init__(self, data_dir: str = ".", write_batch: int = 1000, idle_close_every: int = 4096,
+                 durable: bool = False, persist_interval: float = 5.0, cached_files: int = 32):
+        self.data_dir = data_dir
+        self.write_batch = write_batch
+        self.idle_close_every = idle_close_every
+        self.durable = durable
+        self.persist_interval = persist_interval
+        self.cached_files = cached_files
+        self.open: Dict[str, Dict[str, Aggregate]] = {name: {} for name in RESOLUTIONS}
+        self._pending: Dict[str, List[bytes]] = {}  # path -> encoded closed aggregates
+        self._pending_count = 0
+        self._added = 0
+        self._flush_seq = 0  # Tags the lines of each durable write, for recovery
+        self._persisted_at = time.monotonic()
+        self._offsets: 'OrderedDict[str, Tuple[int, int, Dict[str, array]]]' = OrderedDict()  # path -> (inode, size, offsets)
+        if durable:
+            self._recover()
+
+    def add(self, reading: Dict):
+        """Fold one reading into every resolution"""
+        user_id = reading.get('user_id')
+        try:
+            when = naive_local(datetime.fromisoformat(reading['timestamp']))
+        except (KeyError, TypeError, ValueError):
+            return  # Cannot place a reading without a valid timestamp
+        elapsed = int((when - _EPOCH).total_seconds())
+
+        for name, (seconds, _) in RESOLUTIONS.items():
+            start = elapsed - elapsed % seconds
+            buckets = self.open[name]
+            current = buckets.get(user_id)
+            if current is None or current.start < start:
+                if current is not None:
+                    self._close(name, current)
+                current = buckets[user_id] = Aggregate(user_id, start)
+            elif current.start > start:
+                # Late reading for an already-closed bucket: write a partial
+                late = Aggregate(user_id, start)
+                late.add(reading)
+                self._close(name, late)
+                continue
+            current.add(reading)
+
+        self._added += 1
+        if self._added % self.idle_close_every == 0:
+            self.close_idle(when)
+        if self._pending_count >= self.write_batch:
+            self.flush_pending()
+        elif self.durable and time.monotonic() - self._persisted_at >= self.persist_interval:
+            self._write()
+
+    def add_many(self, readings: Iterable[Dict]) -> int:
+        count = 0
+        for reading in readings:
+            self.add(reading)
+            count += 1
+        return count
+
+    def _close(self, resolution: str, aggregate: Aggregate):
+        path = rollup_path(self.data_dir, resolution, aggregate.start)
+        record = aggregate.to_record()
+        if self.durable:
+            record['flush'] = self._flush_seq + 1
+        self._pending.setdefault(path, []).append(encode_record(record))
+        self._pending_count += 1
+
+    def close_idle(self, now: datetime):
+        """Close open buckets that ended before ``now``"""
+        elapsed = int((naive_local(now) - _EPOCH).total_seconds())
+        for name, (seconds, _) in RESOLUTIONS.items():
+            buckets = self.open[name]
+            for user_id in [u for u, a in buckets.items() if a.start + seconds <= elapsed]:
+                self._close(name, buckets.pop(user_id))
+
+    def flush_pending(self):
+        """Append closed buckets to their files"""
+        if self._pending:
+            self._write()
+
+    def _write(self):
+        """Append queued aggregates; a durable store saves its state first
+
+        The saved state holds everything not yet in a file, plus each
+        file's size before the append, so recovery can finish an append
+        that a crash interrupted without writing any line twice.
+        """
+        if self.durable:
+            self._flush_seq += 1
+            self._save_state()
+        for path, lines in self._pending.items():
+            _append_lines(path, lines, sync=self.durable)
+        self._pending.clear()
+        self._pending_count = 0
+
+    def _state_path(self) -> str:
+        return os.path.join(self.data_dir, STATE_FILE)
+
+    def _save_state(self):
+        state = {
+            'flush': self._flush_seq,
+            'sizes': {path: _size(path) for path in self._pending},
+            'pending': {path: [line.decode('utf-8') for line in lines] for path, lines in self._pending.items()},
+            'open': {name: [aggregate.to_record() for aggregate in buckets.values()]
+                     for name, buckets in self.open.items()}
+        }
+        temporary = self._state_path() + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(json_codec.dumps(state))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self._state_path())
+        self._persisted_at = time.monotonic()
+
+    def _recover(self):
+        """Restore open buckets and finish the last append after a crash"""
+        try:
+            state = json_codec.load(self._state_path())
+        except FileNotFoundError:
+            return
+        self._flush_seq = state['flush']
+        for path, lines in state['pending'].items():
+            written = _count_flushed(path, state['sizes'][path], self._flush_seq)
+            if written < len(lines):
+                _append_lines(path, [line.encode('utf-8') for line in lines[written:]], sync=True)
+        for name, records in state['open'].items():
+            self.open[name] = {record['user_id']: Aggregate.from_record(record) for record in records}
+        self._save_state()  # Nothing pending any more
+
+    def close(self):
+        """Close every open bucket and write everything out"""
+        for name in RESOLUTIONS:
+            for aggregate in self.open[name].values():
+                self._close(name, aggregate)
+            self.open[name].clear()
+        if self.durable:
+            self._write()  # Also saves the now empty open buckets
+        else:
+            self.flush_pending()
+
+    def choose_resolution(self, start: datetime, end: datetime, max_points: int = 500) -> str:
+        """Finest resolution that covers the range in at most ``max_points`` buckets"""
+        span = max(0.0, (end - start).total_seconds())
+        for name, (seconds, _) in sorted(RESOLUTIONS.items(), key=lambda item: item[1][0]):
+            if span / seconds <= max_points:
+                return name
+        return max(RESOLUTIONS, key=lambda name: RESOLUTIONS[name][0])
+
+    def query(self, user_id: str, start: datetime, end: datetime,
+              resolution: Optional[str] = None, max_points: int = 500) -> Dict:
+        """Aggregated history of one user between start and end (inclusive)
+
+        Without an explicit ``resolution`` the finest one yielding at most
+        ``max_points`` buckets is used, so a week of 5-second readings
+        comes back as 168 hourly points rather than 120,960 rows.
+        """
+        start, end = naive_local(start), naive_local(end)
+        resolution = resolution or self.choose_resolution(start, end, max_points)
+        seconds = RESOLUTIONS[resolution][0]
+        first, last = bucket_start(start, seconds), bucket_start(end, seconds)
+
+        self.flush_pending()
+        merged: Dict[int, Aggregate] = {}
+        for aggregate in self._stored(resolution, first, last, user_id):
+            if first <= aggregate.start <= last:
+                _merge_into(merged, aggregate)
+        current = self.open[resolution].get(user_id)
+        if current is not None and first <= current.start <= last:
+            _merge_into(merged, current)
+
+        return {
+            'user_id': user_id,
+            'resolution': resolution,
+            'points': [merged[key].to_point() for key in sorted(merged)]
+        }
+
+    def _stored(self, resolution: str, first: int, last: int, user_id: str) -> Iterator[Aggregate]:
+        """A user's aggregates from every file whose partition overlaps [first, last]"""
+        seconds, key_format = RESOLUTIONS[resolution]
+        seen = set()
+        # Step through the range a bucket-sized stride at a time, at most daily
+        stride = max(seconds, 86400)
+        for start in range(first, last + stride, stride):
+            path = rollup_path(self.data_dir, resolution, min(start, last))
+            if path in seen:
+                continue
+            seen.add(path)
+            offsets = self._user_offsets(path).get(user_id)
+            if not offsets:
+                continue
+            with open(path, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    try:
+                        record = json_codec.loads(f.readline())
+                    except ValueError:
+                        continue  # A line torn by a crash, terminated on the next write
+                    yield Aggregate.from_record(record)
+
+    def _user_offsets(self, path: str) -> Dict[str, array]:
+        """user_id -> offsets of that user's lines in a rollup file, caught up to its end"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._offsets.pop(path, None)
+            return {}
+        cached = self._offsets.get(path)
+        if cached is None or cached[0] != stat.st_ino or cached[1] > stat.st_size:
+            cached = (stat.st_ino, 0, {})  # New, replaced or truncated: index from the start
+        inode, covered, users = cached
+        if covered < stat.st_size:
+            with open(path, 'rb') as f:
+                f.seek(covered)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # A torn last line is picked up once it is complete
+                    user_id = _line_user_id(line)
+                    if user_id is not None:
+                        offsets = users.get(user_id)
+                        if offsets is None:
+                            offsets = users[user_id] = array('q')
+                        offsets.append(covered)
+                    covered += len(line)
+        self._offsets[path] = (inode, covered, users)
+        self._offsets.move_to_end(path)
+        while len(self._offsets) > self.cached_files:
+            self._offsets.popitem(last=False)
+        return users
+
+def _line_user_id(line: bytes) -> Optional[str]:
+    match = _USER_ID_RE.search(line)
+    try:
+        if match:
+            return json_codec.loads(match.group(1))
+        return json_codec.loads(line).get('user_id')
+    except ValueError:
+        return None
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def _append_lines(path: str, lines: List[bytes], sync: bool = False):
+    with open(path, 'ab') as f:
+        if f.tell() > 0:
+            with open(path, 'rb') as check:
+                check.seek(-1, os.SEEK_END)
+                if check.read(1) != b'\n':
+                    f.write(b'\n')  # Terminate a line torn by a crash
+        f.write(b''.join(lines))
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+def _count_flushed(path: str, size: int, flush: int) -> int:
+    """Complete lines of write ``flush`` found after ``size`` bytes of a file"""
+    count = 0
+    try:
+        with open(path, 'rb') as f:
+            f.seek(size)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json_codec.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and record.get('flush') == flush:
+                    count += 1
+    except FileNotFoundError:
+        pass
+    return count
+
+def _merge_into(merged: Dict[int, Aggregate], aggregate: Aggregate):
+    existing = merged.get(aggregate.start)
+    if existing is None:
+        merged[aggregate.start] = copy = Aggregate(aggregate.user_id, aggregate.start)
+        copy.merge(aggregate)
+    else:
+        existing.merge(aggregate)
+
+def remove_rollups(data_dir: str) -> int:
+    """Delete every rollup file (and saved state), returning how many were removed"""
+    removed = 0
+    for name in os.listdir(data_dir):
+        if name.startswith(ROLLUP_PREFIX) and (name.endswith('.jsonl') or name == STATE_FILE):
+            os.remove(os.path.join(data_dir, name))
+            removed += 1
+    return removed
+
+def rebuild(data_dir: str) -> int:
+    """Recompute all rollups from the raw day partitions"""
+    remove_rollups(data_dir)
+    store = RollupStore(data_dir)
+    count = 0
+    for day in list_partition_days(data_dir):
+        for path in day_partitions(data_dir, day):
+            count += store.add_many(iter_partition(path))
+    store.close()
+    return count
+
+def main():
+    """Rebuild rollups from raw partitions or query a user's history"""
+    parser = argparse.ArgumentParser(description="Health reading rollups")
+    parser.add_argument('--data-dir', default='.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild', help="recompute rollups from the day partitions")
+    query = subparsers.add_parser('query', help="print a user's aggregated history")
+    query.add_argument('user_id')
+    query.add_argument('--start', type=datetime.fromisoformat, required=True)
+    query.add_argument('--end', type=datetime.fromisoformat, default=None)
+    query.add_argument('--resolution', choices=sorted(RESOLUTIONS), default=None)
+    query.add_argument('--max-points', type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        count = rebuild(args.data_dir)
+        print(f"📊 Rolled up {count:,} readings")
+    else:
+        result = RollupStore(args.data_dir).query(args.user_id, args.start, args.end or datetime.now(),
+                                                  args.resolution, args.max_points)
+        print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
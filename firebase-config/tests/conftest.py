@@ -0,0 +1,12 @@
+"""
+Test setup for the storage modules
+Puts firebase-config on sys.path, as running the scripts does
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.normpath(os.path.join(HERE, '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
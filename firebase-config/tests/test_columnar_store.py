@@ -0,0 +1,67 @@
+"""
+Tests for columnar storage
+Records must come back exactly as written, missing and null fields included
+"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+
+from columnar_store import ColumnarPartition, ColumnarWriter, records_to_columns, write_columnar
+from local_storage import naive_local
+
+RECORDS = [
+    {'timestamp': '2024-03-01T10:00:00', 'user_id': 'u1', 'heart_rate': 72, 'spo2': 98.5,
+     'temperature': 36.6, 'fall_detected': False, 'activity_level': 'resting',
+     'location': {'latitude': 28.6, 'longitude': 77.2}, 'battery_level': 80},
+    {'timestamp': '2024-03-01T10:00:01', 'user_id': 'u2', 'fall_detected': True},
+    {'timestamp': '2024-03-01T10:00:02', 'user_id': 'u1', 'heart_rate': 140, 'activity_level': 'active'},
+    {'user_id': 'u3', 'spo2': 91.0, 'battery_level': 5},
+]
+
+def _round_trip(tmp_path, records):
+    path = str(tmp_path / 'day.cols')
+    write_columnar(path, records_to_columns(records))
+    return list(ColumnarPartition(path).iter_records())
+
+def test_round_trip_returns_records_unchanged(tmp_path):
+    assert _round_trip(tmp_path, RECORDS) == RECORDS
+
+def test_explicit_none_is_treated_as_missing(tmp_path):
+    records = [{'timestamp': '2024-03-01T10:00:00', 'user_id': 'u1', 'heart_rate': None,
+                'spo2': None, 'fall_detected': None, 'activity_level': None, 'location': None}]
+    assert _round_trip(tmp_path, records) == [{'timestamp': '2024-03-01T10:00:00', 'user_id': 'u1'}]
+
+def test_aware_timestamps_are_stored_as_local_time(tmp_path):
+    aware = datetime(2024, 3, 1, 10, 0, tzinfo=timezone.utc)
+    records = _round_trip(tmp_path, [{'timestamp': aware.isoformat(), 'user_id': 'u1'}])
+    assert records[0]['timestamp'] == naive_local(aware).isoformat()
+
+def test_writer_keeps_nulls_missing(tmp_path):
+    path = str(tmp_path / 'batch.cols')
+    writer = ColumnarWriter(path)
+    writer.append({
+        'timestamp': np.array(['2024-03-01T10:00:00', None, '2024-03-01T10:00:02'], dtype=object),
+        'user_id': np.array(['u1', 'u2', 'u1'], dtype=object),
+        'activity_level': np.array(['walking', None, 'walking'], dtype=object),
+        'heart_rate': np.array([80, np.nan, 82]),
+        'spo2': np.array([97.0, 96.5, np.nan]),
+        'fall_detected': np.array([False, None, True], dtype=object),
+    })
+    writer.close()
+    partition = ColumnarPartition(path)
+    assert list(partition.iter_records()) == [
+        {'timestamp': '2024-03-01T10:00:00', 'user_id': 'u1', 'heart_rate': 80, 'spo2': 97.0,
+         'fall_detected': False, 'activity_level': 'walking'},
+        {'user_id': 'u2', 'spo2': 96.5},
+        {'timestamp': '2024-03-01T10:00:02', 'user_id': 'u1', 'heart_rate': 82,
+         'fall_detected': True, 'activity_level': 'walking'},
+    ]
+    assert partition.meta['activity_levels'] == ['walking']
+
+def test_select_accepts_aware_bounds(tmp_path):
+    path = str(tmp_path / 'day.cols')
+    write_columnar(path, records_to_columns(RECORDS))
+    partition = ColumnarPartition(path)
+    since = datetime(2024, 3, 1, 10, 0, 1).astimezone()
+    assert partition.select(since=since).tolist() == [1, 2]
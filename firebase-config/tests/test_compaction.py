@@ -0,0 +1,104 @@
+"""
+Tests for compaction and retention
+Cold partitions must round-trip, spilled or not, and open partitions must never be rewritten
+"""
+
+import os
+import random
+import sys
+from datetime import date
+
+import pytest
+
+import compaction
+from compaction import ColdPartition, Compactor, RetentionPolicy, write_cold
+from firebase_setup import FirebaseHealthDB
+import local_storage
+from local_storage import COLD_SUFFIX, RecentIndex, partition_path
+
+def _records(count=300, users=7, seed=1):
+    rng = random.Random(seed)
+    return [{'timestamp': f"2024-03-01T10:{i // 60:02d}:{i % 60:02d}", 'user_id': f"u{rng.randrange(users)}",
+             'heart_rate': rng.randint(50, 130), 'spo2': round(rng.uniform(90, 100), 1)}
+            for i in range(count)]
+
+def _by_user(records):
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record['user_id'], []).append(record)
+    return grouped
+
+@pytest.mark.parametrize('spill_bytes', [1 << 30, 512, 1])
+def test_cold_partition_round_trip(tmp_path, spill_bytes):
+    records = _records()
+    path = str(tmp_path / 'day.cold')
+    assert write_cold(path, iter(records), block_size=1024, spill_bytes=spill_bytes) == len(records)
+    assert sorted(os.listdir(tmp_path)) == ['day.cold']  # Spilled runs are removed
+
+    partition = ColdPartition(path)
+    expected = _by_user(records)
+    assert len(partition) == len(records) and len(partition.blocks) > 1
+    assert list(partition) == [record for user in sorted(expected) for record in expected[user]]
+    for user_id, user_records in expected.items():
+        assert list(partition.records([user_id])) == user_records
+        assert partition.recent(user_id, 3) == user_records[-3:]
+
+def test_spilled_and_in_memory_partitions_are_identical(tmp_path):
+    records = _records(seed=2)
+    write_cold(str(tmp_path / 'memory.cold'), records, block_size=1024)
+    write_cold(str(tmp_path / 'spilled.cold'), records, block_size=1024, spill_bytes=700)
+    with open(tmp_path / 'memory.cold', 'rb') as memory, open(tmp_path / 'spilled.cold', 'rb') as spilled:
+        assert memory.read() == spilled.read()
+
+def test_raw_readings_kept_forever_allow_minute_rollup_expiry(monkeypatch, tmp_path):
+    assert RetentionPolicy(7, None, 365).minute_rollup_days == 365
+    with pytest.raises(ValueError):
+        RetentionPolicy(7, 90, 30)
+    monkeypatch.setattr(sys, 'argv', ['compaction', '--data-dir', str(tmp_path), '--raw-days', '0', '--dry-run'])
+    compaction.main()
+    monkeypatch.setattr(sys, 'argv', ['compaction', '--data-dir', str(tmp_path), '--minute-rollup-days', '30'])
+    with pytest.raises(SystemExit):
+        compaction.main()
+
+def test_background_compaction_skips_the_open_writer(tmp_path):
+    db = FirebaseHealthDB(data_dir=str(tmp_path), rollups=False)
+    db._append_record('20240301', {'timestamp': '2024-03-01T10:00:00', 'user_id': 'u1', 'heart_rate': 70})
+    db._append_record('20240302', {'timestamp': '2024-03-02T10:00:00', 'user_id': 'u1', 'heart_rate': 80})
+    policy = RetentionPolicy(hot_days=1, raw_days=None, minute_rollup_days=None)
+
+    db.start_compaction(policy).stop()  # One run, with 20240302 still being written
+    assert os.path.exists(partition_path(str(tmp_path), '20240301', COLD_SUFFIX))
+    assert not os.path.exists(partition_path(str(tmp_path), '20240302', COLD_SUFFIX))
+    assert [record['heart_rate'] for record in db.get_recent_data('u1')] == [70, 80]
+
+    db.close()
+    assert db.compact(policy)['compacted'] == ['20240302']
+    assert [record['heart_rate'] for record in db.get_recent_data('u1')] == [70, 80]
+
+def test_on_change_sees_every_rewritten_day(tmp_path):
+    for day in ('20240301', '20240302'):
+        write_cold(partition_path(str(tmp_path), day, COLD_SUFFIX), _records(20))
+    with open(partition_path(str(tmp_path), '20240303'), 'w') as f:
+        f.write('{"timestamp":"2024-03-03T10:00:00","user_id":"u1"}\n')
+    changed = []
+    policy = RetentionPolicy(hot_days=1, raw_days=2, minute_rollup_days=None)
+    summary = Compactor(str(tmp_path), policy, on_change=changed.append).run(date(2024, 3, 4))
+    assert summary['expired'] == ['20240301', '20240302']
+    assert summary['compacted'] == ['20240303']
+    assert changed == ['20240301', '20240302', '20240303']
+
+def test_reads_racing_a_compaction_fall_back_to_the_cold_file(monkeypatch, tmp_path):
+    records = _records(40)
+    jsonl_path = partition_path(str(tmp_path), '20240301')
+    with open(jsonl_path, 'wb') as f:
+        f.writelines(local_storage.encode_record(record) for record in records)
+    index = RecentIndex(str(tmp_path))
+    expected = [record for record in records if record['user_id'] == 'u1'][-3:]
+    assert index.recent('u1', 3) == expected
+
+    policy = RetentionPolicy(hot_days=1, raw_days=None, minute_rollup_days=None)
+    Compactor(str(tmp_path), policy).compact_day('20240301')
+    # The raw file passed the existence check just before compaction deleted it
+    exists = os.path.exists
+    monkeypatch.setattr(local_storage.os.path, 'exists', lambda path: path == jsonl_path or exists(path))
+    assert index.recent('u1', 3) == expected
@@ -0,0 +1,57 @@
+"""
+Tests for FirebaseHealthDB local storage
+Readings are appended one line each, and both storage formats read back the same
+"""
+
+import logging
+
+import pytest
+
+from firebase_setup import FirebaseHealthDB
+from local_storage import JSONL_SUFFIX, partition_day, partition_path
+
+def _readings(count=6):
+    return [{'timestamp': f"2024-03-01T10:00:{i:02d}", 'user_id': f"u{i % 2}", 'heart_rate': 60 + i}
+            for i in range(count)]
+
+def test_each_reading_is_one_appended_line(tmp_path):
+    db = FirebaseHealthDB(data_dir=str(tmp_path), rollups=False, fsync_every=0, fsync_interval_ms=0)
+    for reading in _readings():
+        assert db.save_health_data(reading)
+    db.close()
+    with open(partition_path(str(tmp_path), partition_day(), JSONL_SUFFIX), 'rb') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 6 and lines[0].startswith(b'{')
+
+@pytest.mark.parametrize('storage_format', ['jsonl', 'json'])
+def test_recent_data_is_the_same_for_both_formats(tmp_path, storage_format):
+    db = FirebaseHealthDB(data_dir=str(tmp_path), storage_format=storage_format, rollups=False)
+    readings = _readings()
+    for reading in readings:
+        db.save_health_data(reading)
+    assert db.get_recent_data('u1', limit=2) == [readings[3], readings[5]]
+    db.close()
+
+def test_torn_final_line_is_skipped_after_a_crash(tmp_path):
+    db = FirebaseHealthDB(data_dir=str(tmp_path), rollups=False)
+    readings = _readings(4)
+    for reading in readings:
+        db.save_health_data(reading)
+    db.close()
+    with open(partition_path(str(tmp_path), partition_day(), JSONL_SUFFIX), 'ab') as f:
+        f.write(b'{"timestamp":"2024-03-01T10:00:09","user_id":"u1","hea')
+    reopened = FirebaseHealthDB(data_dir=str(tmp_path), rollups=False)
+    assert reopened.get_recent_data('u1') == [readings[1], readings[3]]
+
+def test_unknown_storage_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        FirebaseHealthDB(data_dir=str(tmp_path), storage_format='csv')
+
+def test_save_log_is_formatted_only_when_emitted(tmp_path, caplog):
+    db = FirebaseHealthDB(data_dir=str(tmp_path), rollups=False, fsync_every=0, fsync_interval_ms=0)
+    with caplog.at_level(logging.DEBUG, logger='health_monitor.storage'):
+        db.save_health_data(_readings(1)[0])
+    db.close()
+    saved, = [record for record in caplog.records if record.msg.startswith("💾")]
+    assert saved.msg == "💾 Health data saved to %s"
+    assert saved.getMessage() == f"💾 Health data saved to {partition_path(str(tmp_path), partition_day(), JSONL_SUFFIX)}"
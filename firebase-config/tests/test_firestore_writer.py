@@ -0,0 +1,65 @@
+"""
+Tests for batched Firestore writes
+Retries must be idempotent, limited to transient errors and kept off the caller's thread
+"""
+
+import time
+
+from firestore_writer import FakeFirestoreClient, FirestoreBatchWriter
+
+def _documents(count):
+    return [{'user_id': f"u{i % 3}", 'heart_rate': 60 + i} for i in range(count)]
+
+def _writer(client, **options):
+    options.setdefault('backoff_base', 0.001)
+    return FirestoreBatchWriter(client, 'readings', **options)
+
+def test_documents_are_committed_in_batches():
+    client = FakeFirestoreClient()
+    with _writer(client, max_batch_size=10, flush_interval=None) as writer:
+        for document in _documents(25):
+            writer.add(document)
+    assert len(client.collections['readings']) == 25
+    assert client.commits == 3
+    assert writer.stats['written'] == 25
+
+def test_lost_response_is_retried_without_duplicates():
+    client = FakeFirestoreClient(lose_responses=1)
+    with _writer(client, max_batch_size=10, flush_interval=None) as writer:
+        for document in _documents(10):
+            writer.add(document)
+    assert len(client.collections['readings']) == 10
+    assert writer.stats['retries'] == 1
+    assert writer.stats['written'] == 10
+
+def test_transient_errors_are_retried():
+    client = FakeFirestoreClient(fail_commits=2)
+    with _writer(client, flush_interval=None) as writer:
+        writer.add({'user_id': 'u1'})
+    assert writer.stats['retries'] == 2
+    assert list(client.collections['readings'].values()) == [{'user_id': 'u1'}]
+
+def test_permanent_errors_are_not_retried():
+    class Rejecting(FakeFirestoreClient):
+        def commit(self, writes):
+            self.commits += 1
+            raise ValueError("invalid document")
+
+    client = Rejecting()
+    with _writer(client, flush_interval=None, max_failed=3) as writer:
+        for document in _documents(5):
+            writer.add(document)
+    assert client.commits == 1
+    assert writer.stats['retries'] == 0
+    assert writer.stats['failed'] == 5
+    assert list(writer.failed) == _documents(5)[-3:]  # Bounded to the newest max_failed
+
+def test_add_does_not_wait_for_slow_commits():
+    client = FakeFirestoreClient(commit_latency=0.3)
+    writer = _writer(client, max_batch_size=5, flush_interval=None)
+    started = time.perf_counter()
+    for document in _documents(10):
+        writer.add(document)
+    assert time.perf_counter() - started < 0.2
+    writer.close()
+    assert len(client.collections['readings']) == 10
@@ -0,0 +1,69 @@
+"""
+Tests for the hospital spatial index
+Grid lookups must agree with a brute-force haversine scan, including across the antimeridian
+"""
+
+import random
+
+import pytest
+
+from hospital_index import HospitalIndex, haversine_km
+
+def _hospitals(count, seed=3, lat=(-60, 60), lng=(-180, 180)):
+    rng = random.Random(seed)
+    return [{'hospital_id': f"h{i}", 'name': f"Hospital {i}",
+             'coordinates': {'latitude': rng.uniform(*lat), 'longitude': rng.uniform(*lng)}}
+            for i in range(count)]
+
+def _brute_force(hospitals, latitude, longitude, k=None, radius_km=None):
+    distances = sorted(
+        (float(haversine_km(latitude, longitude, h['coordinates']['latitude'], h['coordinates']['longitude'])),
+         h['hospital_id'])
+        for h in hospitals)
+    if radius_km is not None:
+        distances = [entry for entry in distances if entry[0] <= radius_km]
+    return [hospital_id for _, hospital_id in distances[:k]]
+
+@pytest.mark.parametrize('cell_km', [25.0, 500.0])
+def test_nearest_matches_brute_force(cell_km):
+    hospitals = _hospitals(400)
+    index = HospitalIndex.from_records(hospitals, cell_km=cell_km, capacity=16)
+    rng = random.Random(5)
+    queries = [(rng.uniform(-70, 70), rng.uniform(-180, 180)) for _ in range(40)]
+    for latitude, longitude in queries:
+        got = index.nearest(latitude, longitude, k=3)
+        assert [hospital_id for hospital_id, _ in got] == _brute_force(hospitals, latitude, longitude, k=3)
+    many = index.nearest_many(*zip(*queries), k=3)
+    assert many == [index.nearest(latitude, longitude, k=3) for latitude, longitude in queries]
+
+def test_neighbours_across_the_antimeridian():
+    index = HospitalIndex.from_records([
+        {'id': 'east', 'coordinates': [0.0, 179.9]},
+        {'id': 'west', 'coordinates': [0.0, -179.9]},
+        {'id': 'far', 'coordinates': [0.0, 170.0]},
+    ])
+    matches = index.nearest(0.0, -179.95, k=2)
+    assert [hospital_id for hospital_id, _ in matches] == ['west', 'east']
+    assert matches[1][1] == pytest.approx(16.7, abs=0.1)
+
+def test_within_and_max_km():
+    hospitals = _hospitals(300, lat=(27, 30), lng=(76, 79))
+    index = HospitalIndex.from_records(hospitals, cell_km=20.0)
+    found = [hospital_id for hospital_id, _ in index.within(28.6, 77.2, 50.0)]
+    assert found == _brute_force(hospitals, 28.6, 77.2, radius_km=50.0)
+    assert all(km <= 10.0 for _, km in index.nearest(28.6, 77.2, k=50, max_km=10.0))
+
+def test_moves_and_removals_are_reflected():
+    index = HospitalIndex.from_records([{'id': 'a', 'coordinates': [28.6, 77.2]},
+                                        {'id': 'b', 'coordinates': [28.7, 77.3]}])
+    index.upsert({'id': 'a', 'coordinates': [40.7, -74.0]})
+    assert index.nearest(28.6, 77.2, k=1)[0][0] == 'b'
+    assert index.remove('b') and not index.remove('b')
+    assert index.nearest(28.6, 77.2, k=3)[0][0] == 'a' and len(index) == 1
+    assert not index.upsert({'id': 'c'})
+
+def test_readings_without_location_get_no_hospitals():
+    index = HospitalIndex.from_records(_hospitals(20, lat=(28, 29), lng=(77, 78)))
+    results = index.for_readings([{'location': {'latitude': 28.5, 'longitude': 77.5}}, {'user_id': 'u1'}], k=2)
+    assert len(results[0]) == 2 and results[1] == []
+    assert results[0][0]['distance_km'] <= results[0][1]['distance_km']
@@ -0,0 +1,43 @@
+"""
+Tests for the JSON codec
+Both backends must write the same bytes, non-finite floats included
+"""
+
+import importlib.util
+
+import numpy as np
+import pytest
+
+import json_codec
+
+VALUE = {'heart_rate': 72, 'spo2': float('nan'), 'window': [1.5, float('inf'), -float('inf')],
+         'location': {'latitude': np.float64('nan'), 'longitude': 77.2},
+         'columns': np.array([np.nan, 2.0]), 'activity_level': 'résting'}
+
+def _backend(monkeypatch, name):
+    monkeypatch.setenv('HEALTH_JSON', name)
+    spec = importlib.util.spec_from_file_location(f"json_codec_{name}", json_codec.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_stdlib_writes_non_finite_floats_as_null(monkeypatch):
+    codec = _backend(monkeypatch, 'stdlib')
+    assert codec.BACKEND == 'stdlib'
+    assert codec.loads(codec.dumps(VALUE)) == {
+        'heart_rate': 72, 'spo2': None, 'window': [1.5, None, None],
+        'location': {'latitude': None, 'longitude': 77.2},
+        'columns': [None, 2.0], 'activity_level': 'résting'}
+
+def test_backends_write_the_same_bytes(monkeypatch):
+    pytest.importorskip('orjson')
+    stdlib = _backend(monkeypatch, 'stdlib')
+    fast = _backend(monkeypatch, 'orjson')
+    assert fast.BACKEND == 'orjson'
+    assert fast.dumps(VALUE) == stdlib.dumps(VALUE)
+    assert fast.encode_line(VALUE) == stdlib.encode_line(VALUE)
+
+def test_bare_nan_from_older_files_still_parses(monkeypatch):
+    for name in ('stdlib', 'orjson'):
+        codec = _backend(monkeypatch, name)
+        assert codec.loads(b'{"spo2":NaN}')['spo2'] != codec.loads(b'{"spo2":NaN}')['spo2']
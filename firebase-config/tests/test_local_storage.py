@@ -0,0 +1,86 @@
+"""
+Tests for local day-partitioned storage
+Recent-N lookups must stay bounded in days walked and days cached
+"""
+
+import os
+import time
+
+import json_codec
+from local_storage import (INDEX_SUFFIX, JSONL_SUFFIX, LEGACY_SUFFIX, JsonlDayWriter,
+                           RecentIndex, partition_path)
+
+def _write_day(data_dir, day, records):
+    writer = JsonlDayWriter(partition_path(data_dir, day, JSONL_SUFFIX), fsync_every=0, fsync_interval_ms=0)
+    for record in records:
+        writer.append(record)
+    writer.close()
+
+def _reading(user_id, day, i):
+    return {'user_id': user_id, 'timestamp': f"{day[:4]}-{day[4:6]}-{day[6:]}T00:00:{i:02d}", 'heart_rate': 60 + i}
+
+def test_recent_walks_back_across_days_in_order(tmp_path):
+    for day in ('20240101', '20240102', '20240103'):
+        _write_day(str(tmp_path), day, [_reading('u1', day, i) for i in range(3)])
+    index = RecentIndex(str(tmp_path))
+    recent = index.recent('u1', limit=5)
+    assert [r['timestamp'] for r in recent] == [
+        '2024-01-02T00:00:01', '2024-01-02T00:00:02',
+        '2024-01-03T00:00:00', '2024-01-03T00:00:01', '2024-01-03T00:00:02']
+
+def test_lookback_limit_and_cache_bound(tmp_path):
+    days = [f"202401{d:02d}" for d in range(1, 11)]
+    for day in days:
+        _write_day(str(tmp_path), day, [_reading('u1', day, 0)])
+    index = RecentIndex(str(tmp_path), max_days=4, cached_days=2)
+    assert len(index.recent('u1', limit=100)) == 4
+    assert index.recent('unknown', limit=10) == []
+    assert list(index._days) == days[-4:-2][::-1]  # The oldest days walked were used last
+    assert len(index._days) <= 2
+
+def test_scanned_day_gets_a_sidecar(tmp_path):
+    _write_day(str(tmp_path), '20240101', [_reading('u1', '20240101', i) for i in range(3)])
+    sidecar = partition_path(str(tmp_path), '20240101', INDEX_SUFFIX)
+    assert not os.path.exists(sidecar)
+    RecentIndex(str(tmp_path)).recent('u1')
+    assert os.path.exists(sidecar)
+
+def test_active_day_is_never_evicted(tmp_path):
+    index = RecentIndex(str(tmp_path), cached_days=1)
+    path = partition_path(str(tmp_path), '20240105', JSONL_SUFFIX)
+    writer = JsonlDayWriter(path, fsync_every=0, fsync_interval_ms=0)
+    index.day_index('20240105')
+    index.record('20240105', 'u1', writer.append(_reading('u1', '20240105', 0)))
+    for day in ('20240101', '20240102'):
+        _write_day(str(tmp_path), day, [_reading('u1', day, 0)])
+        index.day_index(day)
+    assert '20240105' in index._days
+    writer.flush()
+    assert index.recent('u1', limit=1)[0]['timestamp'] == '2024-01-05T00:00:00'
+    writer.close()
+
+def test_legacy_file_is_parsed_once_per_version(tmp_path, monkeypatch):
+    import local_storage
+    path = partition_path(str(tmp_path), '20240101', LEGACY_SUFFIX)
+    json_codec.dump([_reading('u1', '20240101', i) for i in range(4)], path)
+    index = RecentIndex(str(tmp_path))
+    assert len(index.recent('u1', limit=3)) == 3
+
+    parsed = []
+    original = local_storage.iter_partition
+    monkeypatch.setattr(local_storage, 'iter_partition', lambda p: parsed.append(p) or original(p))
+    assert len(index.recent('u1', limit=3)) == 3
+    assert parsed == []
+
+def test_idle_writer_syncs_on_timer(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.append(fd))
+    writer = JsonlDayWriter(str(tmp_path / 'day.jsonl'), fsync_every=0, fsync_interval_ms=20)
+    writer.append({'user_id': 'u1'})
+    assert synced == []
+    deadline = time.monotonic() + 2
+    while not synced and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert synced
+    assert writer._pending == 0
+    writer.close()
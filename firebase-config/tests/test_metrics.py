@@ -0,0 +1,83 @@
+"""
+Tests for stage metrics and structured logging
+Timers must count calls, items and errors, and exports must follow the Prometheus text format
+"""
+
+import json
+import logging
+import time
+
+import pytest
+
+import metrics
+from metrics import Histogram, MetricsRegistry, SamplingProfiler
+
+def _stage_count(stage):
+    return metrics.STAGE_SECONDS.labels(stage).read()[2]
+
+def test_timed_records_calls_items_and_errors():
+    @metrics.timed('test_stage', items=len)
+    def work(values):
+        if values is None:
+            raise ValueError("no values")
+        return values
+
+    before = _stage_count('test_stage')
+    work([1, 2, 3])
+    with pytest.raises(ValueError):
+        work(None)
+    assert _stage_count('test_stage') == before + 2
+    samples = {(name, tuple(labels.items())): value for name, labels, value in metrics.STAGE_ITEMS.samples()}
+    assert samples[('health_stage_items_total', (('stage', 'test_stage'),))] >= 3
+    assert ('stage', 'test_stage') in [next(iter(labels.items())) for _, labels, _ in metrics.STAGE_ERRORS.samples()]
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram('latency', 'test', buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0, 10.0):
+        histogram.observe(value)
+    counts, total, count = histogram.labels().read()
+    assert counts == [1, 2, 1, 1] and count == 5 and total == pytest.approx(16.5)
+    assert 1.0 <= histogram.quantile(0.5) <= 2.0
+    assert histogram.quantile(0.5, 'missing') is None
+
+def test_prometheus_export_is_cumulative_and_escaped():
+    registry = MetricsRegistry()
+    registry.counter('events_total', 'Events', ('kind',)).inc('a "quoted"\nkind', amount=2)
+    registry.histogram('wait_seconds', 'Waits', buckets=(0.1, 1.0)).observe(0.5)
+    text = registry.to_prometheus()
+    assert 'events_total{kind="a \\"quoted\\"\\nkind"} 2' in text
+    assert 'wait_seconds_bucket{le="0.1"} 0' in text
+    assert 'wait_seconds_bucket{le="1.0"} 1' in text
+    assert 'wait_seconds_bucket{le="+Inf"} 1' in text
+    assert registry.snapshot()['histograms']['wait_seconds']['total']['count'] == 1
+
+def test_conflicting_registration_is_rejected():
+    registry = MetricsRegistry()
+    assert registry.counter('x', 'X') is registry.counter('x', 'X')
+    with pytest.raises(ValueError):
+        registry.gauge('x', 'X')
+
+def test_queue_gauge_reads_depth_at_export_time():
+    depth = [3]
+    metrics.track_queue('test_queue', lambda: depth[0])
+    depth[0] = 7
+    assert 'health_queue_depth{queue="test_queue"} 7' in metrics.REGISTRY.to_prometheus()
+    metrics.track_queue('test_queue', None)
+    assert 'queue="test_queue"' not in metrics.REGISTRY.to_prometheus()
+
+def test_json_log_lines_carry_extra_fields():
+    record = logging.LogRecord('health_monitor.test', logging.INFO, __file__, 1, "saved %d", (3,), None)
+    record.fields = {'readings': 3}
+    entry = json.loads(metrics.JsonFormatter().format(record))
+    assert entry['message'] == 'saved 3' and entry['readings'] == 3 and entry['level'] == 'info'
+
+def test_profiler_can_be_read_while_it_samples():
+    profiler = SamplingProfiler(interval=0.0005, depth=2).start()
+    try:
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            hot = profiler.top(5)
+    finally:
+        profiler.stop()
+    assert profiler.total > 0 and hot
+    assert sum(entry['share'] for entry in profiler.top(len(profiler.samples))) == pytest.approx(1.0, abs=0.01)
@@ -0,0 +1,34 @@
+"""
+Tests for range queries over stored readings
+Batches built from stored records must keep numeric columns numeric
+"""
+
+import numpy as np
+
+from range_query import records_to_batch
+
+RECORDS = [
+    {'timestamp': '2024-03-01T10:00:00', 'user_id': 'u1', 'heart_rate': 72, 'spo2': 98.5,
+     'temperature': 98.6, 'fall_detected': False, 'activity_level': 'resting',
+     'location': {'latitude': 28.6, 'longitude': 77.2}, 'battery_level': 80},
+    {'timestamp': '2024-03-01T10:00:01', 'user_id': 'u2', 'fall_detected': True},
+    {'timestamp': '2024-03-01T10:00:02', 'user_id': 'u1', 'heart_rate': None, 'spo2': 91.0},
+]
+
+def test_missing_numbers_become_nan():
+    batch = records_to_batch(RECORDS)
+    assert batch['heart_rate'].dtype == float
+    assert batch['heart_rate'][0] == 72 and np.isnan(batch['heart_rate'][1:]).all()
+    assert batch['battery_level'].dtype == float and np.isnan(batch['battery_level'][1])
+    assert batch['fall_detected'].tolist() == [False, True, False]
+    assert np.isnan(batch['latitude'][1])
+    assert batch['user_id'].tolist() == ['u1', 'u2', 'u1']
+
+def test_complete_columns_keep_their_dtype():
+    batch = records_to_batch(RECORDS[:1])
+    assert batch['heart_rate'].dtype.kind == 'i'
+    assert batch['heart_rate'].tolist() == [72]
+
+def test_batch_with_gaps_is_searchable():
+    batch = records_to_batch(RECORDS)
+    np.searchsorted([60.0, 100.0], batch['heart_rate'])
@@ -0,0 +1,91 @@
+"""
+Tests for the rollup store
+Queries read one user's buckets, and a durable store survives a crash without double counting
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import rollup_store
+from rollup_store import STATE_FILE, RollupStore, rollup_path
+
+START = datetime(2024, 3, 1, 10, 0)
+
+def _reading(user_id, minutes, heart_rate=70):
+    return {'user_id': user_id, 'timestamp': (START + timedelta(minutes=minutes)).isoformat(),
+            'heart_rate': heart_rate}
+
+def _counts(store, user_id, resolution='1m'):
+    result = store.query(user_id, START, START + timedelta(hours=2), resolution)
+    return [point['heart_rate']['count'] for point in result['points']]
+
+def test_query_merges_stored_and_open_buckets(tmp_path):
+    store = RollupStore(str(tmp_path), write_batch=1)
+    for minutes in (0, 0, 1, 2):
+        store.add(_reading('u1', minutes))
+    assert _counts(store, 'u1') == [2, 1, 1]
+    store.add(_reading('u1', 0, heart_rate=90))  # Late partial for a written bucket
+    points = store.query('u1', START, START + timedelta(hours=2), '1m')['points']
+    assert points[0]['heart_rate'] == {'min': 70, 'max': 90, 'mean': 76.67, 'count': 3}
+
+def test_query_reads_only_the_users_lines(tmp_path, monkeypatch):
+    store = RollupStore(str(tmp_path), write_batch=1)
+    for minutes in range(30):
+        for user in range(20):
+            store.add(_reading(f"u{user}", minutes))
+    store.close()
+    parsed = []
+    original = rollup_store.Aggregate.from_record
+    monkeypatch.setattr(rollup_store.Aggregate, 'from_record',
+                        classmethod(lambda cls, record: parsed.append(record['user_id']) or original(record)))
+    assert _counts(store, 'u7') == [1] * 30
+    assert set(parsed) == {'u7'}
+
+def test_aware_timestamps_use_local_time(tmp_path):
+    store = RollupStore(str(tmp_path))
+    aware = START.astimezone(timezone.utc)
+    store.add({'user_id': 'u1', 'timestamp': aware.isoformat(), 'heart_rate': 70})
+    store.add(_reading('u1', 0))
+    assert _counts(store, 'u1') == [2]
+    assert _counts(RollupStore(str(tmp_path)), 'u1') == []  # Not yet written
+
+def test_durable_store_recovers_open_buckets(tmp_path):
+    store = RollupStore(str(tmp_path), write_batch=2, durable=True, persist_interval=0)
+    for minutes in range(6):
+        store.add(_reading('u1', minutes))
+    # Crash: the store is dropped without close(), holding minute 5 open and minute 4 queued
+    recovered = RollupStore(str(tmp_path), durable=True)
+    recovered.add(_reading('u1', 5))
+    assert _counts(recovered, 'u1') == [1, 1, 1, 1, 1, 2]
+    recovered.close()
+    final = RollupStore(str(tmp_path), durable=True)
+    assert _counts(final, 'u1', '1h') == [7]
+    assert final.open == {'1m': {}, '1h': {}, '1d': {}}
+
+def test_interrupted_append_is_finished_once(tmp_path):
+    store = RollupStore(str(tmp_path), write_batch=10 ** 6, durable=True)
+    for minutes in range(10):
+        store.add(_reading('u1', minutes))
+    store.close_idle(START + timedelta(days=1))
+    pending = {path: list(lines) for path, lines in store._pending.items()}
+    store._flush_seq += 1
+    store._save_state()
+    # Crash halfway through the append: half the minute lines, the last one torn
+    path = rollup_path(str(tmp_path), '1m', int((START - datetime(1970, 1, 1)).total_seconds()))
+    lines = pending[path]
+    with open(path, 'wb') as f:
+        f.write(b''.join(lines[:4]) + lines[4][:10])
+
+    recovered = RollupStore(str(tmp_path), durable=True)
+    assert _counts(recovered, 'u1') == [1] * 10
+    assert sum(_counts(recovered, 'u1', '1h')) == 10
+    with open(os.path.join(str(tmp_path), STATE_FILE)) as f:
+        assert json.load(f)['pending'] == {}
+
+def test_resolution_is_the_finest_within_max_points(tmp_path):
+    store = RollupStore(str(tmp_path))
+    assert store.choose_resolution(START, START + timedelta(hours=8)) == '1m'
+    assert store.choose_resolution(START, START + timedelta(weeks=1)) == '1h'
+    assert store.choose_resolution(START, START + timedelta(days=30)) == '1d'
+    assert store.choose_resolution(START, START + timedelta(days=30), max_points=1000) == '1h'